@@ -1,15 +1,20 @@
 """Application factory and initialization for the SmartQ Flask app.
 
 This module exposes `create_app` which constructs and configures the Flask
-application using the provided configuration class. It also ensures the
-database tables exist and creates an initial super-admin user when the
-database is empty.
+application using the provided configuration class. It creates the
+database tables on a fresh database (stamping it with the latest
+migration; existing databases are upgraded with `flask db upgrade`) and
+creates an initial super-admin user when none exists.
 """
 
+import os
+
 from flask import Flask
-from flask_migrate import Migrate
+from flask_migrate import Migrate, stamp
 from config import Config
 from app.models import db
+from app import auth, display, lookups, metrics, notifications, state
+from app.cli import register_commands
 
 migrate = Migrate()
 
@@ -28,7 +33,15 @@ def create_app(config_class=Config):
 
     # Initialize extensions
     db.init_app(app)
-    migrate.init_app(app, db)
+    migrate.init_app(app, db, render_as_batch=True,
+                     directory=os.path.join(os.path.dirname(app.root_path), 'migrations'))
+    metrics.init_app(app)
+    state.init_app(app)
+    auth.init_app(app)
+    display.init_app(app)
+    lookups.init_app(app)
+    notifications.init_app(app)
+    register_commands(app)
 
     # Register blueprints
     from app.routes import client, staff, admin, super_admin
@@ -78,9 +91,11 @@ def create_app(config_class=Config):
             </html>
         '''
 
-    # Create tables
+    # Create tables on a fresh database and mark it as fully migrated
     with app.app_context():
-        db.create_all()
+        if not db.inspect(db.engine).get_table_names():
+            db.create_all()
+            stamp()
         create_initial_data()
 
     return app
@@ -97,7 +112,7 @@ def create_initial_data():
     from app.models import User
 
     # Check if super admin exists
-    super_admin = User.query.filter_by(role='super_admin').first()
+    super_admin = db.session.query(User.id).filter_by(role='super_admin').first()
     if not super_admin:
         admin = User(
             username='superadmin',
@@ -0,0 +1,195 @@
+"""Bookable time slots per service (appointment / virtual queue mode).
+
+Each service's opening hours (`APPOINTMENT_HOURS`) are cut into slots of
+`APPOINTMENT_SLOT_MINUTES`. A slot offers `APPOINTMENT_SHARE` of what the
+service can serve in that time, measured by its wait estimator: the
+interval between completions (`ServiceWaitEstimate.ewma_interval_seconds`,
+which reflects how many counters usually serve it) or, before the service
+has been busy, the time per client divided by the active staff. The rest
+of the throughput stays free for walk-ins.
+
+A slot's `ServiceSlot` row is created by its first booking, with the
+capacity of that moment, and a booking is admitted by::
+
+    UPDATE service_slots SET booked = booked + 1
+    WHERE service_id = ? AND starts_at = ? AND booked < capacity
+
+which the database applies atomically, so concurrent bookings can never
+overbook a slot.
+
+A booking is a ticket with status 'booked', numbered in the slot day's
+sequence and in the 'appointment' class. It joins the live queue when a
+counter of the service calls its next client within
+`APPOINTMENT_CALL_AHEAD` seconds of the slot (see
+`app.queue_ops.admit_bookings`): it becomes 'waiting' with the slot
+time as arrival time, and is then served by the service's scheduler like
+any other ticket.
+
+A client can cancel a booking (`cancel_booking`), which gives its place
+back to the slot. Bookings of past days that were never admitted (no-shows,
+or slots after the day's last call) are skipped by `expire_bookings`, run
+by ``flask archive-queue``, so they leave the live table like any other
+finished ticket.
+"""
+
+import math
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app.estimates import active_staff
+from app.models import db, QueueItem, ServiceSlot, ServiceWaitEstimate
+from app.queue_ops import finish_ticket, issue_ticket
+
+
+class BookingError(ValueError):
+    """The requested booking is not possible."""
+
+
+class SlotFull(BookingError):
+    """Every place of the slot is taken."""
+
+
+def slot_starts(day):
+    """Return the start times of the slots of `day`, in order."""
+    start_hour, end_hour = current_app.config['APPOINTMENT_HOURS']
+    length = timedelta(minutes=current_app.config['APPOINTMENT_SLOT_MINUTES'])
+    start = datetime.combine(day, datetime.min.time()) + timedelta(hours=start_hour)
+    end = datetime.combine(day, datetime.min.time()) + timedelta(hours=end_hour)
+    starts = []
+    while start + length <= end:
+        starts.append(start)
+        start += length
+    return starts
+
+
+def seconds_per_client(service):
+    """Return the seconds the service needs per client, by its measured throughput."""
+    estimate = db.session.get(ServiceWaitEstimate, service['id'])
+    if estimate and estimate.ewma_interval_seconds:
+        return estimate.ewma_interval_seconds
+    if estimate and estimate.ewma_service_seconds:
+        per_client = estimate.ewma_service_seconds
+    else:
+        per_client = (service['avg_service_time'] or 10) * 60
+    return per_client / max(1, active_staff(service['id']))
+
+
+def slot_capacity(service):
+    """Return the number of bookings a new slot of `service` accepts."""
+    config = current_app.config
+    slot_seconds = config['APPOINTMENT_SLOT_MINUTES'] * 60
+    return math.floor(slot_seconds / seconds_per_client(service) * config['APPOINTMENT_SHARE'])
+
+
+def available_slots(service, day, now=None):
+    """Return the future slots of `service` on `day` with their free places.
+
+    Returns:
+        list[dict]: ``starts_at``, ``capacity`` and ``available`` per slot.
+    """
+    now = now or datetime.now()
+    rows = {slot.starts_at: slot for slot in ServiceSlot.query.filter(
+        ServiceSlot.service_id == service['id'],
+        ServiceSlot.starts_at >= datetime.combine(day, datetime.min.time()),
+        ServiceSlot.starts_at < datetime.combine(day + timedelta(days=1), datetime.min.time()))}
+    capacity = None
+    slots = []
+    for starts_at in slot_starts(day):
+        if starts_at <= now:
+            continue
+        row = rows.get(starts_at)
+        if row is None and capacity is None:
+            capacity = slot_capacity(service)
+        slots.append({
+            'starts_at': starts_at.isoformat(),
+            'capacity': row.capacity if row else capacity,
+            'available': row.capacity - row.booked if row else capacity,
+        })
+    return slots
+
+
+def _check_start(starts_at, now):
+    if starts_at <= now:
+        raise BookingError('That slot has already started')
+    if starts_at.date() > date.today() + timedelta(days=current_app.config['APPOINTMENT_BOOKING_DAYS']):
+        raise BookingError('That slot is too far ahead')
+    if starts_at not in slot_starts(starts_at.date()):
+        raise BookingError('No slot starts at that time')
+
+
+def reserve_place(service, starts_at, now=None):
+    """Take one place of a slot, creating the slot on its first booking.
+
+    Raises:
+        BookingError: `starts_at` is not a bookable slot.
+        SlotFull: No place is left.
+    """
+    _check_start(starts_at, now or datetime.now())
+    slots = ServiceSlot.__table__
+    key = (slots.c.service_id == service['id'], slots.c.starts_at == starts_at)
+    if db.session.scalar(db.select(slots.c.capacity).where(*key)) is None:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(slots).values(
+                    service_id=service['id'], starts_at=starts_at,
+                    capacity=slot_capacity(service), booked=0))
+        except IntegrityError:
+            # Created concurrently
+            pass
+    taken = db.session.execute(
+        db.update(slots).where(*key, slots.c.booked < slots.c.capacity)
+        .values(booked=slots.c.booked + 1)
+    ).rowcount
+    if not taken:
+        raise SlotFull('That slot is fully booked')
+
+
+def book(service, phone_number, starts_at):
+    """Book a place in a slot of `service` and issue its ticket (the caller commits).
+
+    Returns:
+        QueueItem: The 'booked' ticket.
+    """
+    reserve_place(service, starts_at)
+    return issue_ticket(service, phone_number, day=starts_at.date(),
+                        queue_class='appointment', scheduled_at=starts_at, booked=True)
+
+
+def cancel_booking(item, now=None):
+    """Cancel the booked ticket `item` and give its place back (the caller commits).
+
+    Returns:
+        bool: False if the ticket is no longer a booking.
+    """
+    if item.status != 'booked' or not finish_ticket(item, 'skipped'):
+        return False
+    if item.scheduled_at > (now or datetime.now()):
+        slots = ServiceSlot.__table__
+        db.session.execute(
+            db.update(slots).where(slots.c.service_id == item.service_id,
+                                   slots.c.starts_at == item.scheduled_at, slots.c.booked > 0)
+            .values(booked=slots.c.booked - 1)
+        )
+    return True
+
+
+def expire_bookings(before_day=None, batch_size=1000):
+    """Skip the bookings of days before `before_day` (default: today) never admitted.
+
+    Commits after each batch.
+
+    Returns:
+        int: Number of bookings skipped.
+    """
+    before_day = before_day or date.today()
+    expired = 0
+    while True:
+        items = QueueItem.query.filter(
+            QueueItem.status == 'booked', QueueItem.service_day < before_day
+        ).order_by(QueueItem.id).limit(batch_size).all()
+        if not items:
+            return expired
+        expired += sum(finish_ticket(item, 'skipped') for item in items)
+        db.session.commit()
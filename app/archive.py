@@ -0,0 +1,119 @@
+"""Archiving of finished tickets out of the live queue table.
+
+`queue_items` only needs today's tickets, the ones still waiting or being
+served and future bookings; everything else is history. `archive_finished`
+moves done and skipped tickets of past days into `queue_items_archive` in
+bounded batches, each in its own short transaction (``INSERT ... SELECT``
+then ``DELETE`` by id), so the live table and its indexes stay small. It
+is run periodically with ``flask archive-queue``, which first skips the
+bookings of past days that were never admitted
+(`app.appointments.expire_bookings`).
+
+Readers of history (analytics, export, stats rebuilds) query both
+tables, see `HISTORY_MODELS`.
+"""
+
+import time
+from datetime import date, datetime
+
+from app.models import db, QueueItem, QueueItemArchive
+from app.sql import supports_skip_locked
+
+# Tables holding tickets: the live one and the archive
+HISTORY_MODELS = (QueueItem, QueueItemArchive)
+
+# Columns copied into the archive, which adds `archived_at`
+ARCHIVED_COLUMNS = (
+    'id', 'queue_number', 'service_id', 'phone_number', 'status', 'created_at',
+    'called_at', 'completed_at', 'service_day', 'ticket_seq', 'served_by',
+    'queue_class', 'scheduled_at',
+)
+
+FINISHED_STATUSES = ('done', 'skipped')
+
+
+def _archivable(before_day, newest_id):
+    return (
+        QueueItem.status.in_(FINISHED_STATUSES),
+        QueueItem.service_day < before_day,
+        # The newest ticket always stays: databases that derive the next id
+        # from the current maximum (SQLite, MySQL before 8.0 after a restart)
+        # would otherwise hand out an id that is already in the archive
+        QueueItem.id < newest_id,
+    )
+
+
+def archive_batch(before_day, newest_id, after_id=0, batch_size=1000):
+    """Move one batch of finished tickets issued before `before_day`.
+
+    Tickets are taken in id order after `after_id`. The caller commits.
+
+    Returns:
+        tuple: (number of tickets moved, last id of the batch or None)
+    """
+    criteria = _archivable(before_day, newest_id)
+    query = db.select(QueueItem.id).where(QueueItem.id > after_id, *criteria).order_by(
+        QueueItem.id).limit(batch_size)
+    if supports_skip_locked():
+        query = query.with_for_update(skip_locked=True)
+    ids = db.session.scalars(query).all()
+    if not ids:
+        return 0, None
+
+    db.session.execute(db.insert(QueueItemArchive).from_select(
+        [*ARCHIVED_COLUMNS, 'archived_at'],
+        db.select(*(getattr(QueueItem, name) for name in ARCHIVED_COLUMNS),
+                  db.literal(datetime.now(), db.DateTime))
+        .where(QueueItem.id.in_(ids), *criteria)
+    ))
+    moved = db.session.execute(
+        db.delete(QueueItem).where(QueueItem.id.in_(ids), *criteria)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    return moved, ids[-1]
+
+
+def archive_finished(before_day=None, batch_size=1000, pause=0, max_batches=None):
+    """Move finished tickets of days before `before_day` into the archive.
+
+    Args:
+        before_day: First day whose tickets stay live (default: today).
+        batch_size: Tickets moved per transaction.
+        pause: Seconds to sleep between batches, to leave room for the
+            live traffic on a busy database.
+        max_batches: Stop after this many batches (default: until done).
+
+    Returns:
+        int: Number of tickets archived.
+    """
+    before_day = before_day or date.today()
+    newest_id = db.session.scalar(db.select(db.func.max(QueueItem.id)))
+    if newest_id is None:
+        return 0
+
+    archived = 0
+    after_id = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved, after_id = archive_batch(before_day, newest_id, after_id, batch_size)
+        db.session.commit()
+        if after_id is None:
+            break
+        archived += moved
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return archived
+
+
+def delete_archived(service_ids):
+    """Delete the archived tickets of `service_ids` with one statement.
+
+    Called before deleting services, whose ORM cascade only covers the
+    live tickets. The caller commits.
+    """
+    if service_ids:
+        db.session.execute(
+            db.delete(QueueItemArchive).where(QueueItemArchive.service_id.in_(service_ids))
+            .execution_options(synchronize_session=False)
+        )
@@ -0,0 +1,181 @@
+"""Password hashing and login throttling shared by the login endpoints.
+
+Verifying a password runs a deliberately slow key derivation (scrypt or
+PBKDF2). Done inline, a burst of login attempts keeps the workers busy
+hashing and starves the queue endpoints. `authenticate` therefore:
+
+* rejects usernames and client IPs with too many recent failures before
+  any hashing happens. Failures are counted in the state backend
+  (`app.state`), so with a shared backend the limits hold across all
+  workers;
+* verifies passwords on a small per-worker thread pool with a bounded
+  queue. When it is full the attempt is refused straight away (503)
+  instead of piling up behind the running hashes;
+* rehashes a password after a successful login when its hash was made
+  with other parameters than `PASSWORD_HASH_METHOD`, so changing the cost
+  takes effect as users log in.
+
+`PASSWORD_HASH_METHOD` uses Werkzeug's notation, e.g. ``scrypt:32768:8:1``
+(n, r, p) or ``pbkdf2:sha256:600000`` (iterations).
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash,
+)
+
+from app.models import db, User
+from app.state import get_state
+
+
+class LoginRejected(Exception):
+    """A login attempt refused before checking the password."""
+
+    status = 429
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = int(retry_after)
+
+
+class HashingBusy(LoginRejected):
+    """Every hashing slot of this worker is taken."""
+
+    status = 503
+
+
+class HashingExecutor:
+    """Thread pool running password hashes, with a bounded backlog.
+
+    Args:
+        workers: Hashes computed concurrently.
+        max_pending: Hashes allowed to wait for a thread; further ones
+            are refused with `HashingBusy`.
+        timeout: Seconds a caller waits for its hash.
+    """
+
+    def __init__(self, workers=2, max_pending=8, timeout=5):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='smartq-hash')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def run(self, function, *args):
+        """Return ``function(*args)`` computed on the pool."""
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy('Too many logins in progress, try again shortly', 1)
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy('Too many logins in progress, try again shortly', 1) from None
+
+
+def init_app(app):
+    """Create the application's hashing executor."""
+    app.extensions['smartq_auth'] = HashingExecutor(
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_QUEUE'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+    )
+
+
+def hash_method():
+    """Return `PASSWORD_HASH_METHOD` with Werkzeug's defaults filled in.
+
+    This is the prefix Werkzeug stores in front of the salt, so it can be
+    compared with existing hashes.
+    """
+    method = current_app.config.get('PASSWORD_HASH_METHOD') or 'scrypt'
+    name, *params = method.split(':')
+    if name == 'scrypt':
+        n, r, p = (params + ['32768', '8', '1'][len(params):])[:3]
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        digest, iterations = (params + ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)][len(params):])[:2]
+        return f'pbkdf2:{digest}:{iterations}'
+    return method
+
+
+def hash_password(password):
+    """Hash `password` with the configured method, on the calling thread."""
+    return generate_password_hash(password, method=hash_method())
+
+
+def needs_rehash(password_hash):
+    """Return True if `password_hash` was made with other parameters than configured."""
+    return password_hash.split('$', 1)[0] != hash_method()
+
+
+# -- Failed-attempt limits ----------------------------------------------
+
+def _failure_keys(username, ip):
+    return (f'login-failures:user:{username.lower()}', f'login-failures:ip:{ip}')
+
+
+def check_throttle(username, ip):
+    """Raise `LoginRejected` if `username` or `ip` has too many recent failures."""
+    config = current_app.config
+    state = get_state()
+    user_key, ip_key = _failure_keys(username, ip)
+    if ((state.get(user_key) or 0) >= config['LOGIN_MAX_FAILURES_PER_USER']
+            or (state.get(ip_key) or 0) >= config['LOGIN_MAX_FAILURES_PER_IP']):
+        raise LoginRejected('Too many failed login attempts, try again later',
+                            config['LOGIN_FAILURE_WINDOW'])
+
+
+def record_failure(username, ip):
+    """Count a failed attempt against `username` and `ip` for the failure window."""
+    window = current_app.config['LOGIN_FAILURE_WINDOW']
+    state = get_state()
+    for key in _failure_keys(username, ip):
+        state.incr(key, ttl=window)
+
+
+def reset_failures(username):
+    """Forget the failures of `username` after a successful login."""
+    get_state().delete(_failure_keys(username, '')[0])
+
+
+def authenticate(username, password, role, ip):
+    """Return the `role` user matching the credentials, or None.
+
+    Raises:
+        LoginRejected: The username or IP is throttled, or no hashing slot
+            is free. No password was checked.
+    """
+    if not isinstance(username, str) or not isinstance(password, str) or not username:
+        return None
+    check_throttle(username, ip)
+
+    executor = current_app.extensions['smartq_auth']
+    user = User.query.filter_by(username=username, role=role).first()
+    if user is None or not executor.run(check_password_hash, user.password_hash, password):
+        record_failure(username, ip)
+        return None
+    reset_failures(username)
+
+    if needs_rehash(user.password_hash):
+        try:
+            new_hash = executor.run(generate_password_hash, password, hash_method())
+        except HashingBusy:
+            # Upgraded on a later login
+            return user
+        # Skipped if the password changed since it was checked
+        db.session.execute(
+            db.update(User)
+            .where(User.id == user.id, User.password_hash == user.password_hash)
+            .values(password_hash=new_hash)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    return user
+
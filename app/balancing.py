@@ -0,0 +1,113 @@
+"""Staff service pools: one counter serving the busiest of several services.
+
+Besides their own service, a staff member can be given a pool of other
+services of the organization (`StaffServicePool`). In pool mode their
+call-next draws from the pool's service with the longest estimated wait
+(`app.estimates.estimate_wait_minutes` for its last waiting client), the
+deepest queue breaking ties and the staff member's own service winning
+remaining ones. Queue depths come from one grouped count for the whole
+pool; the ticket itself is then claimed through the service's scheduler
+as usual (`app.queue_ops.claim_next_ticket`).
+
+Waiting tickets can also be moved between services for good, see
+`app.queue_ops.transfer_tickets`.
+"""
+
+from flask import current_app
+
+from app.display import notify_service_changed
+from app.estimates import estimate_wait_minutes
+from app.lookups import get_service
+from app.models import db, QueueItem, StaffServicePool
+from app.notifications import dispatch_pending, enqueue_sms
+from app.queue_ops import notify_almost_up, transfer_tickets
+
+
+def pool_service_ids(user_id, home_service_id=None):
+    """Return the ids of the services a staff member may serve, their own first."""
+    pool = db.session.scalars(
+        db.select(StaffServicePool.service_id).where(StaffServicePool.user_id == user_id)
+        .order_by(StaffServicePool.service_id)
+    ).all()
+    return list(dict.fromkeys(([home_service_id] if home_service_id else []) + pool))
+
+
+def set_pool(user_id, service_ids):
+    """Replace a staff member's pool with `service_ids` (the caller commits)."""
+    db.session.execute(db.delete(StaffServicePool).where(StaffServicePool.user_id == user_id))
+    if service_ids:
+        db.session.execute(db.insert(StaffServicePool),
+                           [{'user_id': user_id, 'service_id': service_id}
+                            for service_id in sorted(set(service_ids))])
+
+
+def service_loads(service_ids):
+    """Return the queue depth and estimated wait of each service in `service_ids`.
+
+    Services that no longer exist are left out; the order is kept.
+    """
+    counts = dict(db.session.execute(
+        db.select(QueueItem.service_id, db.func.count())
+        .where(QueueItem.service_id.in_(service_ids), QueueItem.status == 'waiting')
+        .group_by(QueueItem.service_id)
+    ).all()) if service_ids else {}
+    loads = []
+    for service_id in service_ids:
+        service = get_service(service_id)
+        if not service:
+            continue
+        waiting = counts.get(service_id, 0)
+        loads.append({
+            'service_id': service_id,
+            'name': service['name'],
+            'counter_number': service['counter_number'],
+            'waiting': waiting,
+            'estimated_wait': estimate_wait_minutes(service, waiting),
+        })
+    return loads
+
+
+def draw_order(loads):
+    """Return the ids of the services with clients waiting, most loaded first."""
+    busy = [load for load in loads if load['waiting']]
+    # Stable, so ties keep the pool's order (own service first)
+    busy.sort(key=lambda load: (-load['estimated_wait'], -load['waiting']))
+    return [load['service_id'] for load in busy]
+
+
+def transfer_request(data, source_id, target_id, staff_id=None):
+    """Answer a transfer endpoint: move waiting tickets and text their clients.
+
+    `data` holds either ``ticket_ids`` or a ``count`` of oldest waiting
+    tickets, at most `TRANSFER_MAX_TICKETS`. The caller has checked that
+    both services belong to its organization. Commits.
+
+    Returns:
+        tuple: (JSON-serializable payload, HTTP status)
+    """
+    max_tickets = current_app.config['TRANSFER_MAX_TICKETS']
+    ticket_ids, count = data.get('ticket_ids'), data.get('count')
+    if source_id == target_id:
+        return {'error': 'Tickets are already in that service'}, 400
+    if ticket_ids is not None:
+        if (not isinstance(ticket_ids, list) or len(ticket_ids) > max_tickets
+                or not all(isinstance(ticket_id, int) for ticket_id in ticket_ids)):
+            return {'error': f'ticket_ids must be a list of at most {max_tickets} ids'}, 400
+        count = None
+    elif not isinstance(count, int) or not 1 <= count <= max_tickets:
+        return {'error': f'Give ticket_ids or a count between 1 and {max_tickets}'}, 400
+
+    target = get_service(target_id)
+    items = transfer_tickets(source_id, target_id, ticket_ids, count, staff_id)
+    for item in items:
+        enqueue_sms(item.phone_number,
+                    f"SmartQ: Ticket {item.queue_number} moved to {target['name']}, "
+                    f"counter {target['counter_number']}.",
+                    item)
+    notify_almost_up(target_id, current_app.config['ALMOST_UP_THRESHOLD'])
+    db.session.commit()
+    if items:
+        notify_service_changed(source_id)
+        notify_service_changed(target_id)
+        dispatch_pending()
+    return {'moved': len(items), 'tickets': [item.to_dict() for item in items]}, 200
@@ -0,0 +1,118 @@
+"""Small process-local caches used on hot read paths.
+
+`TTLCache` is a thread-safe mapping whose entries expire after a fixed
+time-to-live and which evicts the least recently used entry once it holds
+`maxsize` items. Each gunicorn worker keeps its own instances, so TTLs
+should stay short for data that other workers may change, or the caches
+should be flushed through a `FileInvalidationChannel`.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry.
+
+    Args:
+        ttl: Lifetime of an entry in seconds.
+        maxsize: Maximum number of entries kept before LRU eviction.
+    """
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, or `default` if absent/expired."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store `value` under `key` for `ttl` seconds."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for `key`, calling `loader()` on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        """Drop the entry for `key` if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class FileInvalidationChannel:
+    """Tell every worker on a host to flush its caches by touching a file.
+
+    `publish` appends a byte to the file; `poll` returns True once per
+    change seen since the previous poll. Checking costs a single `stat`
+    call, so it can run on every cache lookup. Without a path the channel
+    is disabled and only the local worker's caches are invalidated.
+    """
+
+    # Start the file over once it reaches this size
+    MAX_SIZE = 4096
+
+    def __init__(self, path=None):
+        self.path = path
+        self._seen = _MISSING
+
+    def publish(self):
+        """Signal all workers that cached data changed."""
+        if not self.path:
+            return
+        mode = 'wb' if self._size() >= self.MAX_SIZE else 'ab'
+        with open(self.path, mode) as handle:
+            handle.write(b'.')
+
+    def poll(self):
+        """Return True if another publish happened since the last poll."""
+        if not self.path:
+            return False
+        try:
+            stat = os.stat(self.path)
+            marker = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            marker = None
+        changed = self._seen is not _MISSING and marker != self._seen
+        self._seen = marker
+        return changed
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
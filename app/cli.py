@@ -0,0 +1,238 @@
+"""Flask CLI commands for SmartQ maintenance tasks.
+
+Commands are registered on the application by `create_app` and run with
+the usual Flask CLI, e.g. ``flask --app run.py rebuild-stats``.
+"""
+
+import time
+from datetime import date, datetime, timedelta
+
+import click
+
+from app.models import db
+
+
+def register_commands(app):
+    """Attach the SmartQ CLI commands to `app`."""
+
+    @app.cli.command('rebuild-stats')
+    @click.option('--day', 'day', default=None,
+                  help='Day to rebuild (YYYY-MM-DD). Defaults to today.')
+    @click.option('--days', default=1, show_default=True,
+                  help='Number of days to rebuild, counting back from --day.')
+    def rebuild_stats(day, days):
+        """Recompute the daily service stats rollup by replaying the queue event log."""
+        from app.events import rebuild_daily_stats
+
+        end = datetime.strptime(day, '%Y-%m-%d').date() if day else date.today()
+        for offset in range(days):
+            current = end - timedelta(days=offset)
+            rows = rebuild_daily_stats(current)
+            db.session.commit()
+            if rows is None:
+                click.echo(f"{current.isoformat()}: before the event log, left as is")
+            else:
+                click.echo(f"{current.isoformat()}: {rows} service rollup(s) rebuilt")
+
+    @app.cli.command('export-history')
+    @click.option('--output', 'output', required=True, type=click.Path(file_okay=False),
+                  help='Directory receiving the compressed CSV chunk files.')
+    @click.option('--org-id', type=int, default=None, help='Only export this organization.')
+    @click.option('--batch-size', default=5000, show_default=True,
+                  help='Rows per streamed batch and per chunk file.')
+    def export_history(output, org_id, batch_size):
+        """Export queue history incrementally as gzip-compressed CSV chunks."""
+        from app.export import export_to_directory, last_exported_key
+
+        after = last_exported_key(output)
+        if after:
+            click.echo(f"Resuming after ticket {after[1]} of {after[0].isoformat()}")
+        rows, paths = export_to_directory(output, org_id=org_id, batch_size=batch_size)
+        click.echo(f"Exported {rows} ticket(s) into {len(paths)} chunk file(s)")
+
+    @app.cli.command('archive-queue')
+    @click.option('--before', 'before', default=None,
+                  help='Archive tickets issued before this day (YYYY-MM-DD). Defaults to today.')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Tickets moved per transaction. Defaults to ARCHIVE_BATCH_SIZE.')
+    @click.option('--max-batches', type=int, default=None,
+                  help='Stop after this many batches.')
+    def archive_queue(before, batch_size, max_batches):
+        """Skip expired bookings, then move finished tickets of past days into the queue archive."""
+        from app.appointments import expire_bookings
+        from app.archive import archive_finished
+
+        before_day = datetime.strptime(before, '%Y-%m-%d').date() if before else date.today()
+        if before_day > date.today():
+            raise click.BadParameter('cannot archive tickets of future days', param_hint='--before')
+        expired = expire_bookings(before_day, batch_size or app.config['ARCHIVE_BATCH_SIZE'])
+        click.echo(f"Skipped {expired} booking(s) never admitted before {before_day.isoformat()}")
+        archived = archive_finished(
+            before_day,
+            batch_size=batch_size or app.config['ARCHIVE_BATCH_SIZE'],
+            pause=app.config['ARCHIVE_BATCH_PAUSE'],
+            max_batches=max_batches,
+        )
+        click.echo(f"Archived {archived} ticket(s) issued before {before_day.isoformat()}")
+
+    @app.cli.command('replay-events')
+    @click.argument('names', nargs=-1)
+    @click.option('--rebuild', is_flag=True,
+                  help='Reset the views and replay the whole event log.')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Events per transaction. Defaults to EVENT_REPLAY_BATCH_SIZE.')
+    def replay_events(names, rebuild, batch_size):
+        """Bring derived views up to date with the queue event log."""
+        from app import events
+
+        unknown = set(names) - set(events.PROJECTIONS)
+        if unknown:
+            raise click.BadParameter(
+                f"unknown projection(s) {', '.join(sorted(unknown))}; "
+                f"available: {', '.join(events.PROJECTIONS)}", param_hint='NAMES')
+        for name in names or events.PROJECTIONS:
+            projection = events.PROJECTIONS[name]
+            applied = (events.rebuild if rebuild else events.catch_up)(projection, batch_size)
+            click.echo(f"{name}: applied {applied} event(s), "
+                       f"checkpoint at {events.get_checkpoint(name)}")
+
+    @app.cli.command('provision')
+    @click.argument('kind', type=click.Choice(('organizations', 'services', 'staff', 'admins')))
+    @click.argument('source', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+    @click.option('--org-id', type=int, default=None,
+                  help='Organization receiving the services or staff.')
+    @click.option('--format', 'fmt', type=click.Choice(('csv', 'json')), default=None,
+                  help='Input format. Defaults to the file extension (CSV for stdin).')
+    @click.option('--skip-invalid', is_flag=True,
+                  help='Create the valid rows even if other rows have errors.')
+    def provision(kind, source, org_id, fmt, skip_invalid):
+        """Create organizations, services, staff or admins from a CSV/JSON file."""
+        from app.provisioning import ProvisioningError, parse_rows, provision as provision_rows
+
+        fmt = fmt or ('json' if source.lower().endswith('.json') else 'csv')
+        with click.open_file(source, encoding='utf-8') as handle:
+            text = handle.read()
+        try:
+            report = provision_rows(kind, parse_rows(text, fmt), org_id, skip_invalid)
+        except ProvisioningError as error:
+            db.session.rollback()
+            raise click.ClickException(str(error))
+        for error in report['errors']:
+            click.echo(f"row {error['row']}: {error['error']}", err=True)
+        if report['errors'] and not skip_invalid:
+            raise click.ClickException(
+                f"{len(report['errors'])} invalid row(s), nothing created (see --skip-invalid)")
+        db.session.commit()
+        click.echo(f"Created {report['created']} of {report['rows']} {kind} row(s)")
+
+    @app.cli.command('simulate-slots')
+    @click.option('--service-id', type=int, default=None,
+                  help='Take the service time from this service\'s wait estimator.')
+    @click.option('--service-minutes', type=float, default=None,
+                  help='Mean time a counter spends on a client. Defaults to 5, '
+                       'or the measured time of --service-id.')
+    @click.option('--staff', type=int, default=3, show_default=True, help='Counters open.')
+    @click.option('--arrivals', default=None,
+                  help='Clients per hour as HOUR=RATE,... Defaults to a morning peak.')
+    @click.option('--days', type=int, default=20, show_default=True,
+                  help='Simulated days per policy.')
+    @click.option('--seed', type=int, default=0, show_default=True)
+    def simulate_slots(service_id, service_minutes, staff, arrivals, days, seed):
+        """Compare peak queue length and waits under appointment slot policies."""
+        from app.models import Service, ServiceWaitEstimate
+        from app.simulation import MORNING_PEAK, compare_policies
+
+        service_seconds = service_minutes * 60 if service_minutes else 300
+        if service_id is not None and service_minutes is None:
+            service = db.session.get(Service, service_id)
+            if service is None:
+                raise click.BadParameter(f'service {service_id} not found', param_hint='--service-id')
+            estimate = db.session.get(ServiceWaitEstimate, service_id)
+            service_seconds = ((estimate.ewma_service_seconds if estimate else None)
+                               or (service.avg_service_time or 10) * 60)
+        try:
+            rates = ({int(hour): float(rate) for hour, rate in
+                      (pair.split('=') for pair in arrivals.split(','))}
+                     if arrivals else MORNING_PEAK)
+        except ValueError:
+            raise click.BadParameter('expected HOUR=RATE,...', param_hint='--arrivals')
+
+        click.echo(f"{staff} counter(s), {service_seconds / 60:.1f} min per client, "
+                   f"{sum(rates.values()):.0f} clients/day, {days} day(s) per policy")
+        click.echo(f"{'policy':<28}{'booked':>8}{'peak':>8}{'mean':>8}{'p90':>8}{'max':>8}")
+        for row in compare_policies(rates, service_seconds, staff, days=days, seed=seed):
+            click.echo(f"{row['policy']:<28}{row['booked_per_day']:>8}{row['peak_queue']:>8}"
+                       f"{row['mean_wait_minutes']:>8}{row['p90_wait_minutes']:>8}"
+                       f"{row['max_wait_minutes']:>8}")
+
+    @app.cli.command('simulate-service')
+    @click.argument('service_id', type=int)
+    @click.option('--staff', type=int, default=None,
+                  help='Counters to predict for. Defaults to the staff assigned to the service.')
+    @click.option('--days', type=int, default=None,
+                  help='Simulated days per staffing. Defaults to SIMULATION_DAYS.')
+    @click.option('--history-days', type=int, default=None,
+                  help='Days of history to seed from. Defaults to SIMULATION_HISTORY_DAYS.')
+    @click.option('--service-minutes', type=float, default=None,
+                  help='Assume this mean service time instead of the measured one.')
+    @click.option('--target-minutes', type=float, default=None,
+                  help='Wait target; also find the fewest counters meeting it.')
+    @click.option('--percentile', type=click.IntRange(1, 99), default=90, show_default=True,
+                  help='Percentile of the waits the target applies to.')
+    @click.option('--seed', type=int, default=0, show_default=True)
+    def simulate_service(service_id, staff, days, history_days, service_minutes,
+                         target_minutes, percentile, seed):
+        """Predict a service's waits from its history and the staff a wait target needs."""
+        from app.lookups import get_service
+        from app.planning import assigned_staff, demand_profile, plan_staffing
+        from app.simulation import exponential
+
+        service = get_service(service_id)
+        if service is None:
+            raise click.BadParameter(f'service {service_id} not found', param_hint='SERVICE_ID')
+        profile = demand_profile(service, history_days or app.config['SIMULATION_HISTORY_DAYS'])
+        if service_minutes:
+            profile = profile._replace(service_times=exponential(service_minutes * 60))
+        staff = staff or assigned_staff(service_id) or 1
+
+        started = time.monotonic()
+        plan = plan_staffing(profile, staff, target_minutes, percentile / 100, days, seed)
+        elapsed = time.monotonic() - started
+
+        click.echo(f"{service['name']}: {sum(profile.rates.values()):.0f} clients/day over "
+                   f"{profile.days} day(s) of history, "
+                   f"{profile.service_times.mean / 60:.1f} min per client "
+                   f"({profile.samples} measured)")
+        levels = plan.get('levels') or [plan['prediction']]
+        keys = list(levels[0]['percentiles'])
+        click.echo(f"{'staff':>6}{'mean':>8}" + ''.join(f'{key:>8}' for key in keys) + f"{'max':>8}")
+        for level in levels:
+            click.echo(f"{level['staff']:>6}{level['mean_wait_minutes']:>8}"
+                       + ''.join(f"{level['percentiles'][key]:>8}" for key in keys)
+                       + f"{level['max_wait_minutes']:>8}")
+        click.echo(f"{len(levels)} staffing(s) x {levels[0]['days']} day(s) simulated in {elapsed:.1f}s")
+        if target_minutes is not None:
+            needed = plan['staff_needed']
+            click.echo(f"p{percentile} wait <= {target_minutes:g} min needs "
+                       + (f"{needed} counter(s)" if needed else
+                          f"more than {app.config['SIMULATION_MAX_STAFF']} counters"))
+
+    @app.cli.command('notifications-worker')
+    @click.option('--once', is_flag=True,
+                  help='Deliver the messages that are due now, then exit.')
+    def notifications_worker(once):
+        """Deliver queued SMS notifications from the outbox."""
+        from app.notifications import get_dispatcher
+
+        dispatcher = get_dispatcher(app)
+        if once:
+            click.echo(f"Handled {dispatcher.drain()} notification(s)")
+            return
+        dispatcher.workers = max(dispatcher.workers, 1)
+        dispatcher.start()
+        click.echo(f"Delivering notifications with {dispatcher.workers} worker(s), Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            dispatcher.stop()
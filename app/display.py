@@ -0,0 +1,335 @@
+"""Lobby display snapshots and the push feed used by display screens.
+
+Display screens subscribe to a per-organization Server-Sent Events stream
+instead of polling `/client/api/display-status`. Queue mutations call
+`notify_service_changed` after committing, which drops the cached
+snapshot of the organization and announces the change on the state
+backend's ``queue-events`` channel (see `app.state`). Every worker with
+connected screens for that organization then builds one snapshot and
+pushes it to them, so database reads no longer grow with the number of
+screens. Snapshots are cached for `DISPLAY_CACHE_TTL` seconds in the
+state backend, so with a shared backend one build serves all workers.
+
+Subscribers live in the memory of the worker that accepted the stream.
+As a safety net for lost events, each worker also resyncs organizations
+with connected screens at most once per `DISPLAY_STREAM_RESYNC` seconds.
+Every open stream holds one of the worker's threads, so a worker accepts
+at most `DISPLAY_STREAM_MAX` of them; further screens are told to poll.
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app
+
+from app.lookups import get_service
+from app.models import db, Service, QueueItem
+from app.queue_ops import mark_queue_changed
+from app.scheduling import get_scheduler
+from app.state import RespError, get_state, record_failure
+
+
+EVENTS_CHANNEL = 'queue-events'
+
+
+def init_app(app):
+    """Push fresh snapshots to this worker's screens on queue events."""
+
+    def on_queue_event(event):
+        org_id = event['org_id']
+        if feed.has_subscribers(org_id):
+            with app.app_context():
+                feed.publish(org_id, get_display_snapshot(org_id))
+
+    get_state(app).subscribe(EVENTS_CHANNEL, on_queue_event)
+
+
+def build_display_snapshot(org_id):
+    """Build the display payload for all active services of an organization.
+
+    Returns a list of dictionaries with the service name, counter, the
+    ticket currently being served, the next ticket and the waiting count.
+    One query ranks the live tickets per service and status with window
+    functions and joins the head of each partition back onto the
+    organization's services. The next ticket depends on each service's
+    scheduler, so a second query reads the head of every lane of the
+    services with clients waiting (see `app.scheduling`) in one UNION.
+    """
+    rank = db.func.row_number().over(
+        partition_by=(QueueItem.service_id, QueueItem.status),
+        order_by=(
+            db.case((QueueItem.status == 'serving', QueueItem.called_at)).desc(),
+            QueueItem.created_at,
+        ),
+    )
+    total = db.func.count().over(partition_by=(QueueItem.service_id, QueueItem.status))
+    ranked = (
+        db.select(
+            QueueItem.service_id,
+            QueueItem.status,
+            QueueItem.queue_number,
+            rank.label('rank'),
+            total.label('total'),
+        )
+        .join(Service, Service.id == QueueItem.service_id)
+        .where(
+            Service.organization_id == org_id,
+            Service.is_active.is_(True),
+            QueueItem.status.in_(('serving', 'waiting')),
+        )
+        .subquery()
+    )
+    rows = db.session.execute(
+        db.select(
+            Service.id,
+            Service.name,
+            Service.counter_number,
+            Service.scheduler,
+            ranked.c.status,
+            ranked.c.queue_number,
+            ranked.c.total,
+        )
+        .outerjoin(ranked, db.and_(ranked.c.service_id == Service.id, ranked.c.rank == 1))
+        .where(Service.organization_id == org_id, Service.is_active.is_(True))
+        .order_by(Service.id)
+    ).all()
+
+    by_service = {}
+    schedulers = {}
+    for service_id, name, counter, scheduler, status, queue_number, count in rows:
+        schedulers[service_id] = scheduler
+        entry = by_service.get(service_id)
+        if entry is None:
+            entry = by_service[service_id] = {
+                'service_name': name,
+                'counter': counter,
+                'now_serving': None,
+                'next': None,
+                'waiting': 0
+            }
+        if status == 'serving':
+            entry['now_serving'] = queue_number
+        elif status == 'waiting':
+            entry['waiting'] = count
+
+    for service_id, queue_number in _next_tickets(
+            {service_id: schedulers[service_id]
+             for service_id, entry in by_service.items() if entry['waiting']}).items():
+        by_service[service_id]['next'] = queue_number
+
+    return list(by_service.values())
+
+
+def _next_tickets(schedulers):
+    """Return ``{service_id: queue number}`` of the ticket each service calls next.
+
+    `schedulers` maps the ids of the services to the name of their policy.
+
+    It is the head of the service's first non-empty lane, as
+    `app.queue_ops.claim_next_ticket` would claim it.
+    """
+    if not schedulers:
+        return {}
+    now = datetime.now()
+    heads = []
+    for service_id, name in schedulers.items():
+        for index, lane in enumerate(get_scheduler(name).lanes(service_id, now, peek=True)):
+            head = (
+                db.select(QueueItem.service_id, db.literal(index).label('lane'),
+                          QueueItem.queue_number)
+                .where(QueueItem.service_id == service_id, QueueItem.status == 'waiting',
+                       *lane.where(QueueItem))
+                .order_by(*lane.order_by(QueueItem))
+                .limit(1)
+                .subquery()
+            )
+            heads.append(db.select(head))
+    found = {}
+    for service_id, lane, queue_number in sorted(db.session.execute(db.union_all(*heads)).all()):
+        found.setdefault(service_id, queue_number)
+    return found
+
+
+def snapshot_key(org_id):
+    """State backend key of the cached snapshot of `org_id`."""
+    return f'display-snapshot:{org_id}'
+
+
+def invalidate_display(org_id):
+    """Drop the cached snapshot of `org_id` and refresh its screens.
+
+    Runs after the change committed, so it is best-effort: a state backend
+    failure is logged and counted, and the screens catch up when the
+    snapshot expires (`DISPLAY_CACHE_TTL`).
+    """
+    try:
+        state = get_state()
+        state.delete(snapshot_key(org_id))
+        state.publish(EVENTS_CHANNEL, {'org_id': org_id})
+    except (OSError, RespError):
+        record_failure('display_invalidation', f'organization {org_id}')
+
+
+def get_display_snapshot(org_id):
+    """Return the display payload for `org_id`, served from a short-lived cache."""
+    return get_state().get_or_load(
+        snapshot_key(org_id), current_app.config.get('DISPLAY_CACHE_TTL', 2),
+        lambda: build_display_snapshot(org_id))
+
+
+class DisplayFeed:
+    """In-process registry of display stream subscribers per organization.
+
+    Each subscriber gets a single-slot queue: a slow screen only ever sees
+    the latest snapshot, older undelivered snapshots are dropped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._latest = {}
+        self._synced_at = {}
+        self._count = 0
+
+    def subscribe(self, org_id, limit=0):
+        """Register a new subscriber for `org_id` and return its queue.
+
+        Returns None when this worker already serves `limit` streams
+        (0: no limit).
+        """
+        subscription = queue.Queue(maxsize=1)
+        with self._lock:
+            if limit and self._count >= limit:
+                return None
+            self._subscribers[org_id].add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, org_id, subscription):
+        """Remove a subscriber previously returned by `subscribe`."""
+        with self._lock:
+            subscribers = self._subscribers.get(org_id)
+            if subscribers is None or subscription not in subscribers:
+                return
+            subscribers.discard(subscription)
+            self._count -= 1
+            if not subscribers:
+                del self._subscribers[org_id]
+                self._latest.pop(org_id, None)
+                self._synced_at.pop(org_id, None)
+
+    def has_subscribers(self, org_id):
+        """Return True when at least one screen is connected for `org_id`."""
+        with self._lock:
+            return bool(self._subscribers.get(org_id))
+
+    def publish(self, org_id, snapshot):
+        """Push `snapshot` to all subscribers of `org_id`.
+
+        Subscribers are skipped when the snapshot is identical to the last
+        one published, so screens only receive real changes.
+        """
+        with self._lock:
+            self._synced_at[org_id] = time.monotonic()
+            if self._latest.get(org_id) == snapshot:
+                return
+            self._latest[org_id] = snapshot
+            subscribers = list(self._subscribers.get(org_id, ()))
+
+        for subscription in subscribers:
+            _offer(subscription, snapshot)
+
+    def claim_resync(self, org_id, interval):
+        """Return True if the caller should rebuild the snapshot for `org_id`.
+
+        At most one caller per `interval` seconds wins, which bounds the
+        resync cost per worker to one snapshot build per organization.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._synced_at.get(org_id, 0) < interval:
+                return False
+            self._synced_at[org_id] = now
+            return True
+
+
+def _offer(subscription, snapshot):
+    """Replace whatever is pending in a single-slot queue with `snapshot`."""
+    try:
+        subscription.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        subscription.put_nowait(snapshot)
+    except queue.Full:
+        pass
+
+
+feed = DisplayFeed()
+
+
+def notify_service_changed(service_id):
+    """Announce that the queue of `service_id` changed.
+
+    Must be called after the queue mutation has been committed. Advances
+    the service's queue generation (see `app.queue_ops.mark_queue_changed`),
+    drops the organization's cached snapshot and tells every worker; the
+    queue tables are only read again where a screen is subscribed.
+
+    Like `invalidate_display` it never fails the request whose change
+    already committed: if the generation cannot be advanced, the failure
+    is logged and counted and the cached queue versions expire on their
+    own.
+    """
+    service = get_service(service_id)
+    if not service:
+        return
+    try:
+        mark_queue_changed(service_id)
+    except (OSError, RespError):
+        record_failure('queue_generation', f'service {service_id}')
+    invalidate_display(service['organization_id'])
+
+
+def format_event(snapshot):
+    """Encode a snapshot as a Server-Sent Events `message` frame."""
+    return f"data: {json.dumps(snapshot)}\n\n"
+
+
+def stream_snapshots(app, org_id, subscription, initial):
+    """Yield SSE frames for one connected display screen.
+
+    Args:
+        app: Flask application, used to open an app context for resyncs.
+        org_id: Organization the screen displays.
+        subscription: Queue returned by `feed.subscribe`.
+        initial: Snapshot sent immediately on connect.
+    """
+    keepalive = app.config.get('DISPLAY_STREAM_KEEPALIVE', 15)
+    resync = app.config.get('DISPLAY_STREAM_RESYNC', 10)
+    wait = min(keepalive, resync)
+    last_sent = time.monotonic()
+
+    try:
+        yield f"retry: {app.config.get('DISPLAY_STREAM_RETRY_MS', 3000)}\n"
+        yield format_event(initial)
+        while True:
+            try:
+                snapshot = subscription.get(timeout=wait)
+            except queue.Empty:
+                if feed.claim_resync(org_id, resync):
+                    with app.app_context():
+                        feed.publish(org_id, get_display_snapshot(org_id))
+                    continue
+                if time.monotonic() - last_sent >= keepalive:
+                    last_sent = time.monotonic()
+                    yield ': keepalive\n\n'
+                continue
+            last_sent = time.monotonic()
+            yield format_event(snapshot)
+    finally:
+        feed.unsubscribe(org_id, subscription)
@@ -0,0 +1,124 @@
+"""Adaptive wait-time estimates.
+
+Every completed ticket feeds two exponentially weighted moving averages
+kept in `ServiceWaitEstimate`: the time a counter spends on one client,
+and the time between two completions of the service (the inverse of its
+throughput, which already reflects how many counters are open). Updates
+happen in the completing transaction and cost three single-row
+statements; estimates read one row by primary key plus a cached count of
+the staff currently active on the service, never the ticket history.
+
+While the service is busy the wait is ``ahead * interval``. After an
+idle period (no completion for `ESTIMATOR_IDLE_GAP` seconds) the
+throughput is stale, so the wait falls back to ``ahead * service time /
+active staff``. Until the first ticket is completed the service time is
+the admin-entered `avg_service_time`.
+"""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.models import db, User, ServiceWaitEstimate
+from app.sql import increment_row
+from app.state import get_state
+
+
+def _setting(name, default):
+    return current_app.config.get(name, default)
+
+
+def _ewma(previous, sample, alpha):
+    return sample if previous is None else previous + alpha * (sample - previous)
+
+
+def record_completion(item):
+    """Fold a ticket that was just marked done into its service's averages.
+
+    Must run in the transaction that completes the ticket. The counter
+    UPDATE locks the estimate row first, so concurrent completions of the
+    same service apply one after the other instead of losing samples.
+    """
+    if not item.called_at or not item.completed_at:
+        return
+    alpha = _setting('ESTIMATOR_ALPHA', 0.2)
+    idle_gap = _setting('ESTIMATOR_IDLE_GAP', 900)
+
+    increment_row(ServiceWaitEstimate.__table__, {'service_id': item.service_id}, {'samples': 1})
+    estimate = db.session.get(ServiceWaitEstimate, item.service_id, populate_existing=True)
+
+    service_seconds = (item.completed_at - item.called_at).total_seconds()
+    estimate.ewma_service_seconds = _ewma(estimate.ewma_service_seconds, service_seconds, alpha)
+    if estimate.last_completed_at:
+        interval = (item.completed_at - estimate.last_completed_at).total_seconds()
+        # A gap longer than an idle period says nothing about throughput
+        if 0 <= interval <= idle_gap:
+            estimate.ewma_interval_seconds = _ewma(estimate.ewma_interval_seconds, interval, alpha)
+    if not estimate.last_completed_at or item.completed_at > estimate.last_completed_at:
+        estimate.last_completed_at = item.completed_at
+
+
+def touch_staff(user_id):
+    """Mark a staff member as active on their service.
+
+    Writes at most once a minute per staff member, in the caller's
+    transaction.
+    """
+    now = datetime.now()
+    db.session.execute(
+        db.update(User).where(
+            User.id == user_id,
+            db.or_(User.last_active_at.is_(None),
+                   User.last_active_at < now - timedelta(seconds=60))
+        ).values(last_active_at=now),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def release_staff(user_id):
+    """Stop counting a staff member who logged out as active."""
+    db.session.execute(
+        db.update(User).where(User.id == user_id).values(last_active_at=None),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def active_staff(service_id):
+    """Number of staff with a queue action on `service_id` in the active window.
+
+    Cached in the state backend for 30 seconds.
+    """
+    def load():
+        cutoff = datetime.now() - timedelta(seconds=_setting('STAFF_ACTIVE_WINDOW', 900))
+        return db.session.scalar(
+            db.select(db.func.count()).select_from(User).where(
+                User.service_id == service_id,
+                User.last_active_at >= cutoff,
+                User.role == 'staff',
+            )
+        )
+    return get_state().get_or_load(f'active-staff:{service_id}', 30, load)
+
+
+def estimate_wait_minutes(service, ahead):
+    """Estimated wait in whole minutes for a client with `ahead` people in front.
+
+    Args:
+        service: Service payload from `app.lookups.get_service`.
+        ahead: Number of clients waiting before this one.
+    """
+    if ahead <= 0:
+        return 0
+    estimate = db.session.get(ServiceWaitEstimate, service['id'])
+    idle_gap = _setting('ESTIMATOR_IDLE_GAP', 900)
+
+    if (estimate and estimate.ewma_interval_seconds and estimate.last_completed_at
+            and datetime.now() - estimate.last_completed_at <= timedelta(seconds=idle_gap)):
+        seconds = ahead * estimate.ewma_interval_seconds
+    else:
+        if estimate and estimate.ewma_service_seconds is not None:
+            per_ticket = estimate.ewma_service_seconds
+        else:
+            per_ticket = (service['avg_service_time'] or 0) * 60
+        seconds = ahead * per_ticket / max(1, active_staff(service['id']))
+    return round(seconds / 60)
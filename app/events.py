@@ -0,0 +1,317 @@
+"""Append-only log of queue transitions, and replay into derived views.
+
+Every ticket transition (booked, joined, called, done, skipped,
+transferred to another service) appends a `QueueEvent` in the same
+transaction as the change itself, via `record_event`. Events are small
+fixed-width rows: ids, the ticket's day and number, an integer `kind`
+code, the staff member and a timestamp. The log gives a ticket's full
+history (`ticket_history`) and is the input of projections.
+
+A projection is a view derived from the log. It remembers the id of the
+last event it applied in `projection_checkpoints`, advanced in the same
+transaction as the view's changes, so `catch_up` only reads the events
+appended since, and `rebuild` resets the view and replays the whole log.
+Neither ever scans the ticket tables. `rebuild_daily_stats` likewise
+rebuilds the daily rollup of `app.stats` from a day's events.
+
+Event ids are allocated before their transaction commits, so a replay
+could read event N+1 while N is still uncommitted and never come back for
+N. Replay therefore stops at the first event recorded less than
+`EVENT_REPLAY_LAG` seconds ago, which is safe as long as transactions
+commit within that time. It goes by `recorded_at`, the insert time, as
+`created_at` may be backdated (a booking admitted late joins at its slot).
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import takewhile
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, ProjectionCheckpoint, QueueEvent, ServiceDailyStats, ServiceHourlyStats
+from app.sql import increment_row
+from app.stats import FIELDS, contribution
+
+# Event kinds
+JOINED, CALLED, DONE, SKIPPED, TRANSFERRED, BOOKED = 1, 2, 3, 4, 5, 6
+
+KIND_NAMES = {JOINED: 'joined', CALLED: 'called', DONE: 'done', SKIPPED: 'skipped',
+              TRANSFERRED: 'transferred', BOOKED: 'booked'}
+
+
+def record_event(item, kind, staff_id=None, at=None):
+    """Append a `kind` event for the flushed ticket `item` to the session."""
+    db.session.add(QueueEvent(
+        queue_item_id=item.id,
+        service_id=item.service_id,
+        service_day=item.service_day,
+        ticket_seq=item.ticket_seq,
+        kind=kind,
+        staff_id=staff_id,
+        created_at=at or datetime.now(),
+        recorded_at=datetime.now(),
+    ))
+
+
+def ticket_history(queue_item_id):
+    """Return the events of a ticket, oldest first, as dictionaries."""
+    events = db.session.execute(
+        db.select(QueueEvent.id, QueueEvent.service_id, QueueEvent.ticket_seq, QueueEvent.kind,
+                  QueueEvent.staff_id, QueueEvent.created_at)
+        .where(QueueEvent.queue_item_id == queue_item_id)
+        .order_by(QueueEvent.id)
+    ).all()
+    return [{
+        'id': event.id,
+        'service_id': event.service_id,
+        'ticket_seq': event.ticket_seq,
+        'event': KIND_NAMES.get(event.kind, str(event.kind)),
+        'staff_id': event.staff_id,
+        'at': event.created_at.isoformat(),
+    } for event in events]
+
+
+# -- Replay engine --------------------------------------------------------
+
+class Projection:
+    """A view derived from the event log.
+
+    Subclasses set `name` and implement `apply` and `reset`. Both run in
+    the replay's transaction; they must not commit.
+    """
+
+    name = None
+
+    def apply(self, events):
+        """Update the view with `events`, a list of rows in id order."""
+        raise NotImplementedError
+
+    def reset(self):
+        """Empty the view before a full rebuild."""
+        raise NotImplementedError
+
+
+PROJECTIONS = {}
+
+
+def register_projection(projection):
+    """Make `projection` available to `catch_up_all` and the CLI."""
+    PROJECTIONS[projection.name] = projection
+    return projection
+
+
+def get_checkpoint(name):
+    """Return the id of the last event applied to projection `name` (0 if none)."""
+    last_id = db.session.scalar(
+        db.select(ProjectionCheckpoint.last_event_id).where(ProjectionCheckpoint.name == name))
+    if last_id is not None:
+        return last_id
+    try:
+        with db.session.begin_nested():
+            db.session.add(ProjectionCheckpoint(name=name, last_event_id=0))
+    except IntegrityError:
+        # Created concurrently
+        pass
+    return 0
+
+
+def _event_rows(after_id, limit):
+    return db.session.execute(
+        db.select(QueueEvent.__table__).where(QueueEvent.id > after_id)
+        .order_by(QueueEvent.id).limit(limit)
+    ).all()
+
+
+def catch_up(projection, batch_size=None, max_batches=None):
+    """Apply the events appended since `projection`'s checkpoint.
+
+    Each batch and its checkpoint are committed together. The checkpoint
+    is advanced with a conditional UPDATE, so when two runs race, the
+    slower one rolls its batch back and stops.
+
+    Returns:
+        int: Number of events applied.
+    """
+    batch_size = batch_size or current_app.config['EVENT_REPLAY_BATCH_SIZE']
+    cutoff = datetime.now() - timedelta(seconds=current_app.config['EVENT_REPLAY_LAG'])
+    applied = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        last_id = get_checkpoint(projection.name)
+        rows = _event_rows(last_id, batch_size)
+        events = list(takewhile(lambda event: event.recorded_at < cutoff, rows))
+        if not events:
+            db.session.commit()
+            break
+
+        projection.apply(events)
+        advanced = db.session.execute(
+            db.update(ProjectionCheckpoint)
+            .where(ProjectionCheckpoint.name == projection.name,
+                   ProjectionCheckpoint.last_event_id == last_id)
+            .values(last_event_id=events[-1].id, updated_at=datetime.now())
+        ).rowcount
+        if not advanced:
+            db.session.rollback()
+            break
+        db.session.commit()
+        applied += len(events)
+        batches += 1
+        if len(events) < len(rows) or len(rows) < batch_size:
+            break
+    return applied
+
+
+def rebuild(projection, batch_size=None):
+    """Reset `projection`'s view and replay the whole log into it.
+
+    Returns:
+        int: Number of events applied.
+    """
+    get_checkpoint(projection.name)
+    projection.reset()
+    db.session.execute(
+        db.update(ProjectionCheckpoint).where(ProjectionCheckpoint.name == projection.name)
+        .values(last_event_id=0, updated_at=datetime.now())
+    )
+    db.session.commit()
+    return catch_up(projection, batch_size)
+
+
+def catch_up_all(batch_size=None):
+    """Catch up every registered projection; return ``{name: events applied}``."""
+    return {name: catch_up(projection, batch_size) for name, projection in PROJECTIONS.items()}
+
+
+def ticket_timelines(events):
+    """Load the history of every ticket in `events` up to the last of them.
+
+    Reads the ``(queue_item_id, id)`` index, one query per 500 tickets.
+    Returns ``{queue_item_id: [event rows in id order]}``.
+    """
+    ticket_ids = sorted({event.queue_item_id for event in events})
+    timelines = defaultdict(list)
+    for start in range(0, len(ticket_ids), 500):
+        rows = db.session.execute(
+            db.select(QueueEvent.__table__)
+            .where(QueueEvent.queue_item_id.in_(ticket_ids[start:start + 500]),
+                   QueueEvent.id <= events[-1].id)
+            .order_by(QueueEvent.queue_item_id, QueueEvent.id)
+        )
+        for row in rows:
+            timelines[row.queue_item_id].append(row)
+    return timelines
+
+
+def _advance(state, event):
+    """Apply `event` to a ticket `state`, the arguments of `app.stats.contribution`."""
+    if event.kind == JOINED:
+        state.update(status='waiting', created_at=event.created_at)
+    elif event.kind == CALLED:
+        state.update(status='serving', called_at=event.created_at)
+    elif event.kind == DONE:
+        state.update(status='done', completed_at=event.created_at)
+    elif event.kind == SKIPPED:
+        state.update(status='skipped')
+
+
+def _initial_state():
+    return {'status': None, 'created_at': None, 'called_at': None, 'completed_at': None}
+
+
+def rebuild_daily_stats(day, service_id=None):
+    """Recompute the `ServiceDailyStats` rows of `day` by replaying its events.
+
+    Reads the day's events through the ``(service_day, queue_item_id,
+    id)`` index and folds each ticket's timeline into its final
+    contribution, counted under the service of its last event like the
+    live rollup. Used to repair drift. Days before the first logged day
+    have no complete history, so their rows are left as they are.
+
+    Returns:
+        int: Number of rollup rows written, or None for a day before the log.
+    """
+    first_day = db.session.scalar(db.select(db.func.min(QueueEvent.service_day)))
+    if first_day is None or day < first_day:
+        return None
+
+    totals = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+    rows = db.session.execute(
+        db.select(QueueEvent.__table__).where(QueueEvent.service_day == day)
+        .order_by(QueueEvent.queue_item_id, QueueEvent.id)
+        .execution_options(yield_per=1000))
+    ticket_id, state, owner = None, None, None
+
+    def close():
+        if ticket_id is not None and (service_id is None or owner == service_id):
+            for field, value in contribution(**state).items():
+                totals[owner][field] += value
+
+    for event in rows:
+        if event.queue_item_id != ticket_id:
+            close()
+            ticket_id, state = event.queue_item_id, _initial_state()
+        _advance(state, event)
+        owner = event.service_id
+    close()
+
+    delete = db.delete(ServiceDailyStats).where(ServiceDailyStats.day == day)
+    if service_id is not None:
+        delete = delete.where(ServiceDailyStats.service_id == service_id)
+    db.session.execute(delete)
+    if totals:
+        db.session.execute(db.insert(ServiceDailyStats), [
+            {'service_id': sid, 'day': day, **values} for sid, values in totals.items()
+        ])
+    return len(totals)
+
+
+# -- Projections --------------------------------------------------------
+
+
+class HourlyStatsProjection(Projection):
+    """`ServiceHourlyStats`: arrivals and outcomes by service, day and hour of arrival.
+
+    Each ticket's state is rebuilt from its earlier events, and the view is
+    adjusted by the change in the ticket's contribution (see
+    `app.stats.contribution`). A ticket finished twice is therefore counted
+    once, exactly as in the daily rollup. Tickets whose 'joined' event
+    predates the log are ignored, and transferred tickets stay counted
+    under the service they joined.
+    """
+
+    name = 'hourly-stats'
+
+    def apply(self, events):
+        batch = {event.id for event in events}
+        deltas = defaultdict(lambda: defaultdict(int))
+        for timeline in ticket_timelines(events).values():
+            joined = None
+            state = _initial_state()
+            for event in timeline:
+                before = contribution(**state)
+                if event.kind == JOINED:
+                    joined = event
+                _advance(state, event)
+                if event.id not in batch or joined is None:
+                    continue
+
+                target = deltas[(joined.service_id, joined.service_day, joined.created_at.hour)]
+                if event.kind == JOINED:
+                    target['joined_count'] += 1
+                after = contribution(**state)
+                for field in FIELDS:
+                    target[field] += after.get(field, 0) - before.get(field, 0)
+
+        table = ServiceHourlyStats.__table__
+        for (service_id, day, hour), values in deltas.items():
+            values = {field: value for field, value in values.items() if value}
+            if values:
+                increment_row(table, {'service_id': service_id, 'day': day, 'hour': hour}, values)
+
+    def reset(self):
+        db.session.execute(db.delete(ServiceHourlyStats))
+
+
+register_projection(HourlyStatsProjection())
@@ -0,0 +1,169 @@
+"""Streaming export of queue history for offline analysis.
+
+Queue tickets are read with a server-side cursor (`stream_results`) in
+fixed-size partitions and written as gzip-compressed CSV, so memory use
+stays flat however many rows are exported. Phone numbers are not
+exported.
+
+A row is never exported again, so only final ones are: closed tickets
+(done or skipped) of days that are over. They are read in
+``(service_day, id)`` order and a run resumes after the last key it
+exported, so a ticket still open, or a booking for a later day, never
+holds back the tickets after it. A ticket left open when its day ended
+is not exported.
+
+The CLI writes one chunk file per partition, named after the keys of the
+first and last ticket it contains
+(``queue_items_<day>_<id>_<day>_<id>.csv.gz``). A later run resumes after
+the highest key present in the output directory, so exports can be
+scheduled incrementally.
+"""
+
+import csv
+import gzip
+import io
+import os
+import re
+import zlib
+from datetime import date, datetime
+
+from app.archive import HISTORY_MODELS
+from app.models import db, Service
+from app.sql import seconds_between
+
+EXPORT_COLUMNS = (
+    'id', 'organization_id', 'service_id', 'queue_number', 'status',
+    'service_day', 'created_at', 'called_at', 'completed_at',
+    'wait_seconds', 'service_seconds', 'served_by',
+)
+
+# Statuses a ticket never leaves
+CLOSED_STATUSES = ('done', 'skipped')
+
+_CHUNK_NAME = re.compile(r'^queue_items_\d{8}_\d+_(\d{8})_(\d+)\.csv\.gz$')
+
+
+def _history_select(model, after, org_id, today):
+    query = db.select(
+        model.id,
+        Service.organization_id,
+        model.service_id,
+        model.queue_number,
+        model.status,
+        model.service_day,
+        model.created_at,
+        model.called_at,
+        model.completed_at,
+        seconds_between(model.created_at, model.called_at).label('wait_seconds'),
+        seconds_between(model.called_at, model.completed_at).label('service_seconds'),
+        model.served_by,
+    ).join(Service, Service.id == model.service_id).where(
+        model.status.in_(CLOSED_STATUSES), model.service_day < today)
+    if after is not None:
+        query = query.where(db.tuple_(model.service_day, model.id) > db.tuple_(*after))
+    if org_id is not None:
+        query = query.where(Service.organization_id == org_id)
+    return query
+
+
+def history_query(after=None, org_id=None, today=None):
+    """Select the closed tickets of days before `today`, in ``(service_day, id)`` order.
+
+    Archived tickets keep their day and id, so live and archived rows
+    interleave into a single sequence. `after` is the ``(service_day, id)``
+    key of the last row already read.
+    """
+    today = today or date.today()
+    tickets = db.union_all(
+        *(_history_select(model, after, org_id, today) for model in HISTORY_MODELS)
+    ).subquery()
+    return db.select(tickets).order_by(tickets.c.service_day, tickets.c.id)
+
+
+def iter_batches(after=None, org_id=None, batch_size=5000):
+    """Yield lists of final export rows after the key `after`, `batch_size` at a time."""
+    result = db.session.execute(
+        history_query(after, org_id).execution_options(
+            stream_results=True, yield_per=batch_size)
+    )
+    for partition in result.partitions():
+        yield partition
+
+
+def parse_key(value):
+    """Parse a ``YYYY-MM-DD:id`` resume key; raise ValueError if malformed."""
+    day, _, ticket_id = value.partition(':')
+    return date.fromisoformat(day), int(ticket_id)
+
+
+def _format(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def last_exported_key(directory):
+    """Return the highest ``(service_day, id)`` written to `directory`, or None."""
+    if not os.path.isdir(directory):
+        return None
+    last = None
+    for name in os.listdir(directory):
+        match = _CHUNK_NAME.match(name)
+        if match:
+            key = (datetime.strptime(match.group(1), '%Y%m%d').date(), int(match.group(2)))
+            last = max(last, key) if last else key
+    return last
+
+
+def _chunk_key(row):
+    return f'{row.service_day:%Y%m%d}_{row.id:012d}'
+
+
+def export_to_directory(directory, org_id=None, batch_size=5000):
+    """Export the final tickets after the last exported key into chunk files.
+
+    Each chunk is written to a temporary file and renamed into place once
+    complete, so an interrupted run never leaves a partial chunk that a
+    resumed run would skip past.
+
+    Returns:
+        tuple: (number of rows exported, list of chunk paths written)
+    """
+    os.makedirs(directory, exist_ok=True)
+    after = last_exported_key(directory)
+    rows_written = 0
+    paths = []
+
+    for batch in iter_batches(after, org_id, batch_size):
+        name = f'queue_items_{_chunk_key(batch[0])}_{_chunk_key(batch[-1])}.csv.gz'
+        path = os.path.join(directory, name)
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', newline='') as handle:
+            writer = csv.writer(handle)
+            writer.writerow(EXPORT_COLUMNS)
+            writer.writerows([_format(value) for value in row] for row in batch)
+        os.replace(tmp_path, path)
+        rows_written += len(batch)
+        paths.append(path)
+
+    return rows_written, paths
+
+
+def stream_csv_gzip(after=None, org_id=None, batch_size=5000):
+    """Yield a gzip-compressed CSV document of the export rows, piece by piece."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in iter_batches(after, org_id, batch_size):
+        writer.writerows([_format(value) for value in row] for row in batch)
+        chunk = compressor.compress(buffer.getvalue().encode('utf-8'))
+        buffer.seek(0)
+        buffer.truncate()
+        if chunk:
+            yield chunk
+
+    yield compressor.compress(buffer.getvalue().encode('utf-8')) + compressor.flush()
@@ -0,0 +1,132 @@
+"""Read-through caches for Service and Organization records.
+
+Services and organizations are read on every kiosk load, ticket and
+display update but almost never change. The helpers here return their
+`to_dict()` payloads from process-local TTL/LRU caches. The admin and
+super-admin CRUD endpoints call `invalidate_service` /
+`invalidate_organization` after committing. Invalidations are broadcast
+on the state backend's ``lookups-invalidated`` channel, so with a shared
+backend (see `app.state`) every worker drops the same entries. When
+`CACHE_INVALIDATION_FILE` is configured, the other workers on the host
+also flush their lookup caches on their next lookup.
+
+Returned dictionaries are shared between requests and must not be
+modified by callers.
+"""
+
+from app.cache import TTLCache, FileInvalidationChannel
+from app.models import db, Organization, Service
+from app.state import RespError, get_state, record_failure
+
+_services = TTLCache(ttl=60, maxsize=4096)
+_active_services = TTLCache(ttl=60, maxsize=1024)
+_organizations = TTLCache(ttl=60, maxsize=1024)
+_channel = FileInvalidationChannel()
+
+# Key of the cached list of all organizations in `_organizations`
+_ALL = 'all'
+
+INVALIDATION_CHANNEL = 'lookups-invalidated'
+
+
+def init_app(app):
+    """Apply lookup cache settings from the application config."""
+    for cache in (_services, _active_services, _organizations):
+        cache.ttl = app.config.get('LOOKUP_CACHE_TTL', 60)
+    _services.maxsize = app.config.get('LOOKUP_CACHE_SIZE', 4096)
+    _channel.path = app.config.get('CACHE_INVALIDATION_FILE')
+    get_state(app).subscribe(INVALIDATION_CHANNEL, _drop)
+
+
+def _sync():
+    """Flush local caches if another worker published an invalidation."""
+    if _channel.poll():
+        clear()
+
+
+def get_service(service_id):
+    """Return the service's `to_dict()` payload, or None if it does not exist."""
+    try:
+        service_id = int(service_id)
+    except (TypeError, ValueError):
+        return None
+    _sync()
+
+    def load():
+        service = db.session.get(Service, service_id)
+        return service.to_dict() if service else None
+
+    return _services.get_or_load(service_id, load)
+
+
+def get_active_services(org_id):
+    """Return the `to_dict()` payloads of an organization's active services."""
+    _sync()
+
+    def load():
+        services = Service.query.filter_by(organization_id=org_id, is_active=True).all()
+        return [s.to_dict() for s in services]
+
+    return _active_services.get_or_load(org_id, load)
+
+
+def get_organization(org_id):
+    """Return the organization's `to_dict()` payload, or None."""
+    _sync()
+
+    def load():
+        org = db.session.get(Organization, org_id)
+        return org.to_dict() if org else None
+
+    return _organizations.get_or_load(org_id, load)
+
+
+def get_organizations():
+    """Return the `to_dict()` payloads of all organizations."""
+    _sync()
+    return _organizations.get_or_load(
+        _ALL, lambda: [org.to_dict() for org in Organization.query.all()])
+
+
+def _drop(message):
+    """Drop the local entries named by an invalidation message."""
+    if message.get('service_id') is not None:
+        _services.invalidate(message['service_id'])
+    elif message['org_id'] is None:
+        _organizations.clear()
+        _active_services.clear()
+        return
+    else:
+        _organizations.invalidate(message['org_id'])
+        _organizations.invalidate(_ALL)
+    _active_services.invalidate(message['org_id'])
+
+
+def _broadcast(message):
+    _drop(message)
+    _channel.publish()
+    try:
+        get_state().publish(INVALIDATION_CHANNEL, message)
+    except (OSError, RespError):
+        # Called after the change committed; other workers catch up when
+        # their entries expire (`LOOKUP_CACHE_TTL`)
+        record_failure('lookup_invalidation', message)
+
+
+def invalidate_service(service_id, org_id):
+    """Drop cached data for a created, updated or deleted service."""
+    _broadcast({'service_id': service_id, 'org_id': org_id})
+
+
+def invalidate_organization(org_id):
+    """Drop cached data for a created, updated or deleted organization.
+
+    `org_id` None drops every organization, e.g. after a bulk import.
+    """
+    _broadcast({'org_id': org_id})
+
+
+def clear():
+    """Drop every cached lookup in this worker."""
+    for cache in (_services, _active_services, _organizations):
+        cache.clear()
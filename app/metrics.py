@@ -0,0 +1,301 @@
+"""Per-endpoint request instrumentation and the Prometheus `/metrics` endpoint.
+
+For every request the app records, labelled by endpoint and method:
+
+* wall time (until the response is handed to the server)
+* number of SQL statements and the time spent executing them, from
+  SQLAlchemy engine events
+* JSON serialization time, from a timing JSON provider
+
+Each gunicorn worker aggregates its requests into histograms in memory.
+With `METRICS_DIR` set, workers also write their totals to one file per
+process in that directory (at most every `METRICS_FLUSH_INTERVAL`
+seconds) and `/metrics` merges all files, so a scrape sees every worker
+of the host. Files of exited workers are kept, so counters stay
+cumulative.
+
+With `SLOW_REQUEST_MS` set, requests slower than that are logged with
+their SQL statements and timings.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, current_app, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+
+from app.models import db
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+HISTOGRAMS = {
+    'smartq_request_duration_seconds': ('Wall time of a request.', SECONDS_BUCKETS),
+    'smartq_request_db_seconds': ('Time spent executing SQL per request.', SECONDS_BUCKETS),
+    'smartq_request_queries': ('SQL statements executed per request.', QUERY_BUCKETS),
+    'smartq_request_serialization_seconds': ('Time spent encoding JSON per request.',
+                                             SECONDS_BUCKETS),
+}
+COUNTERS = {
+    'smartq_requests_total': 'Requests by endpoint, method and status code.',
+    'smartq_state_failures_total': 'Post-commit state backend updates that failed, by operation.',
+}
+
+# Statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 50
+
+
+class Registry:
+    """Thread-safe in-memory histograms and counters.
+
+    Series are keyed by metric name and a JSON-encoded label mapping, so
+    the registry can be written to and merged from files as is.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = defaultdict(dict)
+        self.counters = defaultdict(dict)
+
+    @staticmethod
+    def label_key(labels):
+        return json.dumps(labels, sort_keys=True)
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = self.label_key(labels)
+        with self._lock:
+            series = self.histograms[name].get(key)
+            if series is None:
+                series = self.histograms[name][key] = {
+                    'buckets': [0] * len(buckets), 'sum': 0, 'count': 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def inc(self, name, labels, amount=1):
+        key = self.label_key(labels)
+        with self._lock:
+            self.counters[name][key] = self.counters[name].get(key, 0) + amount
+
+    def snapshot(self):
+        """Return a JSON-serializable copy of every series."""
+        with self._lock:
+            return json.loads(json.dumps({'histograms': self.histograms,
+                                          'counters': self.counters}))
+
+
+def merge(snapshots):
+    """Sum registry snapshots of several workers into one."""
+    merged = {'histograms': defaultdict(dict), 'counters': defaultdict(dict)}
+    for data in snapshots:
+        for name, series in data.get('histograms', {}).items():
+            for key, values in series.items():
+                target = merged['histograms'][name].get(key)
+                if target is None or len(target['buckets']) != len(values['buckets']):
+                    merged['histograms'][name][key] = json.loads(json.dumps(values))
+                    continue
+                target['buckets'] = [a + b for a, b in zip(target['buckets'], values['buckets'])]
+                target['sum'] += values['sum']
+                target['count'] += values['count']
+        for name, series in data.get('counters', {}).items():
+            for key, value in series.items():
+                merged['counters'][name][key] = merged['counters'][name].get(key, 0) + value
+    return merged
+
+
+def _format_labels(labels, extra=None):
+    items = sorted(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+def render(data):
+    """Render a (merged) snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for key, series in sorted(data['histograms'].get(name, {}).items()):
+            labels = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(buckets, series['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {series['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {series['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {series['count']}")
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for key, value in sorted(data['counters'].get(name, {}).items()):
+            lines.append(f'{name}{_format_labels(json.loads(key))} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that adds its encoding time to the current request."""
+
+    def dumps(self, obj, **kwargs):
+        # Sessions are encoded before `before_request` runs; not timed
+        if not has_request_context() or 'metrics_serialization' not in g:
+            return super().dumps(obj, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            g.metrics_serialization += time.perf_counter() - start
+
+
+class Metrics:
+    """Request instrumentation of one application."""
+
+    def __init__(self, app):
+        self.registry = Registry()
+        self.directory = app.config.get('METRICS_DIR')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+        slow_ms = app.config.get('SLOW_REQUEST_MS')
+        self.slow_seconds = slow_ms / 1000 if slow_ms is not None else None
+        self.logger = app.logger
+        self._flushed_at = 0
+        self._flush_lock = threading.Lock()
+
+    # -- SQLAlchemy engine events -------------------------------------
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._statement_finished(conn, statement)
+
+    def handle_error(self, context):
+        # A failed statement gets no after_cursor_execute; pop its start
+        # time so it does not stay on the pooled connection's stack
+        if context.connection is not None and context.execution_context is not None:
+            self._statement_finished(context.connection, context.statement)
+
+    def _statement_finished(self, conn, statement):
+        started = conn.info.get('metrics_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        if not has_request_context() or 'metrics_start' not in g:
+            return
+        g.metrics_queries += 1
+        g.metrics_db += elapsed
+        if self.slow_seconds is not None and len(g.metrics_statements) < MAX_LOGGED_STATEMENTS:
+            g.metrics_statements.append((elapsed, statement))
+
+    # -- Flask request lifecycle --------------------------------------
+
+    def before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db = 0.0
+        g.metrics_serialization = 0.0
+        g.metrics_statements = []
+
+    def after_request(self, response):
+        if 'metrics_start' not in g:
+            return response
+        wall = time.perf_counter() - g.metrics_start
+        labels = {'endpoint': request.endpoint or 'unmatched', 'method': request.method}
+        registry = self.registry
+        registry.observe('smartq_request_duration_seconds', labels, wall)
+        registry.observe('smartq_request_db_seconds', labels, g.metrics_db)
+        registry.observe('smartq_request_queries', labels, g.metrics_queries)
+        registry.observe('smartq_request_serialization_seconds', labels, g.metrics_serialization)
+        registry.inc('smartq_requests_total', {**labels, 'status': str(response.status_code)})
+
+        if self.slow_seconds is not None and wall >= self.slow_seconds:
+            self.log_slow_request(labels, wall)
+        self.maybe_flush()
+        return response
+
+    def log_slow_request(self, labels, wall):
+        statements = '\n'.join(f'  {elapsed * 1000:8.2f} ms  {" ".join(sql.split())[:500]}'
+                               for elapsed, sql in g.metrics_statements)
+        self.logger.warning(
+            'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, JSON %.1f ms\n%s',
+            labels['method'], request.full_path.rstrip('?'), labels['endpoint'], wall * 1000,
+            g.metrics_queries, g.metrics_db * 1000, g.metrics_serialization * 1000, statements)
+
+    # -- Cross-worker aggregation -------------------------------------
+
+    def _path(self):
+        return os.path.join(self.directory, f'worker-{os.getpid()}.json')
+
+    def flush(self):
+        """Write this worker's totals to its file in `METRICS_DIR`."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path()
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump(self.registry.snapshot(), handle)
+        os.replace(tmp_path, path)
+
+    def maybe_flush(self):
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if now - self._flushed_at < self.flush_interval or not self._flush_lock.acquire(False):
+            return
+        try:
+            self._flushed_at = now
+            self.flush()
+        finally:
+            self._flush_lock.release()
+
+    def collect(self):
+        """Return the merged totals of every worker (or just this one)."""
+        if not self.directory:
+            return self.registry.snapshot()
+        self.flush()
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as handle:
+                    snapshots.append(json.load(handle))
+            except (OSError, ValueError):
+                # A file being replaced or a partial write; skip it this scrape
+                continue
+        return merge(snapshots)
+
+
+def count(name, labels, amount=1):
+    """Add to a counter of the current application, if it is instrumented."""
+    metrics = current_app.extensions.get('smartq_metrics')
+    if metrics:
+        metrics.registry.inc(name, labels, amount)
+
+
+def init_app(app):
+    """Install the instrumentation and the `/metrics` endpoint on `app`."""
+    metrics = Metrics(app)
+    app.extensions['smartq_metrics'] = metrics
+    app.json = TimedJSONProvider(app)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', metrics.before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', metrics.after_cursor_execute)
+    event.listen(engine, 'handle_error', metrics.handle_error)
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(render(metrics.collect()),
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -5,14 +5,24 @@ This module defines SQLAlchemy models used across the application:
 - User: users (super_admin, admin, staff)
 - Service: definable service points within an organization
 - QueueItem: individual queue tickets
+- QueueItemArchive: finished tickets of past days, moved out of `queue_items`
+- ServiceDailyCounter: per-service, per-day ticket number sequence
+- ServiceDailyStats: per-service, per-day rollup of served/skipped tickets
+- ServiceWaitEstimate: per-service moving averages used for wait estimates
+- Notification: outbox of SMS messages awaiting delivery
+- QueueEvent: append-only log of ticket transitions
+- ProjectionCheckpoint: last event applied to each derived view
+- ServiceHourlyStats: per-service, per-hour arrivals and outcomes
+- StaffServicePool: extra services a staff member may serve in pool mode
+- ServiceSlot: bookable appointment slot of a service
 
 Each model exposes a `to_dict` helper used by the API endpoints to
 serialize model instances to JSON-friendly dictionaries.
 """
 
-from datetime import datetime
+from datetime import datetime, date
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
 
 
 db = SQLAlchemy()
@@ -65,6 +75,10 @@ class User(db.Model):
     Roles include: 'super_admin', 'admin', 'staff'. Passwords are stored as
     salted hashes in `password_hash` via `set_password` / `check_password`.
     """
+    __table_args__ = (
+        # Counting the active staff of a service
+        db.Index('ix_users_service_last_active', 'service_id', 'last_active_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True,
@@ -77,18 +91,25 @@ class User(db.Model):
     service_id = db.Column(db.Integer, db.ForeignKey(
         'services.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Last queue action of a staff member, see `app.estimates.touch_staff`
+    last_active_at = db.Column(db.DateTime)
 
     # Relationships
     service = db.relationship(
         'Service', backref='staff_members', foreign_keys=[service_id])
+    pool = db.relationship(
+        'StaffServicePool', lazy=True, cascade='all, delete-orphan')
 
     def set_password(self, password):
         """Hash and store the provided plaintext password.
 
         This updates the `password_hash` field using Werkzeug's
-        `generate_password_hash` function.
+        `generate_password_hash` function with the configured
+        `PASSWORD_HASH_METHOD` (see `app.auth`).
         """
-        self.password_hash = generate_password_hash(password)
+        from app.auth import hash_password
+
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
         """Verify a plaintext password against the stored hash.
@@ -123,10 +144,22 @@ class Service(db.Model):
     avg_service_time = db.Column(db.Integer, default=10)  # minutes
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    # Policy choosing the next ticket, see `app.scheduling`
+    scheduler = db.Column(db.String(20), nullable=False, default='fifo', server_default='fifo')
 
     # Relationships
     queue_items = db.relationship(
         'QueueItem', backref='service', lazy=True, cascade='all, delete-orphan')
+    daily_counters = db.relationship(
+        'ServiceDailyCounter', lazy=True, cascade='all, delete-orphan')
+    daily_stats = db.relationship(
+        'ServiceDailyStats', lazy=True, cascade='all, delete-orphan')
+    wait_estimate = db.relationship(
+        'ServiceWaitEstimate', uselist=False, lazy=True, cascade='all, delete-orphan')
+    staff_pools = db.relationship(
+        'StaffServicePool', lazy=True, cascade='all, delete-orphan')
+    slots = db.relationship(
+        'ServiceSlot', lazy=True, cascade='all, delete-orphan')
 
     def to_dict(self):
         """Return a JSON-serializable dictionary representation of the service."""
@@ -136,7 +169,8 @@ class Service(db.Model):
             'organization_id': self.organization_id,
             'counter_number': self.counter_number,
             'avg_service_time': self.avg_service_time,
-            'is_active': self.is_active
+            'is_active': self.is_active,
+            'scheduler': self.scheduler
         }
 
 
@@ -146,19 +180,64 @@ class QueueItem(db.Model):
 
     Contains timestamps for creation, when the client was called, and when
     the service was completed. Status describes the current state and can
-    be one of: 'waiting', 'serving', 'done', 'skipped'.
+    be one of: 'booked', 'waiting', 'serving', 'done', 'skipped'.
+
+    `service_day` and `ticket_seq` identify the ticket within its service's
+    daily numbering; the pair is unique per service. `served_by` is the
+    staff member who called the ticket, and `change_seq` tracks when the
+    ticket last changed (see `ServiceDailyCounter`).
     """
+    __table_args__ = (
+        db.UniqueConstraint('service_id', 'service_day', 'ticket_seq',
+                            name='uq_queue_items_service_day_seq'),
+        # Claiming the next ticket is an index seek on this prefix
+        db.Index('ix_queue_items_service_status_created',
+                 'service_id', 'status', 'created_at'),
+        # ... under the 'priority' and 'weighted' schedulers
+        db.Index('ix_queue_items_service_status_priority',
+                 'service_id', 'status', 'priority', 'created_at'),
+        # ... under the 'appointment' scheduler
+        db.Index('ix_queue_items_service_status_slot',
+                 'service_id', 'status', 'scheduled_at', 'created_at'),
+        # Per-service daily stats and analytics windows
+        db.Index('ix_queue_items_service_status_day',
+                 'service_id', 'status', 'service_day'),
+        # The staff queue view: one service, one day, in arrival order
+        db.Index('ix_queue_items_service_day_created',
+                 'service_id', 'service_day', 'created_at'),
+        # Incremental staff queue view: rows changed since a version
+        db.Index('ix_queue_items_service_day_change',
+                 'service_id', 'service_day', 'change_seq'),
+        # The waiting tickets already told they are almost up
+        db.Index('ix_queue_items_service_status_almost_up',
+                 'service_id', 'status', 'almost_up_notified_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     queue_number = db.Column(db.String(20), nullable=False, index=True)
     service_id = db.Column(db.Integer, db.ForeignKey(
         'services.id'), nullable=False)
     phone_number = db.Column(db.String(15), nullable=False)
-    # waiting, serving, done, skipped
+    # booked, waiting, serving, done, skipped
     status = db.Column(db.String(20), default='waiting')
     created_at = db.Column(db.DateTime, default=datetime.now, index=True)
     called_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
+    # Stored creation date so day filters are plain equality/range predicates
+    service_day = db.Column(db.Date, nullable=False, default=date.today)
+    ticket_seq = db.Column(db.Integer)
+    served_by = db.Column(db.Integer, db.ForeignKey(
+        'users.id', ondelete='SET NULL'), nullable=True)
+    # Value of the day's change sequence when the ticket last changed
+    change_seq = db.Column(db.Integer)
+    # When the "you're almost up" SMS was queued (or the ticket joined close
+    # enough to the head not to need one)
+    almost_up_notified_at = db.Column(db.DateTime)
+    queue_class = db.Column(db.String(20), nullable=False, default='standard',
+                            server_default='standard')
+    # Lower is served first by the 'priority' scheduler
+    priority = db.Column(db.SmallInteger, nullable=False, default=50, server_default='50')
+    scheduled_at = db.Column(db.DateTime)
 
     def to_dict(self):
         """Return a JSON-serializable dictionary representation of the queue item."""
@@ -170,5 +249,242 @@ class QueueItem(db.Model):
             'status': self.status,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'called_at': self.called_at.isoformat() if self.called_at else None,
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'change_seq': self.change_seq,
+            'queue_class': self.queue_class,
+            'scheduled_at': self.scheduled_at.isoformat() if self.scheduled_at else None
+        }
+
+
+class QueueItemArchive(db.Model):
+    __tablename__ = 'queue_items_archive'
+    """A finished ticket of a past day.
+
+    `app.archive.archive_finished` moves done and skipped tickets out of
+    `queue_items` once their day is over, keeping their id, so the live
+    table only holds today's tickets and the ones still open. History
+    readers (analytics, export, stats rebuilds) read both tables.
+    """
+    __table_args__ = (
+        # Analytics windows and per-service cleanup
+        db.Index('ix_queue_items_archive_service_status_day',
+                 'service_id', 'status', 'service_day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    queue_number = db.Column(db.String(20), nullable=False)
+    service_id = db.Column(db.Integer, db.ForeignKey(
+        'services.id'), nullable=False)
+    phone_number = db.Column(db.String(15), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime)
+    called_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    service_day = db.Column(db.Date, nullable=False)
+    ticket_seq = db.Column(db.Integer)
+    served_by = db.Column(db.Integer, db.ForeignKey(
+        'users.id', ondelete='SET NULL'), nullable=True)
+    queue_class = db.Column(db.String(20), nullable=False, default='standard',
+                            server_default='standard')
+    scheduled_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class ServiceDailyCounter(db.Model):
+    __tablename__ = 'service_daily_counters'
+    """Last ticket number handed out for a service on a given day.
+
+    One row per (service, day). Ticket numbers are allocated by atomically
+    incrementing `last_seq`, see `app.queue_ops.issue_ticket`. `change_seq`
+    is bumped on every change to one of the day's tickets and versions the
+    staff queue view. `reset_seq` is the version at which tickets last left
+    the service (see `app.queue_ops.transfer_tickets`); views older than it
+    are reloaded in full.
+    """
+
+    service_id = db.Column(db.Integer, db.ForeignKey(
+        'services.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+    change_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    reset_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+class ServiceDailyStats(db.Model):
+    __tablename__ = 'service_daily_stats'
+    """Daily rollup of finished tickets for a service.
+
+    Maintained incrementally in the same transaction as each queue
+    transition (see `app.stats.record_transition`), keyed by the day the
+    ticket was issued. Wait time is `called_at - created_at`, service time
+    is `completed_at - called_at`; `wait_samples` counts the served tickets
+    that have a `called_at` and therefore contribute to the wait total.
+    """
+
+    service_id = db.Column(db.Integer, db.ForeignKey(
+        'services.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    served_count = db.Column(db.Integer, nullable=False, default=0)
+    skipped_count = db.Column(db.Integer, nullable=False, default=0)
+    wait_samples = db.Column(db.Integer, nullable=False, default=0)
+    total_wait_seconds = db.Column(db.Float, nullable=False, default=0)
+    total_service_seconds = db.Column(db.Float, nullable=False, default=0)
+
+
+class ServiceWaitEstimate(db.Model):
+    __tablename__ = 'service_wait_estimates'
+    """Running estimates of how fast a service gets through its queue.
+
+    Updated on every completed ticket (see `app.estimates.record_completion`).
+    `ewma_service_seconds` is an exponentially weighted moving average of
+    `completed_at - called_at`; `ewma_interval_seconds` averages the time
+    between consecutive completions, i.e. the inverse of the service's
+    current throughput across all of its counters.
+    """
+
+    service_id = db.Column(db.Integer, db.ForeignKey(
+        'services.id'), primary_key=True)
+    samples = db.Column(db.Integer, nullable=False, default=0)
+    ewma_service_seconds = db.Column(db.Float)
+    ewma_interval_seconds = db.Column(db.Float)
+    last_completed_at = db.Column(db.DateTime)
+
+
+class Notification(db.Model):
+    __tablename__ = 'notifications'
+    """Outbox row for an SMS waiting to be delivered.
+
+    Rows are written in the same transaction as the change that triggers
+    them and delivered by `app.notifications.NotificationDispatcher`.
+    `next_attempt_at` is when the row may next be claimed: a retry time
+    while 'pending', the end of the claiming worker's lease while 'sending'.
+    """
+
+    __table_args__ = (
+        # Dispatcher claim: due rows in id order
+        db.Index('ix_notifications_status_next_attempt',
+                 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    queue_item_id = db.Column(db.Integer, db.ForeignKey(
+        'queue_items.id', ondelete='SET NULL'), nullable=True)
+    phone_number = db.Column(db.String(20), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    # pending, sending, sent, failed
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    sent_at = db.Column(db.DateTime)
+
+    queue_item = db.relationship('QueueItem')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'queue_item_id': self.queue_item_id,
+            'phone_number': self.phone_number,
+            'message': self.message,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None
         }
+
+
+class QueueEvent(db.Model):
+    __tablename__ = 'queue_events'
+    """One ticket transition, appended in the transaction that made it.
+
+    Rows are never updated or deleted, and reference tickets and services
+    without foreign keys so they outlive archiving. `kind` is a small
+    integer code, see `app.events`; `staff_id` is the staff member who
+    called, finished or skipped the ticket. The ticket's day and number
+    are repeated on every event so derived views can be rebuilt from the
+    log alone. `created_at` is when the transition happened for the ticket
+    (a booking admitted late joins at its slot); `recorded_at` is when the
+    event was written.
+    """
+    __table_args__ = (
+        # A ticket's history (auditing, replay lookups)
+        db.Index('ix_queue_events_queue_item', 'queue_item_id', 'id'),
+        # The events of one day's tickets (daily rollup rebuilds)
+        db.Index('ix_queue_events_day_ticket', 'service_day', 'queue_item_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    queue_item_id = db.Column(db.Integer, nullable=False)
+    service_id = db.Column(db.Integer, nullable=False)
+    service_day = db.Column(db.Date, nullable=False)
+    ticket_seq = db.Column(db.Integer)
+    kind = db.Column(db.SmallInteger, nullable=False)
+    staff_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+class ProjectionCheckpoint(db.Model):
+    __tablename__ = 'projection_checkpoints'
+    """Id of the last `QueueEvent` applied to a derived view.
+
+    Advanced in the same transaction as the changes the events caused,
+    see `app.events.catch_up`.
+    """
+
+    name = db.Column(db.String(50), primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class ServiceHourlyStats(db.Model):
+    __tablename__ = 'service_hourly_stats'
+    """Arrivals and outcomes of a service's tickets by hour of arrival.
+
+    Derived from the queue event log by the ``hourly-stats`` projection
+    (`app.events.HourlyStatsProjection`); it lags the live queue until the
+    projection catches up. Counters follow `ServiceDailyStats`.
+    """
+
+    service_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    hour = db.Column(db.SmallInteger, primary_key=True)
+    joined_count = db.Column(db.Integer, nullable=False, default=0)
+    served_count = db.Column(db.Integer, nullable=False, default=0)
+    skipped_count = db.Column(db.Integer, nullable=False, default=0)
+    wait_samples = db.Column(db.Integer, nullable=False, default=0)
+    total_wait_seconds = db.Column(db.Float, nullable=False, default=0)
+    total_service_seconds = db.Column(db.Float, nullable=False, default=0)
+
+
+class StaffServicePool(db.Model):
+    __tablename__ = 'staff_service_pools'
+    """A service a staff member may draw tickets from besides their own.
+
+    In pool mode the staff member's call-next serves whichever service of
+    their pool is the most loaded, see `app.balancing`.
+    """
+
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'users.id', ondelete='CASCADE'), primary_key=True)
+    service_id = db.Column(db.Integer, db.ForeignKey(
+        'services.id', ondelete='CASCADE'), primary_key=True)
+
+
+class ServiceSlot(db.Model):
+    __tablename__ = 'service_slots'
+    """A bookable appointment slot of a service.
+
+    Created by the slot's first booking, with a capacity derived from the
+    service's measured throughput (see `app.appointments`). `booked` is
+    only ever incremented by an UPDATE conditional on ``booked <
+    capacity``.
+    """
+
+    service_id = db.Column(db.Integer, db.ForeignKey(
+        'services.id'), primary_key=True)
+    starts_at = db.Column(db.DateTime, primary_key=True)
+    capacity = db.Column(db.Integer, nullable=False)
+    booked = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,509 @@
+"""Asynchronous SMS delivery through a transactional outbox.
+
+Requests never talk to the SMS provider. `enqueue_sms` adds a
+`Notification` row to the caller's transaction, so a message exists if
+and only if the change that triggered it was committed, and
+`dispatch_pending` wakes the delivery workers once it was.
+
+A `NotificationDispatcher` drains the outbox with a small pool of
+threads. Each worker claims a batch of due rows in one statement, sends
+them through the configured transport under a rate limit, and records
+all outcomes of the batch at once. The limit is counted in the state
+backend (`app.state`), so with a shared one it holds across all workers.
+Failed sends are retried with exponential backoff until
+`NOTIFICATION_MAX_ATTEMPTS` is reached. The pool is started inside each
+web worker on the first dispatch, or runs as its own process with
+``flask notifications-worker``; claims are atomic, so any number of
+dispatchers can share the outbox.
+"""
+
+import base64
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.engine import make_url
+
+from app.models import db, Notification
+from app.sql import supports_skip_locked
+from app.state import RespError, get_state
+
+
+class TransportError(Exception):
+    """Raised by a transport when a message could not be delivered.
+
+    Args:
+        message: Description of the failure.
+        retryable: False when sending again cannot succeed (e.g. an
+            invalid phone number), which fails the notification at once.
+    """
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ConsoleTransport:
+    """Print messages to stdout (the default for local development)."""
+
+    def send(self, phone_number, message):
+        print(f"📱 SMS to {phone_number}: {message}")
+
+
+class FakeTransport:
+    """Record messages in memory instead of sending them.
+
+    Args:
+        fail: Optional callable ``fail(phone_number, message)`` returning an
+            exception to raise for that message, or None to accept it.
+    """
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, phone_number, message):
+        error = self.fail(phone_number, message) if self.fail else None
+        if error:
+            raise error
+        with self._lock:
+            self.sent.append((phone_number, message))
+
+
+class TwilioTransport:
+    """Send messages with the Twilio REST API.
+
+    Throttling (HTTP 429), server errors and network failures are
+    retryable; other client errors (bad number, bad credentials) are not.
+    """
+
+    API_URL = 'https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json'
+
+    def __init__(self, account_sid, auth_token, from_number, timeout=10):
+        self.url = self.API_URL.format(sid=account_sid)
+        self.from_number = from_number
+        self.timeout = timeout
+        credentials = f'{account_sid}:{auth_token}'.encode()
+        self._authorization = 'Basic ' + base64.b64encode(credentials).decode()
+
+    def send(self, phone_number, message):
+        body = urllib.parse.urlencode(
+            {'To': phone_number, 'From': self.from_number, 'Body': message}).encode()
+        request = urllib.request.Request(self.url, data=body, method='POST', headers={
+            'Authorization': self._authorization,
+            'Content-Type': 'application/x-www-form-urlencoded',
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                return
+        except urllib.error.HTTPError as error:
+            try:
+                detail = json.loads(error.read()).get('message', error.reason)
+            except ValueError:
+                detail = error.reason
+            retryable = error.code == 429 or error.code >= 500
+            raise TransportError(f'Twilio {error.code}: {detail}', retryable) from error
+        except (urllib.error.URLError, TimeoutError) as error:
+            raise TransportError(f'Twilio unreachable: {error}') from error
+
+
+def create_transport(config):
+    """Build the transport named by `SMS_TRANSPORT` (console, twilio or fake)."""
+    name = config.get('SMS_TRANSPORT', 'console')
+    if name == 'console':
+        return ConsoleTransport()
+    if name == 'fake':
+        return FakeTransport()
+    if name == 'twilio':
+        return TwilioTransport(config['TWILIO_ACCOUNT_SID'], config['TWILIO_AUTH_TOKEN'],
+                               config['TWILIO_PHONE_NUMBER'])
+    raise ValueError(f'Unknown SMS_TRANSPORT: {name!r}')
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting sends to `rate` per second.
+
+    Up to `burst` messages may go out back to back; a rate of 0 disables
+    the limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, count=1):
+        """Block until a token is available and take up to `count` of them.
+
+        Returns:
+            int: Tokens taken; all of `count` when the limit is disabled.
+        """
+        if self.rate <= 0:
+            return count
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    taken = min(count, int(self._tokens))
+                    self._tokens -= taken
+                    return taken
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def release(self, count):
+        """Give back tokens taken but not used."""
+        if self.rate > 0 and count > 0:
+            with self._lock:
+                self._tokens = min(self.capacity, self._tokens + count)
+
+
+class SharedRateLimit:
+    """Limit sends to `rate` per second across every worker of a shared state backend.
+
+    Sends are counted per window of `window` seconds (one second, or long
+    enough for one message at lower rates) with an `app.state` counter, and
+    a full window makes the caller wait for the next one. Should the
+    backend be unreachable, sends fall back to a per-process `TokenBucket`
+    rather than stopping.
+    """
+
+    def __init__(self, state, rate):
+        self.state = state
+        self.rate = rate
+        self.window = max(1.0, 1 / rate) if rate > 0 else 1.0
+        self.allowance = max(1, int(rate * self.window))
+        self.fallback = TokenBucket(rate)
+        # Window the calling thread last took sends from (None: the fallback)
+        self._taken = threading.local()
+
+    def acquire(self, count=1):
+        """Block until the current window has room and take up to `count` sends of it.
+
+        Returns:
+            int: Sends taken; all of `count` when the limit is disabled.
+        """
+        if self.rate <= 0:
+            return count
+        while True:
+            now = time.time()
+            window = int(now // self.window)
+            key = f'sms-rate:{window}'
+            try:
+                sent = self.state.incr(key, count, ttl=2 * self.window + 1)
+                taken = max(0, min(count, self.allowance - (sent - count)))
+                if taken < count:
+                    # Only count the sends taken, so releases free them again
+                    self.state.incr(key, taken - count)
+            except (OSError, RespError):
+                current_app.logger.exception('SMS rate limit unavailable, limiting per process')
+                self._taken.window = None
+                return self.fallback.acquire(count)
+            if taken:
+                self._taken.window = window
+                return taken
+            time.sleep((window + 1) * self.window - now)
+
+    def release(self, count):
+        """Give back sends taken but not used, while their window is current."""
+        if self.rate <= 0 or count <= 0:
+            return
+        window = getattr(self._taken, 'window', None)
+        if window is None:
+            self.fallback.release(count)
+        elif window == int(time.time() // self.window):
+            try:
+                self.state.incr(f'sms-rate:{window}', -count)
+            except (OSError, RespError):
+                pass
+
+
+def enqueue_sms(phone_number, message, queue_item=None):
+    """Add an SMS to the outbox in the caller's transaction.
+
+    Call `dispatch_pending` after committing to deliver it right away.
+    """
+    notification = Notification(phone_number=phone_number, message=message,
+                                queue_item=queue_item)
+    db.session.add(notification)
+    return notification
+
+
+def dispatch_pending():
+    """Wake the application's dispatcher after an outbox row was committed."""
+    dispatcher = current_app.extensions.get('smartq_notifications')
+    if dispatcher:
+        dispatcher.wake()
+
+
+def retry_delay(attempts, base):
+    """Seconds to wait before attempt ``attempts + 1``, with jitter."""
+    delay = min(base * 2 ** (attempts - 1), 3600)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_batch(limit, lease_seconds):
+    """Claim up to `limit` due notifications for this worker and commit.
+
+    Claimed rows move to 'sending' with a lease of `lease_seconds`; rows
+    whose lease expired (their worker died mid-send) are due again. Uses
+    ``SKIP LOCKED`` where available, and a single conditional ``UPDATE ...
+    RETURNING`` on SQLite, which serializes writers.
+
+    Returns:
+        list: Rows with ``id``, ``phone_number``, ``message`` and ``attempts``.
+    """
+    now = datetime.now()
+    due = db.and_(Notification.status.in_(('pending', 'sending')),
+                  Notification.next_attempt_at <= now)
+    head = db.select(Notification.id).where(due).order_by(Notification.id).limit(limit)
+    claim = db.update(Notification).values(
+        status='sending',
+        attempts=Notification.attempts + 1,
+        next_attempt_at=now + timedelta(seconds=lease_seconds),
+    )
+    columns = (Notification.id, Notification.phone_number,
+               Notification.message, Notification.attempts)
+
+    if supports_skip_locked():
+        ids = db.session.scalars(head.with_for_update(skip_locked=True)).all()
+        if not ids:
+            db.session.rollback()
+            return []
+        db.session.execute(claim.where(Notification.id.in_(ids)),
+                           execution_options={'synchronize_session': False})
+        rows = db.session.execute(db.select(*columns).where(
+            Notification.id.in_(ids)).order_by(Notification.id)).all()
+    else:
+        rows = db.session.execute(
+            claim.where(Notification.id.in_(head), due).returning(*columns),
+            execution_options={'synchronize_session': False}
+        ).all()
+    db.session.commit()
+    return rows
+
+
+def _claimed(rows):
+    """Match `rows` while they are still under the claim they were read with.
+
+    A row whose lease ran out may have been claimed again, which counted
+    another attempt; its outcome then belongs to the new claim.
+    """
+    return db.and_(Notification.status == 'sending', db.tuple_(
+        Notification.id, Notification.attempts).in_([(row.id, row.attempts) for row in rows]))
+
+
+def record_results(results, max_attempts, retry_base):
+    """Store the outcome of a sent batch and commit.
+
+    Rows claimed again by another worker meanwhile are left alone.
+
+    Args:
+        results: ``(row, error)`` pairs from `claim_batch` rows, where
+            `error` is None for delivered messages.
+        max_attempts: Attempts after which a failing message is given up.
+        retry_base: Backoff of the first retry, in seconds.
+    """
+    now = datetime.now()
+    sent = [row for row, error in results if error is None]
+    if sent:
+        db.session.execute(
+            db.update(Notification).where(_claimed(sent)).values(
+                status='sent', sent_at=now, last_error=None),
+            execution_options={'synchronize_session': False})
+
+    failures = []
+    for row, error in results:
+        if error is None:
+            continue
+        retryable = getattr(error, 'retryable', True)
+        give_up = not retryable or row.attempts >= max_attempts
+        failures.append({
+            'row_id': row.id,
+            'row_attempts': row.attempts,
+            'new_status': 'failed' if give_up else 'pending',
+            'retry_at': now + timedelta(seconds=retry_delay(row.attempts, retry_base)),
+            'error': str(error)[:255],
+        })
+    if failures:
+        # One conditional UPDATE, sent as a single executemany
+        table = Notification.__table__
+        db.session.execute(
+            table.update().where(
+                table.c.id == db.bindparam('row_id'),
+                table.c.attempts == db.bindparam('row_attempts'),
+                table.c.status == 'sending',
+            ).values(status=db.bindparam('new_status'), next_attempt_at=db.bindparam('retry_at'),
+                     last_error=db.bindparam('error')),
+            failures)
+    db.session.commit()
+
+
+def release_claims(rows):
+    """Hand claimed rows that were not sent back to the outbox and commit.
+
+    They are due again at once and the claim does not count as an attempt.
+    """
+    if rows:
+        db.session.execute(
+            db.update(Notification).where(_claimed(rows)).values(
+                status='pending', attempts=Notification.attempts - 1,
+                next_attempt_at=datetime.now()),
+            execution_options={'synchronize_session': False})
+        db.session.commit()
+
+
+class NotificationDispatcher:
+    """Pool of threads delivering outbox rows through a transport.
+
+    Args:
+        app: Flask application, used to open app contexts in the workers.
+        transport: Object with a ``send(phone_number, message)`` method.
+        workers: Number of worker threads.
+        batch_size: Rows claimed per batch.
+        rate: Messages per second (0 for no limit). With a shared `state`
+            backend the rate holds across all workers, otherwise per process.
+        max_attempts: Attempts before a message is marked 'failed'.
+        retry_base: First retry delay in seconds, doubled on every retry.
+        poll_interval: Seconds an idle worker waits before looking for
+            messages queued by other processes or due for a retry.
+        lease: Seconds a claimed batch is reserved for its worker.
+        state: State backend (`app.state`) counting the sends against
+            `rate`.
+    """
+
+    def __init__(self, app, transport, workers=2, batch_size=20, rate=10,
+                 max_attempts=5, retry_base=5, poll_interval=5, lease=60, state=None):
+        self.app = app
+        self.transport = transport
+        self.workers = workers
+        self.batch_size = batch_size
+        if state is not None and state.shared:
+            self.limiter = SharedRateLimit(state, rate)
+        else:
+            self.limiter = TokenBucket(rate)
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads if they are not running yet."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'smartq-sms-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=None):
+        """Ask the workers to exit after their current batch and wait for them."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stopping.set()
+        self._wake.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def wake(self):
+        """Start the pool if needed and make idle workers look for work now."""
+        if self.workers:
+            self.start()
+            self._wake.set()
+
+    def run_once(self):
+        """Claim, send and record one batch. Returns the number of rows handled.
+
+        The rate allowance is taken before claiming and the claim sized to
+        it, so no send waits for the limiter while the lease runs. No send
+        starts after half the lease: the rows left are handed back rather
+        than sent once another dispatcher may have claimed them again.
+        """
+        with self.app.app_context():
+            allowed = self.limiter.acquire(self.batch_size)
+            batch = claim_batch(allowed, self.lease)
+            self.limiter.release(allowed - len(batch))
+            if not batch:
+                return 0
+            cutoff = time.monotonic() + self.lease / 2
+            results = []
+            for row in batch:
+                if time.monotonic() >= cutoff:
+                    break
+                try:
+                    self.transport.send(row.phone_number, row.message)
+                    results.append((row, None))
+                except Exception as error:
+                    results.append((row, error))
+            record_results(results, self.max_attempts, self.retry_base)
+            release_claims(batch[len(results):])
+            return len(batch)
+
+    def drain(self):
+        """Deliver every due message in the calling thread. Returns the count."""
+        total = 0
+        while True:
+            handled = self.run_once()
+            if not handled:
+                return total
+            total += handled
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                handled = self.run_once()
+            except Exception:
+                self.app.logger.exception('Notification dispatch failed')
+                handled = 0
+            if handled < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+
+def init_app(app):
+    """Create the application's dispatcher from its configuration.
+
+    The worker threads are only started by the first `dispatch_pending`,
+    so CLI commands and migrations never spawn them. They are never
+    started on an in-memory SQLite database, whose single shared
+    connection cannot host concurrent transactions; deliver with
+    `NotificationDispatcher.drain` there.
+    """
+    config = app.config
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    in_memory = url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+    app.extensions['smartq_notifications'] = NotificationDispatcher(
+        app,
+        create_transport(config),
+        workers=0 if in_memory else config.get('NOTIFICATION_WORKERS', 2),
+        batch_size=config.get('NOTIFICATION_BATCH_SIZE', 20),
+        rate=config.get('NOTIFICATION_RATE', 10),
+        max_attempts=config.get('NOTIFICATION_MAX_ATTEMPTS', 5),
+        retry_base=config.get('NOTIFICATION_RETRY_BASE', 5),
+        poll_interval=config.get('NOTIFICATION_POLL_INTERVAL', 5),
+        lease=config.get('NOTIFICATION_LEASE', 60),
+        state=get_state(app),
+    )
+
+
+def get_dispatcher(app=None):
+    """Return the dispatcher of `app` (the current app by default)."""
+    return (app or current_app).extensions['smartq_notifications']
@@ -0,0 +1,227 @@
+"""Staffing and capacity planning from a service's queue history.
+
+`demand_profile` reads what a service really sees from its tickets, live
+and archived (see `app.archive`), over the last `history_days` days with
+traffic:
+
+* arrival rates: tickets per hour of arrival, averaged over the days the
+  service had any tickets (closed days do not dilute the peak);
+* service times: the distribution of ``completed_at - called_at`` of its
+  served tickets, grouped in the database into `DURATION_BUCKET`-second
+  buckets.
+
+Both come from grouped queries, so the cost does not grow with the number
+of tickets in the window. `plan_staffing` then runs the profile through
+`app.simulation.simulate_days` to predict the wait percentiles of a given
+number of counters and to find the fewest counters that meet a wait
+target. A service without history falls back to its `avg_service_time`
+and has no arrivals until it has been open for a day.
+"""
+
+from collections import defaultdict, namedtuple
+from datetime import date, timedelta
+
+from flask import current_app
+
+from app.archive import HISTORY_MODELS
+from app.models import db, User
+from app.simulation import empirical, exponential, simulate_days
+from app.sql import seconds_between
+
+# Width of the service time buckets read from the database, in seconds
+DURATION_BUCKET = 10
+
+# Statuses of tickets that reached the queue ('booked' ones have not yet)
+_ARRIVED = ('waiting', 'serving', 'done', 'skipped')
+
+
+class DemandProfile(namedtuple('DemandProfile', 'rates service_times days samples')):
+    """What a service's history says about its demand.
+
+    `rates` is ``{hour: clients per hour}``, `service_times` a distribution
+    for `app.simulation.simulate_days`, `days` the number of days with
+    traffic it was measured on and `samples` the number of service times.
+    """
+
+
+def _arrivals(model, service_id, start_day, end_day):
+    hour = db.extract('hour', model.created_at).label('hour')
+    return (
+        db.select(model.service_day, hour, db.func.count().label('arrivals'))
+        .where(model.service_id == service_id, model.status.in_(_ARRIVED),
+               model.service_day >= start_day, model.service_day < end_day)
+        .group_by(model.service_day, hour)
+    )
+
+
+def _durations(model, service_id, start_day, end_day):
+    duration = seconds_between(model.called_at, model.completed_at)
+    bucket = (duration // DURATION_BUCKET).label('bucket')
+    return (
+        db.select(bucket, db.func.count().label('served'))
+        .where(model.service_id == service_id, model.status == 'done',
+               model.service_day >= start_day, model.service_day < end_day,
+               duration >= 0)
+        .group_by(bucket)
+    )
+
+
+def demand_profile(service, history_days=28, today=None):
+    """Measure the arrival rates and service times of `service` (a cached dict).
+
+    Today's tickets are left out, as the day is not over.
+    """
+    end_day = today or date.today()
+    start_day = end_day - timedelta(days=history_days)
+
+    per_hour = defaultdict(int)
+    open_days = set()
+    for row in db.session.execute(db.union_all(
+            *(_arrivals(model, service['id'], start_day, end_day) for model in HISTORY_MODELS))):
+        per_hour[int(row.hour)] += row.arrivals
+        open_days.add(row.service_day)
+
+    durations = defaultdict(int)
+    for row in db.session.execute(db.union_all(
+            *(_durations(model, service['id'], start_day, end_day) for model in HISTORY_MODELS))):
+        # Middle of the bucket; zero-length services still take a second
+        durations[max(1, int(row.bucket) * DURATION_BUCKET + DURATION_BUCKET // 2)] += row.served
+
+    rates = {hour: count / len(open_days) for hour, count in per_hour.items()}
+    samples = sum(durations.values())
+    if samples:
+        service_times = empirical(dict(durations))
+    else:
+        service_times = exponential((service['avg_service_time'] or 10) * 60)
+    return DemandProfile(rates, service_times, len(open_days), samples)
+
+
+def assigned_staff(service_id):
+    """Return the number of staff accounts assigned to a service."""
+    return db.session.scalar(
+        db.select(db.func.count()).select_from(User)
+        .where(User.service_id == service_id, User.role == 'staff'))
+
+
+def staffings_tried(target_minutes, maximum):
+    """Return the most staffings `plan_staffing` simulates with these arguments.
+
+    One without a target; with one, the doubling and the bisection of its
+    last step each try at most one staffing per bit of `maximum`, plus the
+    prediction itself.
+    """
+    if target_minutes is None:
+        return 1
+    return 1 + 2 * maximum.bit_length()
+
+
+def plan_staffing(profile, staff, target_minutes=None, percentile=0.9, days=None, seed=0):
+    """Predict the waits with `staff` counters and the counters a wait target needs.
+
+    The target is met when the `percentile` wait is at most
+    `target_minutes`. More counters never lengthen the waits of the same
+    simulated demand, so the smallest sufficient number is found by
+    doubling and bisection, up to `SIMULATION_MAX_STAFF`.
+
+    Returns:
+        dict: ``prediction`` for `staff` and, with a target, ``staff_needed``
+        (None if even the maximum misses it) and ``levels``, the predictions
+        of every staffing simulated, by number of counters.
+    """
+    config = current_app.config
+    days = days or config['SIMULATION_DAYS']
+    key = f'p{round(percentile * 100)}'
+    fractions = tuple(sorted({0.5, 0.9, 0.95, percentile}))
+    levels = {}
+
+    def predict(counters):
+        if counters not in levels:
+            levels[counters] = simulate_days(profile.rates, profile.service_times, counters,
+                                             days, seed, fractions)
+        return levels[counters]
+
+    def meets(counters):
+        return predict(counters)['percentiles'][key] <= target_minutes
+
+    result = {'prediction': predict(staff)}
+    if target_minutes is None:
+        return result
+
+    # Double until the target is met, then bisect the last step
+    maximum = config['SIMULATION_MAX_STAFF']
+    low, high = 1, 1
+    while high < maximum and not meets(high):
+        low, high = high + 1, min(high * 2, maximum)
+    if not meets(high):
+        needed = None
+    else:
+        while low < high:
+            middle = (low + high) // 2
+            if meets(middle):
+                high = middle
+            else:
+                low = middle + 1
+        needed = high
+    result.update({
+        'target': {'percentile': key, 'minutes': target_minutes},
+        'staff_needed': needed,
+        'levels': [levels[counters] for counters in sorted(levels)],
+    })
+    return result
+
+
+def simulation_request(args, service):
+    """Answer the admin simulation endpoint for `service` (a dict) from query `args`.
+
+    Optional arguments: ``staff`` (defaults to the staff assigned to the
+    service), ``days`` (defaults to `SIMULATION_DAYS`, or fewer when the
+    service is too busy for `SIMULATION_MAX_CLIENTS`), ``history_days``, ``service_minutes`` (replaces the
+    measured service times with an exponential distribution of that mean),
+    ``target_minutes`` and ``percentile`` (1-99, default 90).
+
+    Returns:
+        tuple: (JSON-serializable payload, HTTP status)
+    """
+    config = current_app.config
+    staff = args.get('staff', type=int) or assigned_staff(service['id']) or 1
+    days = args.get('days', config['SIMULATION_DAYS'], type=int)
+    history_days = args.get('history_days', config['SIMULATION_HISTORY_DAYS'], type=int)
+    service_minutes = args.get('service_minutes', type=float)
+    target_minutes = args.get('target_minutes', type=float)
+    percentile = args.get('percentile', 90, type=int)
+    if not 1 <= staff <= config['SIMULATION_MAX_STAFF']:
+        return {'error': f"staff must be between 1 and {config['SIMULATION_MAX_STAFF']}"}, 400
+    if not 1 <= days <= config['SIMULATION_MAX_DAYS']:
+        return {'error': f"days must be between 1 and {config['SIMULATION_MAX_DAYS']}"}, 400
+    if not 1 <= history_days <= 366 or not 1 <= percentile <= 99:
+        return {'error': 'history_days must be 1-366 and percentile 1-99'}, 400
+    if (service_minutes is not None and service_minutes <= 0) or \
+            (target_minutes is not None and target_minutes < 0):
+        return {'error': 'service_minutes must be positive and target_minutes not negative'}, 400
+
+    profile = demand_profile(service, history_days)
+    if service_minutes:
+        profile = profile._replace(service_times=exponential(service_minutes * 60))
+    # Each simulated client costs the same, so bound their number; without
+    # an explicit `days` a busy service simply gets fewer days
+    staffings = staffings_tried(target_minutes, config['SIMULATION_MAX_STAFF'])
+    per_day = sum(profile.rates.values()) * staffings
+    if 'days' not in args and per_day:
+        days = max(1, min(days, int(config['SIMULATION_MAX_CLIENTS'] // per_day)))
+    if days * per_day > config['SIMULATION_MAX_CLIENTS']:
+        return {'error': f"{days} day(s) of {sum(profile.rates.values()):.0f} clients for up to "
+                         f"{staffings} staffing(s) simulate more than "
+                         f"{config['SIMULATION_MAX_CLIENTS']} clients; ask for fewer days or "
+                         f"run `flask simulate-service`"}, 400
+    plan = plan_staffing(profile, staff, target_minutes, percentile / 100, days)
+    return {
+        'service_id': service['id'],
+        'history': {
+            'days': profile.days,
+            'arrivals_per_day': round(sum(profile.rates.values()), 1),
+            'arrivals_per_hour': {hour: round(rate, 2) for hour, rate in sorted(profile.rates.items())},
+            'service_samples': profile.samples,
+            'mean_service_minutes': round(profile.service_times.mean / 60, 1),
+        },
+        **plan,
+    }, 200
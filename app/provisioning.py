@@ -0,0 +1,371 @@
+"""Bulk provisioning of organizations, services, staff and admins.
+
+Onboarding loads whole batches of rows from JSON or CSV instead of one
+request per record. A batch is processed in four steps:
+
+1. every row's fields are validated on their own;
+2. usernames and references (services, organizations) are checked with
+   one set-based query per batch, plus duplicate detection within it;
+3. passwords are hashed: within a request on the worker's bounded
+   login hashing pool (`app.auth.HashingExecutor`), from `flask provision`
+   on a thread pool sized to the host's cores;
+4. the valid rows are inserted with a single executemany.
+
+Errors are reported per row, numbered from 1 in input order. By default a
+batch with any invalid row inserts nothing; with `skip_invalid` the valid
+rows are inserted anyway. The caller commits.
+
+The bulk endpoints accept at most `PROVISIONING_MAX_REQUEST_ACCOUNTS`
+staff or admin rows per request, so hashing never holds a web worker for
+long; larger imports go through `flask provision`.
+"""
+
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_request_context
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from app.auth import HashingBusy, hash_method
+from app.models import db, Organization, Service, User
+from app.scheduling import SCHEDULERS
+
+KINDS = ('organizations', 'services', 'staff', 'admins')
+
+
+class ProvisioningError(ValueError):
+    """The batch as a whole cannot be processed."""
+
+
+class ProvisioningConflict(ProvisioningError):
+    """Rows created concurrently by another request collide with the batch."""
+
+
+class RowError(ValueError):
+    """A single row is invalid."""
+
+
+def parse_rows(text, fmt):
+    """Return the list of row mappings in `text`.
+
+    Args:
+        text: Document contents.
+        fmt: 'json' (a list of objects, or ``{"rows": [...]}``) or 'csv'
+            (a header line naming the fields).
+    """
+    if fmt == 'json':
+        try:
+            data = json.loads(text)
+        except ValueError as error:
+            raise ProvisioningError(f'Invalid JSON: {error}') from None
+        if isinstance(data, dict):
+            data = data.get('rows')
+        if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+            raise ProvisioningError('Expected a list of objects or {"rows": [...]}')
+        rows = data
+    elif fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text.lstrip('\ufeff')))
+        if not reader.fieldnames:
+            raise ProvisioningError('CSV input needs a header line')
+        rows = [{(key or '').strip(): value for key, value in row.items()} for row in reader]
+    else:
+        raise ProvisioningError(f'Unsupported format: {fmt!r}')
+
+    max_rows = current_app.config['PROVISIONING_MAX_ROWS']
+    if len(rows) > max_rows:
+        raise ProvisioningError(f'At most {max_rows} rows per batch ({len(rows)} given)')
+    return rows
+
+
+def rows_from_request(request):
+    """Read the rows of a bulk request: a JSON body, a CSV body or a CSV/JSON upload."""
+    upload = request.files.get('file')
+    if upload is not None:
+        name = (upload.filename or '').lower()
+        fmt = 'json' if name.endswith('.json') or upload.mimetype == 'application/json' else 'csv'
+        try:
+            text = upload.read().decode('utf-8')
+        except UnicodeDecodeError:
+            raise ProvisioningError('Uploads must be UTF-8 encoded') from None
+        return parse_rows(text, fmt)
+    fmt = 'json' if request.is_json else 'csv' if request.mimetype == 'text/csv' else None
+    if fmt is None:
+        raise ProvisioningError('Send JSON, text/csv or a multipart "file" upload')
+    return parse_rows(request.get_data(as_text=True), fmt)
+
+
+# -- Field validation ---------------------------------------------------
+
+def _text(row, field, max_length, required=False):
+    value = row.get(field)
+    if value is not None and not isinstance(value, (str, int)):
+        raise RowError(f'{field} must be a string')
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        if required:
+            raise RowError(f'{field} is required')
+        return None
+    if len(value) > max_length:
+        raise RowError(f'{field} is longer than {max_length} characters')
+    return value
+
+
+def _integer(row, field, default=None, minimum=1):
+    value = row.get(field)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field} must be an integer') from None
+    if value < minimum:
+        raise RowError(f'{field} must be at least {minimum}')
+    return value
+
+
+def _choice(row, field, choices, default):
+    value = _text(row, field, 20) or default
+    if value not in choices:
+        raise RowError(f'{field} must be one of {", ".join(sorted(choices))}')
+    return value
+
+
+def _validate(rows, build):
+    """Run `build` on every row; return ``{row number: mapping}`` and the errors."""
+    valid, errors = {}, {}
+    for number, row in enumerate(rows, start=1):
+        try:
+            valid[number] = build(row)
+        except RowError as error:
+            errors[number] = str(error)
+    return valid, errors
+
+
+def _reject(valid, errors, number, message):
+    valid.pop(number, None)
+    errors.setdefault(number, message)
+
+
+# -- Set-based checks ---------------------------------------------------
+
+def _check_usernames(valid, errors):
+    """Reject usernames taken in the database or repeated in the batch."""
+    usernames = {mapping['username'] for mapping in valid.values()}
+    taken = set(db.session.scalars(
+        db.select(User.username).where(User.username.in_(usernames)))) if usernames else set()
+    seen = set()
+    for number, mapping in list(valid.items()):
+        username = mapping['username']
+        if username in taken:
+            _reject(valid, errors, number, f'username {username!r} already exists')
+        elif username in seen:
+            _reject(valid, errors, number, f'username {username!r} appears more than once')
+        seen.add(username)
+
+
+def _resolve(valid, errors, field, model, scope, label, required=False):
+    """Turn ``<field>_id`` or ``<field>`` (a name) into an id, with one query.
+
+    Ids must exist within `scope`; names must match exactly one row of it.
+    With `required`, rows giving neither are rejected.
+    """
+    ids = {m[f'{field}_id'] for m in valid.values() if m.get(f'{field}_id') is not None}
+    names = {m[field] for m in valid.values() if m.get(field) is not None}
+    by_id, by_name = set(), {}
+    if ids or names:
+        rows = db.session.execute(
+            db.select(model.id, model.name).where(*scope, db.or_(
+                model.id.in_(ids), model.name.in_(names)))).all()
+        for row_id, name in rows:
+            by_id.add(row_id)
+            by_name.setdefault(name, []).append(row_id)
+
+    for number, mapping in list(valid.items()):
+        name = mapping.pop(field, None)
+        if mapping.get(f'{field}_id') is not None:
+            if mapping[f'{field}_id'] not in by_id:
+                _reject(valid, errors, number, f'{label} {mapping[f"{field}_id"]} not found')
+        elif name is not None:
+            matches = by_name.get(name, [])
+            if len(matches) != 1:
+                problem = 'not found' if not matches else 'is ambiguous, use its id'
+                _reject(valid, errors, number, f'{label} {name!r} {problem}')
+            else:
+                mapping[f'{field}_id'] = matches[0]
+        elif required:
+            _reject(valid, errors, number, f'{field}_id or {field} is required')
+
+
+def hash_passwords(passwords):
+    """Hash `passwords`, preserving their order.
+
+    Inside a request the hashes run one at a time on the worker's login
+    hashing pool, sharing its bound with the logins; `HashingBusy` is
+    raised when that pool is full. Elsewhere (the CLI) they run in
+    parallel on `PROVISIONING_HASH_WORKERS` threads.
+    """
+    method = hash_method()
+    if has_request_context():
+        executor = current_app.extensions['smartq_auth']
+        return [executor.run(generate_password_hash, password, method) for password in passwords]
+    workers = current_app.config['PROVISIONING_HASH_WORKERS'] or os.cpu_count() or 1
+    if len(passwords) < 2 or workers < 2:
+        return [generate_password_hash(password, method) for password in passwords]
+    with ThreadPoolExecutor(max_workers=min(workers, len(passwords))) as executor:
+        return list(executor.map(generate_password_hash, passwords, [method] * len(passwords)))
+
+
+# -- Insertion ----------------------------------------------------------
+
+def _finish(model, rows, valid, errors, skip_invalid):
+    """Insert the valid mappings unless errors abort the batch; return the report."""
+    report = {
+        'rows': len(rows),
+        'created': 0,
+        'errors': [{'row': number, 'error': errors[number]} for number in sorted(errors)],
+    }
+    if not valid or (errors and not skip_invalid):
+        return report
+
+    mappings = [valid[number] for number in sorted(valid)]
+    if model is User:
+        hashes = hash_passwords([mapping.pop('password') for mapping in mappings])
+        for mapping, password_hash in zip(mappings, hashes):
+            mapping['password_hash'] = password_hash
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.insert(model), mappings)
+    except IntegrityError:
+        raise ProvisioningConflict(
+            'Some rows were created concurrently by another request; retry the batch') from None
+    report['created'] = len(mappings)
+    return report
+
+
+def _user(row):
+    return {
+        'username': _text(row, 'username', 80, required=True),
+        'password': _text(row, 'password', 255, required=True),
+    }
+
+
+def provision_organizations(rows, skip_invalid=False):
+    """Create organizations from rows with name, location and contact."""
+    valid, errors = _validate(rows, lambda row: {
+        'name': _text(row, 'name', 200, required=True),
+        'location': _text(row, 'location', 200) or '',
+        'contact': _text(row, 'contact', 50) or '',
+    })
+    return _finish(Organization, rows, valid, errors, skip_invalid)
+
+
+def provision_services(org_id, rows, skip_invalid=False):
+    """Create services of `org_id` from rows with name, counter_number, avg_service_time and scheduler.
+
+    A (name, counter_number) pair that already exists in the organization,
+    or repeats within the batch, is rejected, so re-running an import does
+    not duplicate services.
+    """
+    valid, errors = _validate(rows, lambda row: {
+        'organization_id': org_id,
+        'name': _text(row, 'name', 100, required=True),
+        'counter_number': _text(row, 'counter_number', 20) or '',
+        'avg_service_time': _integer(row, 'avg_service_time', default=10),
+        'scheduler': _choice(row, 'scheduler', SCHEDULERS, 'fifo'),
+        'is_active': True,
+    })
+
+    names = {mapping['name'] for mapping in valid.values()}
+    existing = {(name, counter or '') for name, counter in db.session.execute(
+        db.select(Service.name, Service.counter_number).where(
+            Service.organization_id == org_id, Service.name.in_(names)))} if names else set()
+    seen = set()
+    for number, mapping in list(valid.items()):
+        key = (mapping['name'], mapping['counter_number'])
+        if key in existing:
+            _reject(valid, errors, number, f'service {key[0]!r} at counter {key[1]!r} already exists')
+        elif key in seen:
+            _reject(valid, errors, number, f'service {key[0]!r} at counter {key[1]!r} appears more than once')
+        seen.add(key)
+    return _finish(Service, rows, valid, errors, skip_invalid)
+
+
+def provision_staff(org_id, rows, skip_invalid=False):
+    """Create staff of `org_id` from rows with username, password and a service.
+
+    The service is given as `service_id` or by its `service` name and must
+    belong to the organization.
+    """
+    valid, errors = _validate(rows, lambda row: {
+        **_user(row), 'role': 'staff', 'organization_id': org_id,
+        'service_id': _integer(row, 'service_id'),
+        'service': _text(row, 'service', 100),
+    })
+    _check_usernames(valid, errors)
+    _resolve(valid, errors, 'service', Service, (Service.organization_id == org_id,), 'service')
+    return _finish(User, rows, valid, errors, skip_invalid)
+
+
+def provision_admins(rows, skip_invalid=False):
+    """Create organization admins from rows with username, password and an organization.
+
+    The organization is required, given as `organization_id` or by its
+    `organization` name.
+    """
+    valid, errors = _validate(rows, lambda row: {
+        **_user(row), 'role': 'admin',
+        'organization_id': _integer(row, 'organization_id'),
+        'organization': _text(row, 'organization', 200),
+    })
+    _check_usernames(valid, errors)
+    _resolve(valid, errors, 'organization', Organization, (), 'organization', required=True)
+    return _finish(User, rows, valid, errors, skip_invalid)
+
+
+def provision(kind, rows, org_id=None, skip_invalid=False):
+    """Provision `rows` of `kind` (one of `KINDS`); services and staff need `org_id`."""
+    if kind in ('services', 'staff'):
+        if org_id is None or db.session.get(Organization, org_id) is None:
+            raise ProvisioningError(f'Organization {org_id} not found')
+        function = provision_services if kind == 'services' else provision_staff
+        return function(org_id, rows, skip_invalid)
+    if kind == 'organizations':
+        return provision_organizations(rows, skip_invalid)
+    if kind == 'admins':
+        return provision_admins(rows, skip_invalid)
+    raise ProvisioningError(f'Unknown kind: {kind!r}')
+
+
+def bulk_request(request, kind, org_id=None):
+    """Answer a bulk endpoint: provision the request's rows and commit them.
+
+    ``?skip_invalid=1`` inserts the valid rows of a batch with errors.
+
+    Returns:
+        tuple: (JSON-serializable report, HTTP status)
+    """
+    skip_invalid = request.args.get('skip_invalid', '').lower() in ('1', 'true', 'yes')
+    try:
+        rows = rows_from_request(request)
+        max_accounts = current_app.config['PROVISIONING_MAX_REQUEST_ACCOUNTS']
+        if kind in ('staff', 'admins') and len(rows) > max_accounts:
+            raise ProvisioningError(
+                f'At most {max_accounts} accounts per request ({len(rows)} given); '
+                'import larger batches with `flask provision`')
+        report = provision(kind, rows, org_id, skip_invalid)
+    except ProvisioningConflict as error:
+        db.session.rollback()
+        return {'error': str(error)}, 409
+    except ProvisioningError as error:
+        return {'error': str(error)}, 400
+    except HashingBusy:
+        db.session.rollback()
+        return {'error': 'Password hashing is busy, try again shortly'}, 503
+    if report['errors'] and not skip_invalid:
+        return report, 400
+    db.session.commit()
+    return report, 200
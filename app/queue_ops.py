@@ -0,0 +1,488 @@
+"""Queue state operations shared by the client and staff blueprints.
+
+The helpers in this module run inside the caller's transaction; callers
+are responsible for committing (and for notifying display screens once
+the commit succeeded). Every transition is appended to the queue event
+log (`app.events`) in that transaction.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import estimates, events, scheduling, stats
+from app.lookups import get_service
+from app.models import db, QueueItem, ServiceDailyCounter
+from app.notifications import enqueue_sms
+from app.state import get_state
+from app.sql import increment_row, supports_skip_locked
+
+
+def _bump_counters(service_id, day, **deltas):
+    """Increment counter columns of the (service, day) row and return it.
+
+    The row is updated with a single conditional UPDATE, which holds its
+    lock until the caller commits, so concurrent workers can never read
+    the same values. The first change of the day inserts the row (see
+    `increment_row`).
+
+    Returns:
+        Row: The updated ``(last_seq, change_seq)`` values.
+    """
+    counters = ServiceDailyCounter.__table__
+    increment_row(counters, {'service_id': service_id, 'day': day}, deltas)
+    return db.session.execute(
+        db.select(counters.c.last_seq, counters.c.change_seq).where(
+            counters.c.service_id == service_id, counters.c.day == day)
+    ).one()
+
+
+def issue_ticket(service, phone_number, day=None, queue_class=None, scheduled_at=None,
+                 booked=False):
+    """Create a waiting ticket for `service` with the next daily number.
+
+    Args:
+        service: Service payload from `app.lookups.get_service`.
+        phone_number: Client phone number.
+        day: Service day, defaults to today.
+        queue_class: One of `QUEUE_CLASSES`, defaults to `DEFAULT_QUEUE_CLASS`.
+        scheduled_at: Slot of a booked ticket; it is not called before it
+            (see `app.scheduling`).
+        booked: Issue an appointment ticket ('booked') that joins the
+            queue at `scheduled_at`, see `admit_bookings`.
+
+    Returns:
+        QueueItem: The new ticket, added to the session.
+    """
+    day = day or date.today()
+    queue_class = queue_class or scheduling.default_class()
+    priority = scheduling.class_priority(queue_class)
+    counters = _bump_counters(service['id'], day, last_seq=1, change_seq=1)
+    queue_item = QueueItem(
+        queue_number=f"{service['name'][:3].upper()}{counters.last_seq:03d}",
+        service_id=service['id'],
+        phone_number=phone_number,
+        status='booked' if booked else 'waiting',
+        service_day=day,
+        ticket_seq=counters.last_seq,
+        change_seq=counters.change_seq,
+        queue_class=queue_class,
+        priority=priority,
+        scheduled_at=scheduled_at
+    )
+    db.session.add(queue_item)
+    # The event needs the ticket's id
+    db.session.flush()
+    events.record_event(queue_item, events.BOOKED if booked else events.JOINED,
+                        at=queue_item.created_at)
+    return queue_item
+
+
+def record_changes(*items):
+    """Stamp changed tickets with fresh values of their day's change sequence.
+
+    Clients of the staff queue view ask for rows with a `change_seq`
+    greater than the last version they saw, see `queue_changes`.
+    """
+    groups = defaultdict(list)
+    for item in items:
+        groups[(item.service_id, item.service_day)].append(item)
+    for (service_id, day), group in groups.items():
+        last = _bump_counters(service_id, day, change_seq=len(group)).change_seq
+        for offset, item in enumerate(group):
+            item.change_seq = last - len(group) + 1 + offset
+
+
+def queue_version(service_id, day):
+    """Return the current change sequence of a service's day (0 if untouched)."""
+    counter = db.session.get(ServiceDailyCounter, (service_id, day))
+    return counter.change_seq if counter else 0
+
+
+def queue_reset_version(service_id, day):
+    """Return the version at which tickets last left a service's day (0 if never).
+
+    Incremental views older than this still list the tickets that left and
+    must be reloaded in full.
+    """
+    return db.session.scalar(
+        db.select(ServiceDailyCounter.reset_seq).where(
+            ServiceDailyCounter.service_id == service_id, ServiceDailyCounter.day == day)
+    ) or 0
+
+
+def mark_queue_changed(service_id):
+    """Advance the service's queue generation after a queue change committed.
+
+    The generation is an atomic counter in the state backend; see
+    `current_queue_version`.
+    """
+    get_state().incr(f'queue-generation:{service_id}')
+
+
+def current_queue_version(service_id, day):
+    """`queue_version`, answered from the shared state backend when possible.
+
+    Versions are cached per queue generation. The generation only moves
+    after a change committed, so a version cached under the current
+    generation was read after every change the generation stands for.
+    Without a shared backend other workers' changes would not move the
+    generation, so the database is read every time.
+    """
+    state = get_state()
+    if not state.shared:
+        return queue_version(service_id, day)
+    generation = state.get(f'queue-generation:{service_id}') or 0
+    return state.get_or_load(
+        f'queue-version:{service_id}:{day.isoformat()}:{generation}', 300,
+        lambda: queue_version(service_id, day))
+
+
+def queue_changes(service_id, day, since=0):
+    """Return the service's tickets for `day` changed after version `since`.
+
+    With `since` 0 every ticket of the day is returned, in arrival order.
+    """
+    query = QueueItem.query.filter_by(service_id=service_id, service_day=day)
+    if since:
+        query = query.filter(QueueItem.change_seq > since)
+    return query.order_by(QueueItem.created_at).all()
+
+
+def admit_bookings(service_id, now=None):
+    """Move today's booked tickets of a service whose slot is due into the queue.
+
+    A booking is due `APPOINTMENT_CALL_AHEAD` seconds before its slot. It
+    becomes 'waiting' with its slot time (or now, if that is earlier) as
+    arrival time, so it takes its place in the queue at its slot time, and
+    its 'joined' event is logged then. Due bookings are found with one
+    seek on the ``(service_id, status, scheduled_at)`` index; like
+    `claim_next_ticket`, MySQL/PostgreSQL lock them with SKIP LOCKED and
+    SQLite moves them with one conditional UPDATE.
+
+    Returns:
+        list[QueueItem]: The admitted tickets.
+    """
+    now = now or datetime.now()
+    ahead = timedelta(seconds=current_app.config['APPOINTMENT_CALL_AHEAD'])
+    due = (QueueItem.service_id == service_id, QueueItem.status == 'booked',
+           QueueItem.scheduled_at <= now + ahead, QueueItem.service_day == now.date())
+
+    if supports_skip_locked():
+        items = QueueItem.query.filter(*due).order_by(QueueItem.scheduled_at).with_for_update(
+            skip_locked=True).all()
+        for item in items:
+            item.status = 'waiting'
+            item.created_at = min(item.scheduled_at, now)
+    else:
+        arrival = db.case((QueueItem.scheduled_at < now, QueueItem.scheduled_at), else_=now)
+        items = db.session.execute(
+            db.update(QueueItem).where(*due).values(status='waiting', created_at=arrival)
+            .returning(QueueItem),
+            execution_options={'synchronize_session': False, 'populate_existing': True}
+        ).scalars().all()
+    if items:
+        record_changes(*items)
+        for item in items:
+            events.record_event(item, events.JOINED, at=item.created_at)
+    return items
+
+
+def _scheduler(service_id):
+    service = get_service(service_id)
+    return scheduling.get_scheduler(service['scheduler'] if service else None)
+
+
+def _lane_query(service_id, lane):
+    return QueueItem.query.filter(
+        QueueItem.service_id == service_id, QueueItem.status == 'waiting', *lane.where(QueueItem)
+    ).order_by(*lane.order_by(QueueItem))
+
+
+def upcoming_tickets(service_id, limit, now=None):
+    """Return the next `limit` waiting tickets in the order the scheduler calls them.
+
+    Reads the first `limit` tickets of each of the scheduler's lanes (one
+    index range each) and interleaves them by `Scheduler.call_sequence`.
+    Tickets joining later may still be called earlier.
+    """
+    now = now or datetime.now()
+    scheduler = _scheduler(service_id)
+    lanes = scheduler.lanes(service_id, now, peek=True)
+    heads = [_lane_query(service_id, lane).limit(limit).all() for lane in lanes]
+    sizes = [len(head) for head in heads]
+    taken = [0] * len(heads)
+    upcoming = []
+    for index in scheduler.call_sequence(service_id, sizes):
+        if len(upcoming) == limit:
+            break
+        upcoming.append(heads[index][taken[index]])
+        taken[index] += 1
+    return upcoming
+
+
+def tickets_ahead(item, now=None):
+    """Return how many waiting tickets the scheduler calls before `item`.
+
+    Counts, in one statement, the tickets of every lane and those of
+    `item`'s own lane ranked before it (a row-value comparison on the
+    lane's ordering), then plays `Scheduler.call_sequence` over the
+    counts. None if `item` is not callable yet.
+    """
+    now = now or datetime.now()
+    scheduler = _scheduler(item.service_id)
+    lanes = scheduler.lanes(item.service_id, now, peek=True)
+    columns = []
+    for lane in lanes:
+        rows = db.select(db.func.count()).select_from(QueueItem).where(
+            QueueItem.service_id == item.service_id, QueueItem.status == 'waiting',
+            QueueItem.id != item.id, *lane.where(QueueItem))
+        columns += [
+            rows.scalar_subquery(),
+            rows.where(db.tuple_(*lane.order_by(QueueItem)) < db.tuple_(*lane.order_by(item)))
+            .scalar_subquery(),
+            db.select(db.func.count()).select_from(QueueItem).where(
+                QueueItem.id == item.id, QueueItem.status == 'waiting', *lane.where(QueueItem)
+            ).scalar_subquery(),
+        ]
+    counts = db.session.execute(db.select(*columns)).one()
+    own = next((index for index in range(len(lanes)) if counts[3 * index + 2]), None)
+    if own is None:
+        return None
+    sizes = [counts[3 * index + (1 if index == own else 0)] for index in range(len(lanes))]
+    sizes[own] += 1
+    called = 0
+    seen = 0
+    for index in scheduler.call_sequence(item.service_id, sizes):
+        if index == own:
+            seen += 1
+            if seen == sizes[own]:
+                return called
+        called += 1
+    return called
+
+
+def claim_next_ticket(service_id, staff_id=None):
+    """Atomically move the service's next waiting ticket to 'serving'.
+
+    The service's scheduler (see `app.scheduling`) says which ticket is
+    next as a list of lanes; the head of the first non-empty lane is
+    claimed, after due bookings joined the queue (`admit_bookings`).
+    Concurrent counters sharing a service each receive a distinct ticket:
+
+    * On MySQL/PostgreSQL the head of a lane is read with
+      ``SELECT ... FOR UPDATE SKIP LOCKED``, so a ticket already being
+      claimed by another transaction is passed over instead of waited on.
+    * Elsewhere (SQLite) a single conditional ``UPDATE ... WHERE id =
+      (head of the lane) AND status = 'waiting' RETURNING`` claims the
+      row; SQLite serializes writers, so the statement is atomic.
+
+    Either way each lane is one seek on a ``(service_id, status, ...)``
+    index.
+
+    Returns:
+        QueueItem | None: The claimed ticket, or None when nobody is waiting.
+    """
+    now = datetime.now()
+    admit_bookings(service_id, now)
+    scheduler = _scheduler(service_id)
+    for lane in scheduler.lanes(service_id, now):
+        item = _claim_head(service_id, staff_id, lane, now)
+        if item:
+            record_changes(item)
+            events.record_event(item, events.CALLED, staff_id, at=now)
+            return item
+    return None
+
+
+def _claim_head(service_id, staff_id, lane, now):
+    """Claim the oldest-ranked waiting ticket of `lane`; see `claim_next_ticket`."""
+    if supports_skip_locked():
+        item = _lane_query(service_id, lane).with_for_update(skip_locked=True).first()
+        if item:
+            item.status = 'serving'
+            item.called_at = now
+            item.served_by = staff_id
+        return item
+
+    head = aliased(QueueItem)
+    head_id = db.select(head.id).where(
+        head.service_id == service_id, head.status == 'waiting', *lane.where(head)
+    ).order_by(*lane.order_by(head)).limit(1).scalar_subquery()
+    claim = db.update(QueueItem).where(
+        QueueItem.id == head_id, QueueItem.status == 'waiting'
+    ).values(status='serving', called_at=now, served_by=staff_id).returning(QueueItem)
+    return db.session.execute(
+        claim, execution_options={'synchronize_session': False, 'populate_existing': True}
+    ).scalar_one_or_none()
+
+
+def reclassify_ticket(item, queue_class):
+    """Move the waiting ticket `item` to `queue_class`, keeping its place in arrival order."""
+    item.queue_class = queue_class
+    item.priority = scheduling.class_priority(queue_class)
+    record_changes(item)
+
+
+def transfer_tickets(source_id, target_id, ticket_ids=None, limit=None, staff_id=None):
+    """Move waiting tickets of `source_id` to `target_id`, keeping their order.
+
+    The tickets given by `ticket_ids` are moved, or else the `limit` oldest
+    waiting tickets of the source. They keep their queue number (the one
+    the client holds) and `created_at`, so they take their arrival place in
+    the target's queue, and get a block of new `ticket_seq` values reserved
+    from the target's daily counter. All of them are moved by one
+    ``UPDATE ... SET ticket_seq = CASE id ...``.
+
+    The source day's `reset_seq` is advanced so incremental staff views
+    drop the tickets that left (see `queue_reset_version`).
+
+    Returns:
+        list[QueueItem]: The moved tickets in arrival order.
+    """
+    today = date.today()
+    # Taken first: on SQLite this write holds the database lock, so no
+    # claim can move one of the tickets between reading and moving them
+    _bump_counters(source_id, today, change_seq=1)
+    query = QueueItem.query.filter(QueueItem.service_id == source_id, QueueItem.status == 'waiting')
+    if ticket_ids is not None:
+        query = query.filter(QueueItem.id.in_(ticket_ids))
+    query = query.order_by(QueueItem.created_at, QueueItem.id).limit(limit)
+    if supports_skip_locked():
+        query = query.with_for_update(skip_locked=True)
+    items = query.all()
+    if not items:
+        return []
+
+    by_day = defaultdict(list)
+    for item in items:
+        by_day[item.service_day].append(item)
+    seqs, versions = {}, {}
+    counters = ServiceDailyCounter.__table__
+    for day, group in by_day.items():
+        reserved = _bump_counters(target_id, day, last_seq=len(group), change_seq=len(group))
+        for offset, item in enumerate(group, start=1 - len(group)):
+            seqs[item.id] = reserved.last_seq + offset
+            versions[item.id] = reserved.change_seq + offset
+        if day != today:
+            _bump_counters(source_id, day, change_seq=1)
+        db.session.execute(
+            db.update(counters).where(counters.c.service_id == source_id, counters.c.day == day)
+            .values(reset_seq=counters.c.change_seq)
+        )
+
+    db.session.execute(
+        db.update(QueueItem).where(QueueItem.id.in_(seqs), QueueItem.status == 'waiting').values(
+            service_id=target_id,
+            ticket_seq=db.case(seqs, value=QueueItem.id),
+            change_seq=db.case(versions, value=QueueItem.id),
+            # Counted again from their place in the target's queue
+            almost_up_notified_at=None,
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    items = QueueItem.query.filter(QueueItem.id.in_(seqs)).order_by(
+        QueueItem.created_at, QueueItem.id).populate_existing().all()
+    now = datetime.now()
+    for item in items:
+        events.record_event(item, events.TRANSFERRED, staff_id, at=now)
+    return items
+
+
+# Statuses a ticket may be finished from, by final status
+FINISHABLE = {'done': ('serving',), 'skipped': ('booked', 'waiting', 'serving')}
+
+
+def finish_ticket(item, status, staff_id=None):
+    """Move `item` to a final status ('done' or 'skipped').
+
+    Only a ticket being served can be done, and only a booked, waiting
+    or serving one skipped (a booking that is cancelled or never shows).
+    The move is a conditional UPDATE on the current status, so of two
+    concurrent or repeated finishes only the first counts.
+    Completing a ticket stamps `completed_at` and updates the service's
+    wait estimator. The service's daily rollup and the event log are
+    updated in the same transaction.
+
+    Returns:
+        bool: False, with nothing changed, if the ticket could not be moved.
+    """
+    now = datetime.now()
+    before = stats.snapshot(item)
+    values = {'status': status}
+    if status == 'done':
+        values['completed_at'] = now
+    moved = db.session.execute(
+        db.update(QueueItem).where(
+            QueueItem.id == item.id, QueueItem.status.in_(FINISHABLE[status])
+        ).values(**values),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    if not moved:
+        return False
+    for key, value in values.items():
+        set_committed_value(item, key, value)
+    if status == 'done':
+        estimates.record_completion(item)
+    stats.record_transition(item, before)
+    record_changes(item)
+    events.record_event(item, events.DONE if status == 'done' else events.SKIPPED, staff_id, at=now)
+    return True
+
+
+def notify_almost_up(service_id, threshold):
+    """Queue an SMS for tickets that moved within `threshold` of the counter.
+
+    The first ``threshold + 1`` tickets the scheduler will call (see
+    `upcoming_tickets`) that have not been notified yet get the SMS, read
+    with one range query per lane however long the queue is. Each ticket
+    is flagged with a conditional UPDATE, so concurrent calls never notify
+    it twice. A higher class or an admitted booking can push a notified
+    ticket back out of that head; its flag is cleared, so it is told again
+    once it gets close. The flags are cleared by one index range over the
+    service's notified waiting tickets (a few more than the head), not
+    over its whole waiting list.
+
+    Returns:
+        int: Number of notifications queued.
+    """
+    if threshold <= 0:
+        return 0
+    head = upcoming_tickets(service_id, threshold + 1)
+    db.session.execute(
+        db.update(QueueItem).where(
+            QueueItem.service_id == service_id, QueueItem.status == 'waiting',
+            QueueItem.almost_up_notified_at.is_not(None),
+            QueueItem.id.not_in([item.id for item in head])
+        ).values(almost_up_notified_at=None),
+        execution_options={'synchronize_session': False}
+    )
+
+    service = None
+    queued = 0
+    now = datetime.now()
+    for ahead, item in enumerate(head):
+        if item.almost_up_notified_at is not None:
+            continue
+        flagged = db.session.execute(
+            db.update(QueueItem).where(
+                QueueItem.id == item.id, QueueItem.almost_up_notified_at.is_(None)
+            ).values(almost_up_notified_at=now),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        if not flagged:
+            continue
+        service = service or get_service(service_id)
+        if ahead == 0:
+            position = "You're next!"
+        else:
+            position = f"You're almost up, {ahead} {'person' if ahead == 1 else 'people'} ahead of you."
+        enqueue_sms(item.phone_number,
+                    f"SmartQ: {position} Ticket {item.queue_number}, "
+                    f"please head to counter {service['counter_number']}.",
+                    item)
+        queued += 1
+    return queued
@@ -1,7 +1,18 @@
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context
 from app.models import db, User, Service, QueueItem, Organization
+from app.auth import LoginRejected, authenticate
 from datetime import datetime, date, timedelta
 from functools import wraps
+from app.analytics import service_analytics
+from app.archive import delete_archived
+from app.balancing import pool_service_ids, set_pool, transfer_request
+from app.events import ticket_history
+from app.export import parse_key, stream_csv_gzip
+from app.lookups import get_organization as cached_organization, invalidate_organization, invalidate_service
+from app.planning import simulation_request
+from app.provisioning import bulk_request
+from app.scheduling import SCHEDULERS
+from app.display import invalidate_display
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -22,8 +33,11 @@ def login():
     username = data.get('username')
     password = data.get('password')
     
-    user = User.query.filter_by(username=username, role='admin').first()
-    if user and user.check_password(password):
+    try:
+        user = authenticate(username, password, 'admin', request.remote_addr)
+    except LoginRejected as error:
+        return jsonify({'error': str(error)}), error.status, {'Retry-After': str(error.retry_after)}
+    if user:
         session['user_id'] = user.id
         session['username'] = user.username
         session['role'] = user.role
@@ -47,8 +61,7 @@ def dashboard():
 def get_organization():
     """Get admin's organization info"""
     org_id = session.get('organization_id')
-    org = Organization.query.get(org_id)
-    return jsonify(org.to_dict() if org else {})
+    return jsonify(cached_organization(org_id) or {})
 
 @bp.route('/api/services', methods=['GET'])
 @admin_required
@@ -64,17 +77,32 @@ def create_service():
     """Create new service"""
     data = request.json
     org_id = session.get('organization_id')
+    if data.get('scheduler', 'fifo') not in SCHEDULERS:
+        return jsonify({'error': 'Unknown scheduler'}), 400
     
     service = Service(
         name=data['name'],
         organization_id=org_id,
         counter_number=data.get('counter_number', ''),
-        avg_service_time=data.get('avg_service_time', 10)
+        avg_service_time=data.get('avg_service_time', 10),
+        scheduler=data.get('scheduler', 'fifo')
     )
     db.session.add(service)
     db.session.commit()
+    invalidate_service(service.id, org_id)
     return jsonify(service.to_dict())
 
+@bp.route('/api/services/bulk', methods=['POST'])
+@admin_required
+def bulk_create_services():
+    """Create services from a JSON or CSV batch"""
+    org_id = session.get('organization_id')
+    report, status = bulk_request(request, 'services', org_id)
+    if report.get('created'):
+        # Drops the organization's cached list of active services
+        invalidate_organization(org_id)
+    return jsonify(report), status
+
 @bp.route('/api/services/<int:service_id>', methods=['PUT'])
 @admin_required
 def update_service(service_id):
@@ -86,12 +114,17 @@ def update_service(service_id):
         return jsonify({'error': 'Service not found'}), 404
     
     data = request.json
+    if data.get('scheduler', service.scheduler) not in SCHEDULERS:
+        return jsonify({'error': 'Unknown scheduler'}), 400
     service.name = data.get('name', service.name)
     service.counter_number = data.get('counter_number', service.counter_number)
     service.avg_service_time = data.get('avg_service_time', service.avg_service_time)
     service.is_active = data.get('is_active', service.is_active)
+    service.scheduler = data.get('scheduler', service.scheduler)
     
     db.session.commit()
+    invalidate_service(service.id, org_id)
+    invalidate_display(org_id)
     return jsonify(service.to_dict())
 
 @bp.route('/api/services/<int:service_id>', methods=['DELETE'])
@@ -104,10 +137,26 @@ def delete_service(service_id):
     if not service:
         return jsonify({'error': 'Service not found'}), 404
     
+    delete_archived([service.id])
     db.session.delete(service)
     db.session.commit()
+    invalidate_service(service_id, org_id)
+    invalidate_display(org_id)
     return jsonify({'success': True})
 
+@bp.route('/api/services/<int:service_id>/simulation', methods=['GET'])
+@admin_required
+def simulate_service(service_id):
+    """Predict waits and the staff needed for a service from its history"""
+    org_id = session.get('organization_id')
+    service = Service.query.filter_by(id=service_id, organization_id=org_id).first()
+    
+    if not service:
+        return jsonify({'error': 'Service not found'}), 404
+    
+    payload, status = simulation_request(request.args, service.to_dict())
+    return jsonify(payload), status
+
 @bp.route('/api/staff', methods=['GET'])
 @admin_required
 def get_staff():
@@ -139,6 +188,13 @@ def create_staff():
     db.session.commit()
     return jsonify(staff.to_dict())
 
+@bp.route('/api/staff/bulk', methods=['POST'])
+@admin_required
+def bulk_create_staff():
+    """Create staff members from a JSON or CSV batch"""
+    report, status = bulk_request(request, 'staff', session.get('organization_id'))
+    return jsonify(report), status
+
 @bp.route('/api/staff/<int:staff_id>', methods=['PUT'])
 @admin_required
 def update_staff(staff_id):
@@ -158,6 +214,40 @@ def update_staff(staff_id):
     db.session.commit()
     return jsonify(staff.to_dict())
 
+@bp.route('/api/staff/<int:staff_id>/pool', methods=['GET'])
+@admin_required
+def get_staff_pool(staff_id):
+    """Get the extra services a staff member may serve in pool mode"""
+    org_id = session.get('organization_id')
+    staff = User.query.filter_by(id=staff_id, organization_id=org_id, role='staff').first()
+    
+    if not staff:
+        return jsonify({'error': 'Staff not found'}), 404
+    
+    return jsonify({'service_ids': pool_service_ids(staff.id)})
+
+@bp.route('/api/staff/<int:staff_id>/pool', methods=['PUT'])
+@admin_required
+def update_staff_pool(staff_id):
+    """Replace the extra services a staff member may serve in pool mode"""
+    org_id = session.get('organization_id')
+    staff = User.query.filter_by(id=staff_id, organization_id=org_id, role='staff').first()
+    
+    if not staff:
+        return jsonify({'error': 'Staff not found'}), 404
+    
+    service_ids = (request.json or {}).get('service_ids')
+    if not isinstance(service_ids, list) or not all(isinstance(i, int) for i in service_ids):
+        return jsonify({'error': 'service_ids must be a list of ids'}), 400
+    found = set(db.session.scalars(db.select(Service.id).where(
+        Service.organization_id == org_id, Service.id.in_(service_ids))))
+    if found != set(service_ids):
+        return jsonify({'error': 'Service not found', 'service_ids': sorted(set(service_ids) - found)}), 404
+    
+    set_pool(staff.id, service_ids)
+    db.session.commit()
+    return jsonify({'service_ids': pool_service_ids(staff.id)})
+
 @bp.route('/api/staff/<int:staff_id>', methods=['DELETE'])
 @admin_required
 def delete_staff(staff_id):
@@ -172,6 +262,22 @@ def delete_staff(staff_id):
     db.session.commit()
     return jsonify({'success': True})
 
+@bp.route('/api/tickets/transfer', methods=['POST'])
+@admin_required
+def transfer_tickets():
+    """Move waiting tickets from one service to another"""
+    org_id = session.get('organization_id')
+    data = request.json or {}
+    source_id, target_id = data.get('from_service_id'), data.get('to_service_id')
+    services = Service.query.filter(Service.organization_id == org_id,
+                                    Service.id.in_([source_id, target_id])).count()
+    if not isinstance(source_id, int) or not isinstance(target_id, int) or \
+            services != len({source_id, target_id}):
+        return jsonify({'error': 'Service not found'}), 404
+    
+    payload, status = transfer_request(data, source_id, target_id)
+    return jsonify(payload), status
+
 @bp.route('/api/analytics', methods=['GET'])
 @admin_required
 def analytics():
@@ -181,32 +287,35 @@ def analytics():
     
     start_date = date.today() - timedelta(days=days)
     
-    # Get all services
-    services = Service.query.filter_by(organization_id=org_id).all()
+    # Grouped in the database: served counts, wait averages/percentiles
+    # and the hourly breakdown for every service at once
+    return jsonify(service_analytics(org_id, start_date))
+
+@bp.route('/api/tickets/<int:item_id>/events', methods=['GET'])
+@admin_required
+def ticket_events(item_id):
+    """Get the transitions of a ticket from the queue event log"""
+    org_id = session.get('organization_id')
+    history = ticket_history(item_id)
+    service_id = history[0]['service_id'] if history else None
+    if not history or not Service.query.filter_by(id=service_id, organization_id=org_id).first():
+        return jsonify({'error': 'Ticket not found'}), 404
+    return jsonify(history)
+
+@bp.route('/api/export', methods=['GET'])
+@admin_required
+def export_history():
+    """Stream the organization's queue history as gzip-compressed CSV"""
+    org_id = session.get('organization_id')
+    after = None
+    if request.args.get('after'):
+        try:
+            after = parse_key(request.args['after'])
+        except ValueError:
+            return jsonify({'error': 'after must be YYYY-MM-DD:ticket_id'}), 400
     
-    result = []
-    for service in services:
-        # Total served
-        served = QueueItem.query.filter_by(service_id=service.id, status='done').filter(
-            QueueItem.created_at >= start_date
-        ).count()
-        
-        # Average wait time
-        completed = QueueItem.query.filter_by(service_id=service.id, status='done').filter(
-            QueueItem.created_at >= start_date,
-            QueueItem.called_at.isnot(None)
-        ).all()
-        
-        avg_wait = 0
-        if completed:
-            total_wait = sum([(item.called_at - item.created_at).total_seconds() / 60 
-                              for item in completed])
-            avg_wait = round(total_wait / len(completed), 1)
-        
-        result.append({
-            'service_name': service.name,
-            'total_served': served,
-            'avg_wait_time': avg_wait
-        })
-    
-    return jsonify(result)
\ No newline at end of file
+    return Response(
+        stream_with_context(stream_csv_gzip(after=after, org_id=org_id)),
+        mimetype='application/gzip',
+        headers={'Content-Disposition': 'attachment; filename=queue_history.csv.gz'}
+    )
\ No newline at end of file
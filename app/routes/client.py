@@ -1,15 +1,17 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, Response, current_app
 from app.models import db, Service, QueueItem, Organization
+from app.appointments import BookingError, SlotFull, available_slots, book, cancel_booking
+from app.queue_ops import issue_ticket, tickets_ahead
+from app.scheduling import default_class, queue_classes
+from app.notifications import enqueue_sms, dispatch_pending
+from app.estimates import estimate_wait_minutes
+from app.lookups import get_active_services, get_organization, get_organizations as cached_organizations, get_service
+from app.display import get_display_snapshot, feed, notify_service_changed, stream_snapshots
 from datetime import datetime, date
 import random
 
 bp = Blueprint('client', __name__, url_prefix='/client')
 
-def send_sms_mock(phone, message):
-    """Mock SMS sending - replace with Twilio in production"""
-    print(f"📱 SMS to {phone}: {message}")
-    return True
-
 @bp.route('/')
 def index():
     """Client kiosk interface"""
@@ -18,8 +20,7 @@ def index():
 @bp.route('/api/organizations', methods=['GET'])
 def get_organizations():
     """Get all organizations for selection"""
-    orgs = Organization.query.all()
-    return jsonify([org.to_dict() for org in orgs])
+    return jsonify(cached_organizations())
 
 @bp.route('/api/services', methods=['GET'])
 def get_services():
@@ -28,8 +29,12 @@ def get_services():
     if not org_id:
         return jsonify({'error': 'Organization ID required'}), 400
     
-    services = Service.query.filter_by(organization_id=org_id, is_active=True).all()
-    return jsonify([s.to_dict() for s in services])
+    return jsonify(get_active_services(org_id))
+
+@bp.route('/api/queue-classes', methods=['GET'])
+def get_queue_classes():
+    """Get the ticket classes offered at the kiosk"""
+    return jsonify([name for name, spec in queue_classes().items() if spec.get('kiosk')])
 
 @bp.route('/api/join-queue', methods=['POST'])
 def join_queue():
@@ -37,48 +42,107 @@ def join_queue():
     data = request.json
     service_id = data.get('service_id')
     phone = data.get('phone_number')
+    queue_class = data.get('queue_class') or default_class()
     
     if not service_id or not phone:
         return jsonify({'error': 'Service and phone number required'}), 400
+    if not queue_classes().get(queue_class, {}).get('kiosk'):
+        return jsonify({'error': 'Unknown queue class'}), 400
     
-    service = Service.query.get(service_id)
+    service = get_service(service_id)
     if not service:
         return jsonify({'error': 'Service not found'}), 404
     
-    # Generate queue number
-    today = date.today()
-    count = QueueItem.query.filter_by(service_id=service_id).filter(
-        db.func.date(QueueItem.created_at) == today
-    ).count()
+    # Create queue item numbered from the service's daily sequence
+    queue_item = issue_ticket(service, phone, queue_class=queue_class)
+    queue_number = queue_item.queue_number
     
-    queue_number = f"{service.name[:3].upper()}{count + 1:03d}"
+    # Its place in the order the service's scheduler calls tickets
+    ahead = tickets_ahead(queue_item)
+    estimated_wait = estimate_wait_minutes(service, ahead)
+    if ahead <= current_app.config['ALMOST_UP_THRESHOLD']:
+        # The join SMS already says how close it is, no "almost up" SMS
+        queue_item.almost_up_notified_at = datetime.now()
     
-    # Calculate estimated wait time
-    waiting = QueueItem.query.filter_by(service_id=service_id, status='waiting').count()
-    estimated_wait = waiting * service.avg_service_time
-    
-    # Create queue item
-    queue_item = QueueItem(
-        queue_number=queue_number,
-        service_id=service_id,
-        phone_number=phone,
-        status='waiting'
-    )
-    db.session.add(queue_item)
+    # Queue the SMS in the same transaction; it is sent in the background
+    sms_message = f"SmartQ: Your ticket {queue_number} for {service['name']}. Counter: {service['counter_number']}. Est. wait: {estimated_wait} min."
+    enqueue_sms(phone, sms_message, queue_item)
     db.session.commit()
-    
-    # Send SMS
-    sms_message = f"SmartQ: Your ticket {queue_number} for {service.name}. Counter: {service.counter_number}. Est. wait: {estimated_wait} min."
-    send_sms_mock(phone, sms_message)
+    notify_service_changed(service_id)
+    dispatch_pending()
     
     return jsonify({
         'success': True,
         'queue_number': queue_number,
-        'counter': service.counter_number,
+        'counter': service['counter_number'],
         'estimated_wait': estimated_wait,
-        'position': waiting + 1
+        'position': ahead + 1
+    })
+
+@bp.route('/api/slots', methods=['GET'])
+def get_slots():
+    """Get the bookable slots of a service on a day"""
+    service = get_service(request.args.get('service_id'))
+    if not service:
+        return jsonify({'error': 'Service not found'}), 404
+    try:
+        day = date.fromisoformat(request.args.get('day') or date.today().isoformat())
+    except ValueError:
+        return jsonify({'error': 'Invalid day'}), 400
+    
+    return jsonify(available_slots(service, day))
+
+@bp.route('/api/book', methods=['POST'])
+def book_slot():
+    """Book an appointment slot"""
+    data = request.json or {}
+    phone = data.get('phone_number')
+    if not phone or not data.get('starts_at'):
+        return jsonify({'error': 'Slot and phone number required'}), 400
+    
+    service = get_service(data.get('service_id'))
+    if not service or not service['is_active']:
+        return jsonify({'error': 'Service not found'}), 404
+    try:
+        starts_at = datetime.fromisoformat(data['starts_at'])
+        if starts_at.tzinfo:
+            starts_at = starts_at.astimezone().replace(tzinfo=None)
+        queue_item = book(service, phone, starts_at)
+    except SlotFull as error:
+        return jsonify({'error': str(error)}), 409
+    except (BookingError, ValueError) as error:
+        return jsonify({'error': str(error)}), 400
+    
+    enqueue_sms(phone, f"SmartQ: Your ticket {queue_item.queue_number} for {service['name']} "
+                       f"is booked for {starts_at:%d %b %H:%M}. Counter: {service['counter_number']}.",
+                queue_item)
+    db.session.commit()
+    notify_service_changed(service['id'])
+    dispatch_pending()
+    
+    return jsonify({
+        'success': True,
+        'ticket_id': queue_item.id,
+        'queue_number': queue_item.queue_number,
+        'counter': service['counter_number'],
+        'starts_at': starts_at.isoformat()
     })
 
+@bp.route('/api/bookings/<int:ticket_id>/cancel', methods=['POST'])
+def cancel_slot(ticket_id):
+    """Cancel a booked appointment"""
+    data = request.json or {}
+    queue_item = db.session.get(QueueItem, ticket_id)
+    if not queue_item or not data.get('phone_number') or \
+            queue_item.phone_number != data['phone_number']:
+        return jsonify({'error': 'Booking not found'}), 404
+    if not cancel_booking(queue_item):
+        return jsonify({'error': 'Booking can no longer be cancelled'}), 409
+    
+    db.session.commit()
+    notify_service_changed(queue_item.service_id)
+    return jsonify({'success': True})
+
 @bp.route('/display')
 def display():
     """Unified display screen for all services in an organization"""
@@ -91,34 +155,27 @@ def display_status():
     if not org_id:
         return jsonify({'error': 'Organization ID required'}), 400
     
-    services = Service.query.filter_by(organization_id=org_id, is_active=True).all()
-    
-    result = []
-    for service in services:
-        # Get currently serving
-        serving = QueueItem.query.filter_by(
-            service_id=service.id,
-            status='serving'
-        ).order_by(QueueItem.called_at.desc()).first()
-        
-        # Get next in queue
-        next_item = QueueItem.query.filter_by(
-            service_id=service.id,
-            status='waiting'
-        ).order_by(QueueItem.created_at).first()
-        
-        # Get waiting count
-        waiting_count = QueueItem.query.filter_by(
-            service_id=service.id,
-            status='waiting'
-        ).count()
-        
-        result.append({
-            'service_name': service.name,
-            'counter': service.counter_number,
-            'now_serving': serving.queue_number if serving else None,
-            'next': next_item.queue_number if next_item else None,
-            'waiting': waiting_count
-        })
-    
-    return jsonify(result)
\ No newline at end of file
+    return jsonify(get_display_snapshot(org_id))
+
+@bp.route('/api/display-stream', methods=['GET'])
+def display_stream():
+    """Server-Sent Events stream of display snapshots for an organization"""
+    org_id = request.args.get('org_id', type=int)
+    if not org_id:
+        return jsonify({'error': 'Organization ID required'}), 400
+    
+    if get_organization(org_id) is None:
+        return jsonify({'error': 'Organization not found'}), 404
+    
+    # Changes published before the subscription are picked up by the resync
+    initial = get_display_snapshot(org_id)
+    subscription = feed.subscribe(org_id, current_app.config['DISPLAY_STREAM_MAX'])
+    if subscription is None:
+        error = 'Too many display streams, poll /client/api/display-status'
+        return jsonify({'error': error}), 503, {'Retry-After': '60'}
+    
+    return Response(
+        stream_snapshots(current_app._get_current_object(), org_id, subscription, initial),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -1,5 +1,14 @@
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
+from flask import Blueprint, current_app, render_template, request, jsonify, session, redirect, url_for
 from app.models import db, User, QueueItem, Service
+from app.auth import LoginRejected, authenticate
+from app.display import notify_service_changed
+from app.queue_ops import claim_next_ticket, finish_ticket, current_queue_version, queue_changes, queue_reset_version, notify_almost_up, reclassify_ticket
+from app.balancing import draw_order, pool_service_ids, service_loads, transfer_request
+from app.scheduling import queue_classes
+from app.notifications import dispatch_pending
+from app.estimates import touch_staff, release_staff
+from app.stats import get_daily_stats
+from app.lookups import get_service
 from datetime import datetime, date
 from functools import wraps
 
@@ -22,18 +31,26 @@ def login():
     username = data.get('username')
     password = data.get('password')
     
-    user = User.query.filter_by(username=username, role='staff').first()
-    if user and user.check_password(password):
+    try:
+        user = authenticate(username, password, 'staff', request.remote_addr)
+    except LoginRejected as error:
+        return jsonify({'error': str(error)}), error.status, {'Retry-After': str(error.retry_after)}
+    if user:
         session['user_id'] = user.id
         session['username'] = user.username
         session['role'] = user.role
         session['service_id'] = user.service_id
+        touch_staff(user.id)
+        db.session.commit()
         return jsonify({'success': True})
     
     return jsonify({'error': 'Invalid credentials'}), 401
 
 @bp.route('/logout')
 def logout():
+    if session.get('role') == 'staff':
+        release_staff(session['user_id'])
+        db.session.commit()
     session.clear()
     return redirect(url_for('staff.login'))
 
@@ -42,6 +59,28 @@ def logout():
 def dashboard():
     return render_template('staff_dashboard.html')
 
+def served_service_ids():
+    """Services the logged-in staff member draws from: their own, plus their pool in pool mode."""
+    service_id = session.get('service_id')
+    if session.get('pool_mode'):
+        return pool_service_ids(session['user_id'], service_id)
+    return [service_id] if service_id else []
+
+def may_handle(item):
+    """Whether the logged-in staff member may finish or skip `item`."""
+    return item is not None and (item.served_by == session['user_id']
+                                 or item.service_id in served_service_ids())
+
+def queue_etag(service_id, day, version):
+    """ETag of a service's queue view at a given change version."""
+    return f'{service_id}-{day.isoformat()}-{version}'
+
+def not_modified(etag):
+    """Empty 304 response telling the client its copy is still current."""
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
 @bp.route('/api/queue', methods=['GET'])
 @staff_required
 def get_queue():
@@ -52,11 +91,47 @@ def get_queue():
     
     # Get all queue items for today
     today = date.today()
-    queue_items = QueueItem.query.filter_by(service_id=service_id).filter(
-        db.func.date(QueueItem.created_at) == today
-    ).order_by(QueueItem.created_at).all()
+    etag = queue_etag(service_id, today, current_queue_version(service_id, today))
+    if etag in request.if_none_match:
+        return not_modified(etag)
+    
+    response = jsonify([item.to_dict() for item in queue_changes(service_id, today)])
+    response.set_etag(etag)
+    return response
+
+@bp.route('/api/queue/changes', methods=['GET'])
+@staff_required
+def get_queue_changes():
+    """Get queue items changed since the version the client last saw"""
+    service_id = session.get('service_id')
+    if not service_id:
+        return jsonify({'error': 'No service assigned'}), 400
+    
+    today = date.today()
+    since = request.args.get('since', 0, type=int)
+    version = current_queue_version(service_id, today)
+    same_day = request.args.get('day') == today.isoformat()
+    
+    etag = queue_etag(service_id, today, version)
+    if same_day and since == version:
+        return not_modified(etag)
+    
+    # A new day, a version from the future or tickets transferred away
+    # since then start the client over
+    full = (not same_day or since <= 0 or since > version
+            or since < queue_reset_version(service_id, today))
+    if full:
+        since = 0
     
-    return jsonify([item.to_dict() for item in queue_items])
+    items = queue_changes(service_id, today, since)
+    response = jsonify({
+        'version': version,
+        'day': today.isoformat(),
+        'full': full,
+        'items': [item.to_dict() for item in items]
+    })
+    response.set_etag(etag)
+    return response
 
 @bp.route('/api/service-info', methods=['GET'])
 @staff_required
@@ -66,34 +141,49 @@ def service_info():
     if not service_id:
         return jsonify({'error': 'No service assigned'}), 400
     
-    service = Service.query.get(service_id)
-    return jsonify(service.to_dict())
+    return jsonify(get_service(service_id))
 
 @bp.route('/api/call-next', methods=['POST'])
 @staff_required
 def call_next():
     """Call next person in queue"""
     service_id = session.get('service_id')
+    staff_id = session.get('user_id')
+    service_ids = served_service_ids()
+    touch_staff(staff_id)
     
-    # Mark any currently serving as done
-    current = QueueItem.query.filter_by(service_id=service_id, status='serving').first()
+    # Mark the client this staff member is serving as done
+    current = QueueItem.query.filter(
+        QueueItem.service_id.in_(service_ids), QueueItem.status == 'serving'
+    ).filter(
+        db.or_(QueueItem.served_by == staff_id,
+               QueueItem.served_by.is_(None) & (QueueItem.service_id == service_id))
+    ).first()
     if current:
-        current.status = 'done'
-        current.completed_at = datetime.now()
+        finish_ticket(current, 'done', staff_id)
     
-    # Get next waiting
-    next_item = QueueItem.query.filter_by(
-        service_id=service_id,
-        status='waiting'
-    ).order_by(QueueItem.created_at).first()
+    # In pool mode, draw from the most loaded service of the pool
+    sources = draw_order(service_loads(service_ids)) if len(service_ids) > 1 else service_ids
+    
+    # Claim the next waiting client; concurrent counters never get the same one
+    next_item = None
+    for source_id in sources:
+        next_item = claim_next_ticket(source_id, staff_id)
+        if next_item:
+            break
     
     if next_item:
-        next_item.status = 'serving'
-        next_item.called_at = datetime.now()
+        notify_almost_up(next_item.service_id, current_app.config['ALMOST_UP_THRESHOLD'])
         db.session.commit()
+        notify_service_changed(next_item.service_id)
+        if current and current.service_id != next_item.service_id:
+            notify_service_changed(current.service_id)
+        dispatch_pending()
         return jsonify({'success': True, 'queue_item': next_item.to_dict()})
     
     db.session.commit()
+    if current:
+        notify_service_changed(current.service_id)
     return jsonify({'success': False, 'message': 'No one waiting'})
 
 @bp.route('/api/mark-done/<int:item_id>', methods=['POST'])
@@ -101,10 +191,12 @@ def call_next():
 def mark_done(item_id):
     """Mark current client as done"""
     item = QueueItem.query.get(item_id)
-    if item and item.service_id == session.get('service_id'):
-        item.status = 'done'
-        item.completed_at = datetime.now()
+    if may_handle(item):
+        touch_staff(session['user_id'])
+        if not finish_ticket(item, 'done', session['user_id']):
+            return jsonify({'error': 'Ticket is not being served'}), 409
         db.session.commit()
+        notify_service_changed(item.service_id)
         return jsonify({'success': True})
     return jsonify({'error': 'Item not found'}), 404
 
@@ -113,12 +205,66 @@ def mark_done(item_id):
 def skip(item_id):
     """Skip a client"""
     item = QueueItem.query.get(item_id)
-    if item and item.service_id == session.get('service_id'):
-        item.status = 'skipped'
+    if may_handle(item):
+        touch_staff(session['user_id'])
+        if not finish_ticket(item, 'skipped', session['user_id']):
+            return jsonify({'error': 'Ticket is already finished'}), 409
+        notify_almost_up(item.service_id, current_app.config['ALMOST_UP_THRESHOLD'])
         db.session.commit()
+        notify_service_changed(item.service_id)
+        dispatch_pending()
         return jsonify({'success': True})
     return jsonify({'error': 'Item not found'}), 404
 
+@bp.route('/api/pool', methods=['GET'])
+@staff_required
+def pool():
+    """Get queue depth and estimated wait of the services this staff member may serve"""
+    service_ids = pool_service_ids(session['user_id'], session.get('service_id'))
+    return jsonify({
+        'pool_mode': bool(session.get('pool_mode')),
+        'services': service_loads(service_ids)
+    })
+
+@bp.route('/api/pool-mode', methods=['POST'])
+@staff_required
+def pool_mode():
+    """Switch drawing from the service pool on or off"""
+    enabled = bool((request.json or {}).get('enabled'))
+    if enabled and len(pool_service_ids(session['user_id'], session.get('service_id'))) < 2:
+        return jsonify({'error': 'No service pool assigned'}), 400
+    session['pool_mode'] = enabled
+    return jsonify({'success': True, 'pool_mode': enabled})
+
+@bp.route('/api/transfer', methods=['POST'])
+@staff_required
+def transfer():
+    """Move waiting clients of this staff member's service to a service of their pool"""
+    service_id = session.get('service_id')
+    data = request.json or {}
+    target_id = data.get('to_service_id')
+    if not service_id or target_id not in pool_service_ids(session['user_id']):
+        return jsonify({'error': 'Target service is not in your pool'}), 400
+    touch_staff(session['user_id'])
+    payload, status = transfer_request(data, service_id, target_id, session['user_id'])
+    return jsonify(payload), status
+
+@bp.route('/api/reclassify/<int:item_id>', methods=['POST'])
+@staff_required
+def reclassify(item_id):
+    """Move a waiting client to another queue class"""
+    queue_class = (request.json or {}).get('queue_class')
+    if queue_class not in queue_classes():
+        return jsonify({'error': 'Unknown queue class'}), 400
+    item = QueueItem.query.get(item_id)
+    if item and item.service_id == session.get('service_id') and item.status == 'waiting':
+        touch_staff(session['user_id'])
+        reclassify_ticket(item, queue_class)
+        db.session.commit()
+        notify_service_changed(item.service_id)
+        return jsonify({'success': True, 'queue_item': item.to_dict()})
+    return jsonify({'error': 'Item not found'}), 404
+
 @bp.route('/api/stats', methods=['GET'])
 @staff_required
 def stats():
@@ -126,22 +272,12 @@ def stats():
     service_id = session.get('service_id')
     today = date.today()
     
-    # Total served today
-    served = QueueItem.query.filter_by(service_id=service_id, status='done').filter(
-        db.func.date(QueueItem.created_at) == today
-    ).count()
-    
-    # Calculate average wait time
-    completed = QueueItem.query.filter_by(service_id=service_id, status='done').filter(
-        db.func.date(QueueItem.created_at) == today,
-        QueueItem.called_at.isnot(None)
-    ).all()
-    
+    # Served count and wait totals come from the daily rollup row
+    daily = get_daily_stats(service_id, today)
+    served = daily.served_count if daily else 0
     avg_wait = 0
-    if completed:
-        total_wait = sum([(item.called_at - item.created_at).total_seconds() / 60 
-                          for item in completed])
-        avg_wait = round(total_wait / len(completed), 1)
+    if daily and daily.wait_samples:
+        avg_wait = round(daily.total_wait_seconds / daily.wait_samples / 60, 1)
     
     # Currently waiting
     waiting = QueueItem.query.filter_by(service_id=service_id, status='waiting').count()
@@ -149,5 +285,6 @@ def stats():
     return jsonify({
         'served_today': served,
         'avg_wait_time': avg_wait,
-        'currently_waiting': waiting
+        'currently_waiting': waiting,
+        'skipped_today': daily.skipped_count if daily else 0
     })
\ No newline at end of file
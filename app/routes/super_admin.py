@@ -1,6 +1,11 @@
 from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
 from app.models import db, User, Organization, Service
+from app.auth import LoginRejected, authenticate
 from functools import wraps
+from app.archive import delete_archived
+from app.lookups import invalidate_organization, invalidate_service
+from app.display import invalidate_display
+from app.provisioning import bulk_request
 
 bp = Blueprint('super_admin', __name__, url_prefix='/super-admin')
 
@@ -12,6 +17,34 @@ def super_admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def keyset_page(query, id_column):
+    """Apply keyset pagination from the `after_id` and `limit` query args.
+
+    The first column of each row must be the model instance. Without
+    `limit` every row is returned. Returns the rows and the id to pass as
+    `after_id` for the next page (None on the last page).
+    """
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    query = query.order_by(id_column)
+    if not limit or limit < 1:
+        return query.all(), None
+    
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], rows[limit - 1][0].id
+
+def paginated(result, next_after):
+    """JSON response with the next page cursor in the `X-Next-After-Id` header"""
+    response = jsonify(result)
+    if next_after is not None:
+        response.headers['X-Next-After-Id'] = str(next_after)
+    return response
+
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'GET':
@@ -21,8 +54,11 @@ def login():
     username = data.get('username')
     password = data.get('password')
     
-    user = User.query.filter_by(username=username, role='super_admin').first()
-    if user and user.check_password(password):
+    try:
+        user = authenticate(username, password, 'super_admin', request.remote_addr)
+    except LoginRejected as error:
+        return jsonify({'error': str(error)}), error.status, {'Retry-After': str(error.retry_after)}
+    if user:
         session['user_id'] = user.id
         session['username'] = user.username
         session['role'] = user.role
@@ -45,22 +81,34 @@ def dashboard():
 @super_admin_required
 def get_organizations():
     """Get all organizations with stats"""
-    orgs = Organization.query.all()
-    result = []
-    
-    for org in orgs:
-        admin_count = User.query.filter_by(organization_id=org.id, role='admin').count()
-        service_count = Service.query.filter_by(organization_id=org.id).count()
-        staff_count = User.query.filter_by(organization_id=org.id, role='staff').count()
-        
-        result.append({
-            **org.to_dict(),
-            'admin_count': admin_count,
-            'service_count': service_count,
-            'staff_count': staff_count
-        })
-    
-    return jsonify(result)
+    # Per-organization counts as grouped subqueries: one query in total
+    user_counts = db.session.query(
+        User.organization_id.label('org_id'),
+        db.func.sum(db.case((User.role == 'admin', 1), else_=0)).label('admin_count'),
+        db.func.sum(db.case((User.role == 'staff', 1), else_=0)).label('staff_count')
+    ).group_by(User.organization_id).subquery()
+    service_counts = db.session.query(
+        Service.organization_id.label('org_id'),
+        db.func.count(Service.id).label('service_count')
+    ).group_by(Service.organization_id).subquery()
+    
+    query = db.session.query(
+        Organization,
+        user_counts.c.admin_count,
+        service_counts.c.service_count,
+        user_counts.c.staff_count
+    ).outerjoin(user_counts, user_counts.c.org_id == Organization.id
+    ).outerjoin(service_counts, service_counts.c.org_id == Organization.id)
+    
+    rows, next_after = keyset_page(query, Organization.id)
+    result = [{
+        **org.to_dict(),
+        'admin_count': admin_count or 0,
+        'service_count': service_count or 0,
+        'staff_count': staff_count or 0
+    } for org, admin_count, service_count, staff_count in rows]
+    
+    return paginated(result, next_after)
 
 @bp.route('/api/organizations', methods=['POST'])
 @super_admin_required
@@ -75,8 +123,18 @@ def create_organization():
     )
     db.session.add(org)
     db.session.commit()
+    invalidate_organization(org.id)
     return jsonify(org.to_dict())
 
+@bp.route('/api/organizations/bulk', methods=['POST'])
+@super_admin_required
+def bulk_create_organizations():
+    """Create organizations from a JSON or CSV batch"""
+    report, status = bulk_request(request, 'organizations')
+    if report.get('created'):
+        invalidate_organization(None)
+    return jsonify(report), status
+
 @bp.route('/api/organizations/<int:org_id>', methods=['PUT'])
 @super_admin_required
 def update_organization(org_id):
@@ -91,6 +149,7 @@ def update_organization(org_id):
     org.contact = data.get('contact', org.contact)
     
     db.session.commit()
+    invalidate_organization(org_id)
     return jsonify(org.to_dict())
 
 @bp.route('/api/organizations/<int:org_id>', methods=['DELETE'])
@@ -101,8 +160,14 @@ def delete_organization(org_id):
     if not org:
         return jsonify({'error': 'Organization not found'}), 404
     
+    service_ids = [service.id for service in org.services]
+    delete_archived(service_ids)
     db.session.delete(org)
     db.session.commit()
+    invalidate_organization(org_id)
+    for service_id in service_ids:
+        invalidate_service(service_id, org_id)
+    invalidate_display(org_id)
     return jsonify({'success': True})
 
 # Admin Management
@@ -110,17 +175,17 @@ def delete_organization(org_id):
 @super_admin_required
 def get_admins():
     """Get all organization admins"""
-    admins = User.query.filter_by(role='admin').all()
-    result = []
+    query = db.session.query(User, Organization.name).outerjoin(
+        Organization, Organization.id == User.organization_id
+    ).filter(User.role == 'admin')
     
-    for admin in admins:
-        org = Organization.query.get(admin.organization_id) if admin.organization_id else None
-        result.append({
-            **admin.to_dict(),
-            'organization_name': org.name if org else 'None'
-        })
+    rows, next_after = keyset_page(query, User.id)
+    result = [{
+        **admin.to_dict(),
+        'organization_name': org_name or 'None'
+    } for admin, org_name in rows]
     
-    return jsonify(result)
+    return paginated(result, next_after)
 
 @bp.route('/api/admins', methods=['POST'])
 @super_admin_required
@@ -143,6 +208,13 @@ def create_admin():
     db.session.commit()
     return jsonify(admin.to_dict())
 
+@bp.route('/api/admins/bulk', methods=['POST'])
+@super_admin_required
+def bulk_create_admins():
+    """Create organization admins from a JSON or CSV batch"""
+    report, status = bulk_request(request, 'admins')
+    return jsonify(report), status
+
 @bp.route('/api/admins/<int:admin_id>', methods=['PUT'])
 @super_admin_required
 def update_admin(admin_id):
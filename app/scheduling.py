@@ -0,0 +1,224 @@
+"""Pluggable policies choosing which waiting ticket a counter calls next.
+
+Every ticket belongs to a class from `QUEUE_CLASSES` (e.g. emergency,
+priority, appointment, standard), stored on the row with the class's
+`priority` number. Each service names the policy serving it in
+`Service.scheduler`:
+
+* ``fifo``: oldest ticket first, classes ignored (the default);
+* ``priority``: strict priority, the oldest ticket of the lowest
+  priority number first;
+* ``weighted``: weighted round-robin between classes. Class weights are
+  expanded into a smooth interleaving (weights 4:2:1 give
+  ``A B A C A B A``) and an atomic per-service turn counter in the state
+  backend walks through it, so with a shared backend all workers follow
+  the same rotation. An empty class passes its turn to the next one;
+* ``appointment``: booked tickets at their slot time (`scheduled_at`,
+  earliest slot first), walk-ins in arrival order otherwise.
+
+Under every policy a booked ticket only becomes callable
+`APPOINTMENT_CALL_AHEAD` seconds before its slot.
+
+A policy does not pick a row itself. It returns an ordered list of
+`Lane`s, each a filter plus an ordering matching a prefix of one of the
+``queue_items`` indexes, and `app.queue_ops.claim_next_ticket` claims the
+head of the first lane that has one. Each lane costs a single index seek,
+so choosing the next ticket stays logarithmic in the queue length.
+
+The same lanes, read without advancing any policy state (``peek``), give
+the order in which the waiting tickets will be called: `call_sequence`
+says which lane each successive call draws from. Queue positions (the
+"almost up" SMS, the join position, the display's next ticket) come from
+there, see `app.queue_ops.upcoming_tickets` and `tickets_ahead`.
+"""
+
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+
+from flask import current_app
+
+from app.state import get_state
+
+
+class Lane(namedtuple('Lane', 'where order_by')):
+    """A slice of a service's waiting tickets, served in a fixed order.
+
+    Both fields are callables taking the ticket entity (`QueueItem` or an
+    alias of it): `where` returns extra filter criteria and `order_by` the
+    ordering columns.
+    """
+
+
+def queue_classes():
+    """Return the configured ``{class name: {'priority', 'weight', ...}}``."""
+    return current_app.config['QUEUE_CLASSES']
+
+
+def default_class():
+    """Return the class of tickets joining without one."""
+    return current_app.config['DEFAULT_QUEUE_CLASS']
+
+
+def class_priority(name):
+    """Return the priority number of class `name` (KeyError if unknown)."""
+    return queue_classes()[name]['priority']
+
+
+def due(ticket, now):
+    """Criterion: `ticket` is a walk-in, or its slot is close enough to call it."""
+    ahead = timedelta(seconds=current_app.config['APPOINTMENT_CALL_AHEAD'])
+    return ticket.scheduled_at.is_(None) | (ticket.scheduled_at <= now + ahead)
+
+
+class Scheduler:
+    """A policy ordering the waiting tickets of a service.
+
+    Subclasses set `name` and implement `lanes`.
+    """
+
+    name = None
+
+    def lanes(self, service_id, now, peek=False):
+        """Return the `Lane`s to try in turn for the next ticket.
+
+        With `peek` the lanes are only looked at, not claimed from: a
+        policy with state (the weighted rotation) leaves it unchanged.
+        """
+        raise NotImplementedError
+
+    def call_sequence(self, service_id, sizes):
+        """Yield the lane index of each successive call, from the current state.
+
+        `sizes` holds the number of tickets in each of the ``peek`` lanes;
+        the sequence ends when they are all called. By default the lanes
+        are drained one after the other.
+        """
+        for index, size in enumerate(sizes):
+            for _ in range(size):
+                yield index
+
+
+SCHEDULERS = {}
+
+
+def register_scheduler(scheduler):
+    """Make `scheduler` selectable as a service's `scheduler`."""
+    SCHEDULERS[scheduler.name] = scheduler
+    return scheduler
+
+
+def get_scheduler(name):
+    """Return the policy called `name`, falling back to ``fifo``."""
+    return SCHEDULERS.get(name) or SCHEDULERS['fifo']
+
+
+class FifoScheduler(Scheduler):
+    """Oldest ticket first; reads ``(service_id, status, created_at)``."""
+
+    name = 'fifo'
+
+    def lanes(self, service_id, now, peek=False):
+        return [Lane(lambda t: [due(t, now)], lambda t: [t.created_at])]
+
+
+class PriorityScheduler(Scheduler):
+    """Lowest priority number first, then oldest; reads ``(service_id, status, priority, created_at)``."""
+
+    name = 'priority'
+
+    def lanes(self, service_id, now, peek=False):
+        return [Lane(lambda t: [due(t, now)], lambda t: [t.priority, t.created_at])]
+
+
+@lru_cache(maxsize=32)
+def interleave(weights):
+    """Expand ``((class, weight), ...)`` into one smooth weighted round.
+
+    Uses the smooth weighted round-robin of nginx: every step each class
+    gains its weight, the class with the most credit is picked and pays
+    back the total. Classes of weight 0 are left out.
+    """
+    weights = [(name, weight) for name, weight in weights if weight > 0]
+    total = sum(weight for _, weight in weights)
+    credit = {name: 0 for name, _ in weights}
+    order = []
+    for _ in range(total):
+        for name, weight in weights:
+            credit[name] += weight
+        chosen = max(weights, key=lambda entry: credit[entry[0]])[0]
+        credit[chosen] -= total
+        order.append(chosen)
+    return tuple(order)
+
+
+class WeightedScheduler(Scheduler):
+    """Weighted round-robin between classes, oldest first within a class.
+
+    One lane per class, each a seek on ``(service_id, status, priority,
+    created_at)``; the class whose turn it is comes first, followed by the
+    others in rotation order and finally the classes of weight 0.
+    """
+
+    name = 'weighted'
+
+    def lanes(self, service_id, now, peek=False):
+        classes = queue_classes()
+        order, turn = self._turn(service_id, peek)
+        return [self._lane(name, classes[name]['priority'], now)
+                for name in self._names(order, turn)]
+
+    def call_sequence(self, service_id, sizes):
+        order, turn = self._turn(service_id, peek=True)
+        names = self._names(order, turn)
+        left = dict(zip(names, sizes))
+        index = {name: position for position, name in enumerate(names)}
+        while any(left.values()):
+            # What `lanes` would return at this turn: first class with tickets
+            name = next(name for name in self._names(order, turn) if left.get(name))
+            left[name] -= 1
+            yield index[name]
+            turn += 1
+
+    @staticmethod
+    def _turn(service_id, peek):
+        """Return the service's round and the turn the next call takes in it."""
+        classes = queue_classes()
+        order = interleave(tuple((name, spec.get('weight', 1)) for name, spec in classes.items()))
+        if not order:
+            return order, 0
+        key = f'scheduler-turn:{service_id}'
+        if peek:
+            return order, int(get_state().get(key) or 0)
+        return order, get_state().incr(key) - 1
+
+    @staticmethod
+    def _names(order, turn):
+        """Return the classes in the order a call at `turn` tries them."""
+        rotation = order[turn % len(order):] + order[:turn % len(order)] if order else ()
+        return list(dict.fromkeys(rotation + tuple(queue_classes())))
+
+    @staticmethod
+    def _lane(name, priority, now):
+        return Lane(lambda t: [t.priority == priority, t.queue_class == name, due(t, now)],
+                    lambda t: [t.created_at])
+
+
+class AppointmentScheduler(Scheduler):
+    """Due booked tickets by slot time, then walk-ins by arrival.
+
+    Both lanes read ``(service_id, status, scheduled_at, created_at)``.
+    """
+
+    name = 'appointment'
+
+    def lanes(self, service_id, now, peek=False):
+        ahead = timedelta(seconds=current_app.config['APPOINTMENT_CALL_AHEAD'])
+        return [
+            Lane(lambda t: [t.scheduled_at <= now + ahead], lambda t: [t.scheduled_at, t.created_at]),
+            Lane(lambda t: [t.scheduled_at.is_(None)], lambda t: [t.created_at]),
+        ]
+
+
+for _scheduler in (FifoScheduler(), PriorityScheduler(), WeightedScheduler(), AppointmentScheduler()):
+    register_scheduler(_scheduler)
@@ -0,0 +1,258 @@
+"""What-if simulations of a service day: appointment slot policies and staffing.
+
+`simulate_day` plays one day of a service as a discrete-event simulation:
+clients arrive by a Poisson process whose rate changes every hour, and
+`staff` counters serve them with exponentially distributed service times.
+Pending events (arrivals, completions) sit on a heap ordered by time, so
+a day costs O(clients log clients).
+
+A `SlotPolicy` mirrors `app.appointments`: each slot offers `share` of the
+counters' throughput for booking. A client who would come at a given time
+books, with probability `adoption`, the first slot starting then or later
+that still has a place, and turns up at its start; everyone else walks
+in. Booked clients who are due are served before walk-ins, like the
+'appointment' scheduler. Booking moves demand out of the peak into later
+slots; `compare_policies` shows what that does to the queue.
+
+`simulate_days` answers staffing questions for a plain first-come,
+first-served queue and is built for volume. In such a queue a client
+starts with the counter that frees up first, so no event list is needed:
+the counters' free times sit on a heap of `staff` entries and each client
+costs one `heapq.heapreplace`. Service times are drawn from a
+distribution (`exponential`, or `empirical` from measured durations), and
+waits are tallied in a per-second histogram rather than kept, so tens of
+thousands of days run in seconds. `app.planning` seeds it from a
+service's history.
+
+Nothing here touches the database.
+"""
+
+import heapq
+import math
+import random
+from itertools import accumulate
+from collections import deque, namedtuple
+
+
+class SlotPolicy(namedtuple('SlotPolicy', 'name share slot_minutes adoption')):
+    """Appointment slot policy to simulate.
+
+    `share` is the fraction of the counters' throughput offered for
+    booking (0 for walk-ins only), `slot_minutes` the slot length and
+    `adoption` the fraction of clients who book when they can.
+    """
+
+
+POLICIES = (
+    SlotPolicy('walk-in only', 0, 15, 0),
+    SlotPolicy('25% bookable', 0.25, 15, 0.6),
+    SlotPolicy('50% bookable', 0.5, 15, 0.6),
+    SlotPolicy('50% bookable, 30 min slots', 0.5, 30, 0.6),
+)
+
+# Clients per hour of a typical day with a morning peak
+MORNING_PEAK = {8: 30, 9: 45, 10: 40, 11: 30, 12: 20, 13: 20, 14: 18, 15: 15, 16: 10}
+
+# Event kinds, ordered so a completion frees its counter before an
+# arrival at the same instant looks for one
+_DONE, _ARRIVAL = 0, 1
+
+
+def arrival_times(rates, rng):
+    """Draw the day's arrival times (seconds after midnight) from hourly `rates`."""
+    times = []
+    for hour, rate in sorted(rates.items()):
+        if rate <= 0:
+            continue
+        t = hour * 3600 + rng.expovariate(rate / 3600)
+        while t < (hour + 1) * 3600:
+            times.append(t)
+            t += rng.expovariate(rate / 3600)
+    return times
+
+
+def plan_bookings(times, policy, service_seconds, staff, close_hour, rng):
+    """Split the demand into walk-ins and bookings under `policy`.
+
+    Returns:
+        list[tuple]: ``(arrival time, booked)`` per client.
+    """
+    slot_seconds = policy.slot_minutes * 60
+    capacity = math.floor(slot_seconds / service_seconds * staff * policy.share)
+    if capacity <= 0 or policy.adoption <= 0:
+        return [(t, False) for t in times]
+    booked = {}
+    clients = []
+    for t in times:
+        if rng.random() < policy.adoption:
+            slot = math.ceil(t / slot_seconds) * slot_seconds
+            while slot + slot_seconds <= close_hour * 3600 and booked.get(slot, 0) >= capacity:
+                slot += slot_seconds
+            if slot + slot_seconds <= close_hour * 3600:
+                booked[slot] = booked.get(slot, 0) + 1
+                clients.append((slot, True))
+                continue
+        clients.append((t, False))
+    return clients
+
+
+def simulate_day(rates, service_seconds, staff, policy, seed=0):
+    """Simulate one day; return its waits (seconds) and its peak queue length.
+
+    Args:
+        rates: ``{hour: clients per hour}`` of the would-be arrivals.
+        service_seconds: Mean time a counter spends on a client.
+        staff: Counters open all day.
+        policy: `SlotPolicy` applied to the day.
+        seed: Random seed; the same seed gives every policy the same demand.
+    """
+    rng = random.Random(seed)
+    close_hour = max(rates) + 1 if rates else 0
+    times = arrival_times(rates, rng)
+    clients = plan_bookings(times, policy, service_seconds, staff, close_hour, rng)
+
+    events = [(t, _ARRIVAL, n, booked) for n, (t, booked) in enumerate(clients)]
+    heapq.heapify(events)
+    waiting = {True: deque(), False: deque()}
+    free = staff
+    peak = 0
+    waits = []
+    sequence = len(events)
+
+    def start(now, arrived):
+        nonlocal sequence
+        waits.append(now - arrived)
+        sequence += 1
+        heapq.heappush(events, (now + rng.expovariate(1 / service_seconds), _DONE, sequence, None))
+
+    while events:
+        now, kind, _, booked = heapq.heappop(events)
+        if kind == _ARRIVAL:
+            if free:
+                free -= 1
+                start(now, now)
+            else:
+                waiting[booked].append(now)
+                peak = max(peak, len(waiting[True]) + len(waiting[False]))
+        else:
+            queue = waiting[True] or waiting[False]
+            if queue:
+                start(now, queue.popleft())
+            else:
+                free += 1
+    return {'waits': waits, 'peak_queue': peak,
+            'booked': sum(1 for _, booked in clients if booked)}
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def compare_policies(rates, service_seconds, staff, policies=POLICIES, days=20, seed=0):
+    """Run every policy over the same `days` simulated days and summarize them.
+
+    Returns:
+        list[dict]: Per policy: clients and bookings per day, the mean daily
+        peak queue length, and the mean, 90th percentile and maximum wait
+        in minutes.
+    """
+    results = []
+    for policy in policies:
+        waits, peaks, booked = [], [], 0
+        for day in range(days):
+            outcome = simulate_day(rates, service_seconds, staff, policy, seed + day)
+            waits.extend(outcome['waits'])
+            peaks.append(outcome['peak_queue'])
+            booked += outcome['booked']
+        waits.sort()
+        results.append({
+            'policy': policy.name,
+            'clients_per_day': round(len(waits) / days, 1),
+            'booked_per_day': round(booked / days, 1),
+            'peak_queue': round(sum(peaks) / days, 1),
+            'mean_wait_minutes': round(sum(waits) / len(waits) / 60, 1) if waits else 0.0,
+            'p90_wait_minutes': round(_percentile(waits, 0.9) / 60, 1),
+            'max_wait_minutes': round(waits[-1] / 60, 1) if waits else 0.0,
+        })
+    return results
+
+
+def exponential(mean_seconds):
+    """Service times drawn from an exponential distribution of the given mean."""
+    rate = 1 / mean_seconds
+
+    def draw(rng, count):
+        return [rng.expovariate(rate) for _ in range(count)]
+    draw.mean = mean_seconds
+    return draw
+
+
+def empirical(durations):
+    """Service times resampled from measured ``{seconds: count}`` durations."""
+    values = sorted(durations)
+    weights = list(accumulate(durations[value] for value in values))
+
+    def draw(rng, count):
+        return rng.choices(values, cum_weights=weights, k=count)
+    draw.mean = sum(value * durations[value] for value in values) / weights[-1]
+    return draw
+
+
+def _tally(histogram, fractions):
+    """Return the clients, mean and percentiles (seconds) of a wait histogram."""
+    total = sum(histogram.values())
+    if not total:
+        return 0, 0.0, [0.0] * len(fractions), 0.0
+    mean = sum(wait * count for wait, count in histogram.items()) / total
+    waits = sorted(histogram)
+    percentiles = []
+    for fraction in fractions:
+        target, seen = fraction * total, 0
+        for wait in waits:
+            seen += histogram[wait]
+            if seen >= target:
+                percentiles.append(float(wait))
+                break
+    return total, mean, percentiles, float(waits[-1])
+
+
+def simulate_days(rates, service_times, staff, days=1000, seed=0, percentiles=(0.5, 0.9, 0.95)):
+    """Simulate `days` first-come, first-served days and summarize the waits.
+
+    Args:
+        rates: ``{hour: clients per hour}`` of the arrivals.
+        service_times: Distribution from `exponential` or `empirical`.
+        staff: Counters open all day.
+        days: Number of independent days to simulate.
+        seed: Random seed; the same seed gives every staffing the same demand.
+        percentiles: Fractions of the wait percentiles to report.
+
+    Returns:
+        dict: ``staff``, ``days``, ``clients_per_day``, ``mean_wait_minutes``,
+        ``max_wait_minutes`` and ``percentiles`` (``{"p90": minutes, ...}``).
+    """
+    rng = random.Random(seed)
+    histogram = {}
+    replace = heapq.heapreplace
+    for _ in range(days):
+        arrivals = arrival_times(rates, rng)
+        free = [0.0] * staff
+        for arrived, duration in zip(arrivals, service_times(rng, len(arrivals))):
+            start = free[0]
+            if start < arrived:
+                start = arrived
+            wait = int(start - arrived)
+            histogram[wait] = histogram.get(wait, 0) + 1
+            replace(free, start + duration)
+    total, mean, values, longest = _tally(histogram, percentiles)
+    return {
+        'staff': staff,
+        'days': days,
+        'clients_per_day': round(total / days, 1) if days else 0.0,
+        'mean_wait_minutes': round(mean / 60, 1),
+        'max_wait_minutes': round(longest / 60, 1),
+        'percentiles': {f'p{round(fraction * 100)}': round(value / 60, 1)
+                        for fraction, value in zip(percentiles, values)},
+    }
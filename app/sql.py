@@ -0,0 +1,84 @@
+"""Small SQL helpers shared by the queue, stats, analytics and notification modules."""
+
+from sqlalchemy import Integer
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from app.models import db
+
+
+# Dialects that understand SELECT ... FOR UPDATE SKIP LOCKED
+_SKIP_LOCKED_DIALECTS = {'mysql', 'mariadb', 'postgresql', 'oracle'}
+
+
+def supports_skip_locked():
+    """Return True if the session's database supports ``SKIP LOCKED``."""
+    return db.session.get_bind().dialect.name in _SKIP_LOCKED_DIALECTS
+
+
+def increment_row(table, key, deltas):
+    """Atomically add `deltas` to the counter columns of one keyed row.
+
+    Runs ``UPDATE table SET col = col + delta WHERE key``, which holds the
+    row lock until the surrounding transaction commits. When the row does
+    not exist yet it is inserted with the deltas as initial values; if a
+    concurrent transaction inserts it first, the UPDATE is retried.
+
+    Args:
+        table: Table object with the counter columns.
+        key: Mapping of primary-key column name to value.
+        deltas: Mapping of column name to the amount to add.
+
+    Returns:
+        bool: True if the row was created by this call.
+    """
+    where = db.and_(*(table.c[name] == value for name, value in key.items()))
+    update = db.update(table).where(where).values(
+        {name: table.c[name] + delta for name, delta in deltas.items()})
+
+    if db.session.execute(update).rowcount:
+        return False
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.insert(table).values({**key, **deltas}))
+        return True
+    except IntegrityError:
+        # Another transaction created the row first
+        db.session.execute(update)
+        return False
+
+
+class seconds_between(FunctionElement):
+    """Whole seconds from `start` to `end`, portable across dialects.
+
+    Compiles to ``TIMESTAMPDIFF(SECOND, start, end)`` on MySQL, an epoch
+    difference on PostgreSQL and a `julianday` difference on SQLite.
+    NULL when either timestamp is NULL.
+    """
+
+    type = Integer()
+    inherit_cache = True
+    name = 'seconds_between'
+
+
+@compiles(seconds_between)
+def _seconds_between_default(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return 'CAST(ROUND((julianday(%s) - julianday(%s)) * 86400) AS INTEGER)' % (
+        compiler.process(end, **kw), compiler.process(start, **kw))
+
+
+@compiles(seconds_between, 'mysql')
+@compiles(seconds_between, 'mariadb')
+def _seconds_between_mysql(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return 'TIMESTAMPDIFF(SECOND, %s, %s)' % (
+        compiler.process(start, **kw), compiler.process(end, **kw))
+
+
+@compiles(seconds_between, 'postgresql')
+def _seconds_between_postgresql(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return 'CAST(EXTRACT(EPOCH FROM (%s - %s)) AS INTEGER)' % (
+        compiler.process(end, **kw), compiler.process(start, **kw))
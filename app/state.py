@@ -0,0 +1,454 @@
+"""Shared state backend: atomic counters, short-lived cache entries, pub/sub.
+
+Workers of one process, several gunicorn workers and several containers
+all need to agree on a little state that is not worth a database
+round trip: display snapshots, cache invalidations, queue change
+notifications. `SmartQState` is the interface the rest of the app uses
+for it; the backend is chosen with `SMARTQ_STATE_URL`:
+
+* ``memory://`` (default) - `InProcessState`, only shared by the threads
+  of one worker. Fine for a single-worker deployment and for tests.
+* ``redis://[:password@]host[:port][/db]`` - `RedisState`, shared by
+  every worker that points at the same server. It speaks the Redis
+  protocol (RESP) directly, so any Redis-compatible server works,
+  including the stand-in in `app.state_server`.
+
+Values are JSON-encoded, so only JSON-serializable data can be stored or
+published. Subscription callbacks run on a background thread.
+"""
+
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from flask import current_app
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+class SmartQState:
+    """Interface of a state backend.
+
+    `shared` tells whether other workers see the same state; callers may
+    skip caching data that other workers change when it is False.
+    """
+
+    shared = False
+
+    def incr(self, key, amount=1, ttl=None):
+        """Atomically add `amount` to the integer at `key` and return the result.
+
+        A missing key counts as 0. When `ttl` is given, a newly created
+        counter expires after `ttl` seconds.
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return the value stored at `key`, or None."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None, only_if_missing=False):
+        """Store `value` at `key`, expiring after `ttl` seconds if given.
+
+        With `only_if_missing` the value is only stored when the key does
+        not exist. Returns True if the value was stored.
+        """
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        """Remove `keys`."""
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        """Send `message` to every subscriber of `channel`, in any worker."""
+        raise NotImplementedError
+
+    def subscribe(self, channel, callback):
+        """Call ``callback(message)`` for each message published on `channel`.
+
+        Returns:
+            Subscription: Handle whose `close()` stops the callbacks.
+        """
+        raise NotImplementedError
+
+    def get_or_load(self, key, ttl, loader):
+        """Return the value at `key`, storing ``loader()`` for `ttl` seconds on a miss.
+
+        Loaders returning None are not cached.
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+
+class Subscription:
+    """Handle returned by `SmartQState.subscribe`."""
+
+    def __init__(self, registry, channel, callback):
+        self._registry = registry
+        self.channel = channel
+        self.callback = callback
+
+    def close(self):
+        """Stop receiving messages."""
+        self._registry.remove(self)
+
+
+class _Registry:
+    """Thread-safe mapping of channel to subscriptions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(list)
+
+    def add(self, subscription):
+        with self._lock:
+            first = not self._subscriptions[subscription.channel]
+            self._subscriptions[subscription.channel].append(subscription)
+            return first
+
+    def remove(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.channel, None)
+
+    def channels(self):
+        with self._lock:
+            return list(self._subscriptions)
+
+    def dispatch(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.callback(message)
+            except Exception:
+                # A broken subscriber must not stop delivery to the others
+                logger.exception('Subscriber of %r failed on %r', channel, message)
+
+
+class InProcessState(SmartQState):
+    """State kept in this worker's memory.
+
+    Published messages are delivered by a single dispatch thread, in
+    publish order, like they are with a shared backend. Values are stored
+    as JSON-decoded copies and returned without copying again, so callers
+    must not modify them. Expired keys are dropped when read, and by a
+    sweep of the whole store at most every `SWEEP_INTERVAL` seconds on
+    writes, so keys never read again (e.g. login failures of random
+    usernames) do not pile up.
+    """
+
+    SWEEP_INTERVAL = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._swept_at = time.monotonic()
+        self._registry = _Registry()
+        self._outbox = queue.Queue()
+        self._dispatcher = None
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def _sweep(self, now):
+        if now - self._swept_at < self.SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        expired = [key for key, (expires_at, _) in self._data.items()
+                   if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._data[key]
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            entry = self._live(key, now)
+            if entry is None:
+                entry = (now + ttl if ttl else None, 0)
+            value = int(entry[1]) + amount
+            self._data[key] = (entry[0], value)
+            return value
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            return None if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None, only_if_missing=False):
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            if only_if_missing and self._live(key, now) is not None:
+                return False
+            # Store a copy, as a shared backend would
+            self._data[key] = (now + ttl if ttl else None, json.loads(json.dumps(value)))
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def publish(self, channel, message):
+        self._outbox.put((channel, json.loads(json.dumps(message))))
+
+    def subscribe(self, channel, callback):
+        subscription = Subscription(self._registry, channel, callback)
+        self._registry.add(subscription)
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(
+                    target=self._dispatch, name='smartq-state-dispatch', daemon=True)
+                self._dispatcher.start()
+        return subscription
+
+    def _dispatch(self):
+        while True:
+            channel, message = self._outbox.get()
+            self._registry.dispatch(channel, message)
+
+
+class RespError(Exception):
+    """Error reply from a RESP server, or a broken connection to it."""
+
+
+class RespConnection:
+    """A single blocking connection speaking RESP2."""
+
+    def __init__(self, host, port, db=0, password=None, timeout=5):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        if password:
+            self.command('AUTH', password)
+        if db:
+            self.command('SELECT', db)
+
+    def send(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(parts))
+
+    def read(self):
+        line = self.reader.readline()
+        if not line:
+            raise RespError('Connection closed by server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RespError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self.read() for _ in range(length)]
+        raise RespError(f'Unexpected reply: {line!r}')
+
+    def command(self, *args):
+        self.send(*args)
+        return self.read()
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisState(SmartQState):
+    """State shared through a Redis-compatible server.
+
+    Commands use a small pool of connections; pub/sub uses one dedicated
+    connection read by a background thread, which reconnects and
+    resubscribes after a failure.
+
+    Args:
+        url: ``redis://[:password@]host[:port][/db]``.
+        prefix: Prepended to every key and channel, so several SmartQ
+            deployments can share a server.
+        pool_size: Idle connections kept for reuse.
+    """
+
+    shared = True
+
+    # Commands that leave the same result when run twice (SET only without NX)
+    RETRYABLE = frozenset({'GET', 'SET', 'DEL', 'EXPIRE'})
+
+    def __init__(self, url, prefix='smartq:', pool_size=16, timeout=5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.password = parsed.password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._registry = _Registry()
+        self._pubsub = None
+        self._pubsub_lock = threading.Lock()
+        self._listener = None
+
+    def _connect(self):
+        return RespConnection(self.host, self.port, self.db, self.password, self.timeout)
+
+    def _execute(self, *args):
+        """Run one command, retrying once on a fresh connection if it broke.
+
+        Only commands in `RETRYABLE` are retried: a connection can break
+        after the server ran the command, and running INCRBY or PUBLISH
+        again would count or deliver it twice, or SET NX report a key it
+        set itself as taken.
+        """
+        attempts = 2 if args[0] in self.RETRYABLE and 'NX' not in args else 1
+        for attempt in range(attempts):
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                reply = connection.command(*args)
+            except (OSError, RespError) as error:
+                connection.close()
+                if isinstance(error, RespError) and 'closed' not in str(error):
+                    raise
+                if attempt + 1 == attempts:
+                    raise
+                continue
+            try:
+                self._pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+            return reply
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def incr(self, key, amount=1, ttl=None):
+        value = self._execute('INCRBY', self._key(key), amount)
+        if ttl and value == amount:
+            self._execute('EXPIRE', self._key(key), int(ttl))
+        return value
+
+    def get(self, key):
+        value = self._execute('GET', self._key(key))
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None, only_if_missing=False):
+        args = ['SET', self._key(key), json.dumps(value)]
+        if ttl:
+            args += ['PX', int(ttl * 1000)]
+        if only_if_missing:
+            args.append('NX')
+        return self._execute(*args) is not None
+
+    def delete(self, *keys):
+        if keys:
+            self._execute('DEL', *(self._key(key) for key in keys))
+
+    def publish(self, channel, message):
+        self._execute('PUBLISH', self._key(channel), json.dumps(message))
+
+    def subscribe(self, channel, callback):
+        subscription = Subscription(self._registry, channel, callback)
+        if self._registry.add(subscription):
+            with self._pubsub_lock:
+                if self._pubsub is not None:
+                    try:
+                        self._pubsub.send('SUBSCRIBE', self._key(channel))
+                    except OSError:
+                        # The listener reconnects and subscribes again
+                        pass
+        with self._pubsub_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen, name='smartq-state-pubsub', daemon=True)
+                self._listener.start()
+        return subscription
+
+    def _listen(self):
+        delay = 0.1
+        while True:
+            try:
+                connection = self._connect()
+                connection.sock.settimeout(None)
+                with self._pubsub_lock:
+                    self._pubsub = connection
+                    for channel in self._registry.channels():
+                        connection.send('SUBSCRIBE', self._key(channel))
+                delay = 0.1
+                while True:
+                    reply = connection.read()
+                    if isinstance(reply, list) and reply[0] == b'message':
+                        channel = reply[1].decode()[len(self.prefix):]
+                        self._registry.dispatch(channel, json.loads(reply[2]))
+            except (OSError, RespError):
+                with self._pubsub_lock:
+                    if self._pubsub is not None:
+                        self._pubsub.close()
+                    self._pubsub = None
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+
+
+def record_failure(operation, subject):
+    """Log and count a failed best-effort update of the state backend.
+
+    Call it from the ``except`` block of an update made after a commit,
+    which must not fail the request.
+    """
+    current_app.logger.exception('State backend update %s failed for %s', operation, subject)
+    metrics.count('smartq_state_failures_total', {'operation': operation})
+
+
+def create_state(url):
+    """Build the backend for a `SMARTQ_STATE_URL`."""
+    if not url or url.startswith('memory://'):
+        return InProcessState()
+    if url.startswith('redis://'):
+        return RedisState(url)
+    raise ValueError(f'Unsupported SMARTQ_STATE_URL: {url!r}')
+
+
+def init_app(app):
+    """Create the application's state backend from `SMARTQ_STATE_URL`."""
+    app.extensions['smartq_state'] = create_state(app.config.get('SMARTQ_STATE_URL'))
+
+
+def get_state(app=None):
+    """Return the state backend of `app` (the current app by default)."""
+    return (app or current_app).extensions['smartq_state']
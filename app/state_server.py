@@ -0,0 +1,174 @@
+"""Minimal Redis-protocol server for development and tests.
+
+Implements the handful of commands `app.state.RedisState` uses (PING,
+AUTH, SELECT, GET, SET with PX/EX/NX, DEL, INCR/INCRBY, EXPIRE,
+PUBLISH, SUBSCRIBE, UNSUBSCRIBE, FLUSHDB) in memory, so multi-worker
+behaviour can be exercised without installing Redis::
+
+    python -m app.state_server --port 6390
+    SMARTQ_STATE_URL=redis://localhost:6390 gunicorn -w 4 run:app
+
+It keeps a single keyspace and is not meant for production.
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+
+
+class _Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.subscribers = {}
+
+    def live(self, key):
+        entry = self.data.get(key)
+        if entry and entry[0] is not None and entry[0] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+
+def _encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, bool):
+        return b':%d\r\n' % int(value)
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    if isinstance(value, Exception):
+        return b'-ERR %s\r\n' % str(value).encode()
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(_encode(item) for item in value)
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.channels = set()
+
+    def write(self, payload):
+        with self.write_lock:
+            self.wfile.write(payload)
+            self.wfile.flush()
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    return
+                if not args:
+                    continue
+                self.write(self.run(args[0].upper().decode(), args[1:]))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self.server.store.lock:
+                for channel in self.channels:
+                    self.server.store.subscribers.get(channel, set()).discard(self)
+
+    def run(self, name, args):
+        store = self.server.store
+        with store.lock:
+            if name == 'PING':
+                return _encode('PONG')
+            if name in ('AUTH', 'SELECT'):
+                return _encode('OK')
+            if name == 'GET':
+                entry = store.live(args[0])
+                return _encode(entry[1] if entry else None)
+            if name == 'SET':
+                key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+                expires_at = None
+                if b'PX' in options:
+                    expires_at = time.monotonic() + int(args[2 + options.index(b'PX') + 1]) / 1000
+                if b'EX' in options:
+                    expires_at = time.monotonic() + int(args[2 + options.index(b'EX') + 1])
+                if b'NX' in options and store.live(key):
+                    return _encode(None)
+                store.data[key] = (expires_at, value)
+                return _encode('OK')
+            if name == 'DEL':
+                return _encode(sum(1 for key in args if store.data.pop(key, None)))
+            if name in ('INCR', 'INCRBY'):
+                entry = store.live(args[0]) or (None, b'0')
+                value = int(entry[1]) + (int(args[1]) if name == 'INCRBY' else 1)
+                store.data[args[0]] = (entry[0], str(value).encode())
+                return _encode(value)
+            if name == 'EXPIRE':
+                entry = store.live(args[0])
+                if not entry:
+                    return _encode(0)
+                store.data[args[0]] = (time.monotonic() + int(args[1]), entry[1])
+                return _encode(1)
+            if name == 'FLUSHDB':
+                store.data.clear()
+                return _encode('OK')
+            if name == 'PUBLISH':
+                receivers = list(store.subscribers.get(args[0], ()))
+            elif name in ('SUBSCRIBE', 'UNSUBSCRIBE'):
+                replies = []
+                for channel in args:
+                    if name == 'SUBSCRIBE':
+                        store.subscribers.setdefault(channel, set()).add(self)
+                        self.channels.add(channel)
+                    else:
+                        store.subscribers.get(channel, set()).discard(self)
+                        self.channels.discard(channel)
+                    replies.append(_encode([name.lower().encode(), channel, len(self.channels)]))
+                return b''.join(replies)
+            else:
+                return _encode(Exception(f"unknown command '{name}'"))
+
+        # PUBLISH: deliver outside the store lock
+        message = _encode([b'message', args[0], args[1]])
+        for receiver in receivers:
+            try:
+                receiver.write(message)
+            except OSError:
+                pass
+        return _encode(len(receivers))
+
+
+class StateServer(socketserver.ThreadingTCPServer):
+    """Threaded TCP server holding one in-memory keyspace."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _Handler)
+        self.store = _Store()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    options = parser.parse_args()
+    with StateServer((options.host, options.port)) as server:
+        print(f"SmartQ state server listening on {options.host}:{options.port}")
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -285,6 +285,10 @@ async function loadAnalytics() {
                         <span>${item.avg_wait_time} min</span>
                         <p>Avg Wait Time</p>
                     </div>
+                    <div>
+                        <span>${item.p50_wait_time} / ${item.p90_wait_time} min</span>
+                        <p>Median / 90th Percentile Wait</p>
+                    </div>
                 </div>
             </div>
         `).join('');
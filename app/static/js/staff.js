@@ -17,44 +17,60 @@ async function loadServiceInfo() {
     }
 }
 
+// Tickets of the day by id, kept in sync through /staff/api/queue/changes
+const queueState = { day: null, version: 0, items: new Map() };
+
 async function loadQueue() {
     try {
-        const response = await fetch('/staff/api/queue');
-        const queue = await response.json();
+        const params = new URLSearchParams({ since: queueState.version, day: queueState.day || '' });
+        const response = await fetch(`/staff/api/queue/changes?${params}`);
+        if (response.status === 304) return;
+        const changes = await response.json();
         
-        const tbody = document.getElementById('queueBody');
-        tbody.innerHTML = queue.map(item => `
-            <tr class="status-${item.status}">
-                <td><strong>${item.queue_number}</strong></td>
-                <td>${item.phone_number}</td>
-                <td><span class="status-badge status-${item.status}">${item.status}</span></td>
-                <td>${new Date(item.created_at).toLocaleTimeString()}</td>
-                <td>
-                    ${item.status === 'serving' ? `
-                        <button onclick="markDone(${item.id})" class="btn btn-primary">Done</button>
-                    ` : ''}
-                    ${!item.status === 'waiting' ? `
-                        <button onclick="skip(${item.id})" class="btn btn-danger">Skip</button>
-                    ` : ''}
-                    ${item.status === 'serving' ? `
-                        <button onclick="skip(${item.id})" class="btn btn-danger">Skip</button>
-                    ` : ''}
-                </td>
-            </tr>
-        `).join('');
+        if (changes.full) queueState.items.clear();
+        changes.items.forEach(item => queueState.items.set(item.id, item));
+        queueState.day = changes.day;
+        queueState.version = changes.version;
         
-        const serving = queue.find(item => item.status === 'serving');
-        const currentDiv = document.getElementById('currentServing');
-        if (serving) {
-            currentDiv.textContent = `Currently Serving: ${serving.queue_number}`;
-        } else {
-            currentDiv.textContent = 'No one being served';
-        }
+        renderQueue([...queueState.items.values()].sort(
+            (a, b) => new Date(a.created_at) - new Date(b.created_at)
+        ));
     } catch (error) {
         console.error('Error loading queue:', error);
     }
 }
 
+function renderQueue(queue) {
+    const tbody = document.getElementById('queueBody');
+    tbody.innerHTML = queue.map(item => `
+        <tr class="status-${item.status}">
+            <td><strong>${item.queue_number}</strong>${item.queue_class && item.queue_class !== 'standard' ? ` <span class="status-badge">${item.queue_class}</span>` : ''}</td>
+            <td>${item.phone_number}</td>
+            <td><span class="status-badge status-${item.status}">${item.status}</span></td>
+            <td>${new Date(item.created_at).toLocaleTimeString()}</td>
+            <td>
+                ${item.status === 'serving' ? `
+                    <button onclick="markDone(${item.id})" class="btn btn-primary">Done</button>
+                ` : ''}
+                ${!item.status === 'waiting' ? `
+                    <button onclick="skip(${item.id})" class="btn btn-danger">Skip</button>
+                ` : ''}
+                ${item.status === 'serving' ? `
+                    <button onclick="skip(${item.id})" class="btn btn-danger">Skip</button>
+                ` : ''}
+            </td>
+        </tr>
+    `).join('');
+    
+    const serving = queue.find(item => item.status === 'serving');
+    const currentDiv = document.getElementById('currentServing');
+    if (serving) {
+        currentDiv.textContent = `Currently Serving: ${serving.queue_number}`;
+    } else {
+        currentDiv.textContent = 'No one being served';
+    }
+}
+
 async function loadStats() {
     try {
         const response = await fetch('/staff/api/stats');
@@ -0,0 +1,56 @@
+"""Incrementally maintained daily statistics per service.
+
+Every queue transition that finishes a ticket (done or skipped), or that
+changes a finished ticket, calls `record_transition` inside the same
+transaction. The rollup row for the ticket's `service_day` is adjusted by
+the difference between the ticket's old and new contribution, so the
+staff stats endpoint reads a single row by primary key. The rollup is
+rebuilt from the queue event log with `app.events.rebuild_daily_stats`.
+"""
+
+from app.models import db, ServiceDailyStats
+from app.sql import increment_row
+
+FIELDS = ('served_count', 'skipped_count', 'wait_samples',
+           'total_wait_seconds', 'total_service_seconds')
+
+
+def contribution(status, created_at, called_at, completed_at):
+    """Return the rollup counters one ticket in the given state accounts for."""
+    if status == 'skipped':
+        return {'skipped_count': 1}
+    if status != 'done':
+        return {}
+    values = {'served_count': 1}
+    if called_at and created_at:
+        values['wait_samples'] = 1
+        values['total_wait_seconds'] = (called_at - created_at).total_seconds()
+    if called_at and completed_at:
+        values['total_service_seconds'] = (completed_at - called_at).total_seconds()
+    return values
+
+
+def record_transition(item, before):
+    """Apply a ticket state change to its service's daily rollup.
+
+    Args:
+        item: The QueueItem after the change.
+        before: The ticket's contribution before the change, as returned
+            by `snapshot(item)` prior to mutating it.
+    """
+    after = snapshot(item)
+    deltas = {field: after.get(field, 0) - before.get(field, 0) for field in FIELDS}
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if deltas:
+        increment_row(ServiceDailyStats.__table__,
+                      {'service_id': item.service_id, 'day': item.service_day}, deltas)
+
+
+def snapshot(item):
+    """Return the current rollup contribution of `item`."""
+    return contribution(item.status, item.created_at, item.called_at, item.completed_at)
+
+
+def get_daily_stats(service_id, day):
+    """Return the rollup row for `service_id` on `day`, or None."""
+    return db.session.get(ServiceDailyStats, (service_id, day))
@@ -0,0 +1,142 @@
+"""Benchmark for `/client/api/display-status`.
+
+Seeds one organization with 5, 50 and 500 services against an in-memory
+SQLite database (or `DATABASE_URL`), then measures the number of SQL
+statements and the p50/p99 latency of the display endpoint with a cold
+snapshot cache (every call rebuilds the snapshot) and with a warm cache.
+The per-service query pattern the endpoint used before is measured too,
+for comparison.
+
+Usage:
+    python benchmarks/display_status_bench.py [--requests 50]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import request
+from sqlalchemy import event
+
+from config import Config
+from app import create_app
+from app.display import build_display_snapshot, snapshot_key
+from app.state import get_state
+from app.models import db, Organization, Service, QueueItem
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+
+def legacy_snapshot(org_id):
+    """Per-service query pattern used by display_status before aggregation."""
+    result = []
+    for service in Service.query.filter_by(organization_id=org_id, is_active=True).all():
+        serving = QueueItem.query.filter_by(service_id=service.id, status='serving').order_by(
+            QueueItem.called_at.desc()).first()
+        next_item = QueueItem.query.filter_by(service_id=service.id, status='waiting').order_by(
+            QueueItem.created_at).first()
+        waiting = QueueItem.query.filter_by(service_id=service.id, status='waiting').count()
+        result.append((serving, next_item, waiting))
+    return result
+
+
+def seed(n_services, tickets_per_service=20):
+    org = Organization(name=f'Bench {n_services}')
+    db.session.add(org)
+    db.session.flush()
+    services = [Service(name=f'Service {i}', organization_id=org.id, counter_number=str(i))
+                for i in range(n_services)]
+    db.session.add_all(services)
+    db.session.flush()
+    now = datetime.now()
+    rows = []
+    for service in services:
+        for n in range(tickets_per_service):
+            status = random.choice(('waiting', 'waiting', 'serving', 'done', 'skipped'))
+            created = now - timedelta(minutes=tickets_per_service - n)
+            rows.append({
+                'queue_number': f'SER{n + 1:03d}',
+                'service_id': service.id,
+                'phone_number': '0788000000',
+                'status': status,
+                'created_at': created,
+                'called_at': created + timedelta(minutes=1) if status != 'waiting' else None,
+            })
+    db.session.bulk_insert_mappings(QueueItem, rows)
+    db.session.commit()
+    return org.id
+
+
+def measure(client, url, requests, before_each=None):
+    statements = []
+    latencies = []
+
+    def count(*args, **kwargs):
+        statements[-1] += 1
+
+    with client.application.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for _ in range(requests):
+            if before_each:
+                before_each()
+            statements.append(0)
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    latencies.sort()
+    return {
+        'queries': statistics.mean(statements),
+        'p50_ms': latencies[len(latencies) // 2],
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 50, 500])
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig)
+
+    @app.route('/bench/legacy')
+    def bench_legacy():
+        legacy_snapshot(request.args.get('org_id', type=int))
+        return 'ok'
+
+    client = app.test_client()
+
+    print(f"{'services':>8} {'variant':<14} {'queries':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for size in args.sizes:
+        with app.app_context():
+            org_id = seed(size)
+        url = f'/client/api/display-status?org_id={org_id}'
+        variants = [
+            ('legacy', lambda: measure(client, f'/bench/legacy?org_id={org_id}', args.requests)),
+            ('cold cache', lambda: measure(client, url, args.requests,
+                                           lambda: get_state(app).delete(snapshot_key(org_id)))),
+            ('warm cache', lambda: measure(client, url, args.requests)),
+        ]
+        for name, run in variants:
+            result = run()
+            print(f"{size:>8} {name:<14} {result['queries']:>8.1f} "
+                  f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Check that hot queue queries are served by indexes.
+
+Drives the kiosk, display, staff and admin endpoints against a seeded
+database, captures every SELECT/UPDATE that touches `queue_items`, runs
+EXPLAIN on it and fails if the planner falls back to a full table scan.
+Works with SQLite (default, in-memory) and MySQL (set `DATABASE_URL`).
+
+Usage:
+    python benchmarks/explain_indexes.py
+"""
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, text
+
+from config import Config
+from app import create_app
+from app.models import db, Organization, Service, User, QueueItem
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # Keep SMS delivery out of the captured statements
+    SMS_TRANSPORT = 'fake'
+    NOTIFICATION_WORKERS = 0
+
+
+def seed(services=20, tickets_per_service=200):
+    org = Organization(name='Explain')
+    db.session.add(org)
+    db.session.flush()
+    rows = [Service(name=f'Service {i}', organization_id=org.id, counter_number=str(i))
+            for i in range(services)]
+    db.session.add_all(rows)
+    db.session.flush()
+    staff = User(username='explain_staff', role='staff', organization_id=org.id,
+                 service_id=rows[0].id)
+    admin = User(username='explain_admin', role='admin', organization_id=org.id)
+    for user in (staff, admin):
+        user.set_password('explain')
+    db.session.add_all([staff, admin])
+
+    now = datetime.now()
+    items = []
+    for service in rows:
+        for n in range(tickets_per_service):
+            created = now - timedelta(hours=n)
+            status = 'waiting' if n < 10 else 'done'
+            items.append({
+                'queue_number': f'SER{n:03d}',
+                'service_id': service.id,
+                'phone_number': '0788000000',
+                'status': status,
+                'created_at': created,
+                'service_day': created.date(),
+                'called_at': created + timedelta(minutes=5) if status == 'done' else None,
+                'completed_at': created + timedelta(minutes=9) if status == 'done' else None,
+            })
+    db.session.bulk_insert_mappings(QueueItem, items)
+    db.session.commit()
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text('ANALYZE'))
+    return org.id, rows[0].id
+
+
+def explain(connection, statement, parameters):
+    """Return a list of plan lines/rows that scan `queue_items` without an index."""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+        return [row[-1] for row in plan
+                if row[-1].startswith('SCAN') and 'queue_items' in row[-1]
+                and 'INDEX' not in row[-1]]
+    plan = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).mappings().all()
+    return [dict(row) for row in plan
+            if row.get('table') == 'queue_items' and row.get('key') is None]
+
+
+def main():
+    app = create_app(BenchConfig)
+    with app.app_context():
+        org_id, service_id = seed()
+        engine = db.engine
+
+    captured = {}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if 'queue_items' in statement and not executemany and \
+                statement.lstrip().upper().startswith(('SELECT', 'UPDATE')):
+            captured.setdefault(statement, parameters)
+
+    client = app.test_client()
+    admin = app.test_client()
+    assert client.post('/staff/login', json={'username': 'explain_staff',
+                                             'password': 'explain'}).status_code == 200
+    assert admin.post('/admin/login', json={'username': 'explain_admin',
+                                            'password': 'explain'}).status_code == 200
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        client.post('/client/api/join-queue',
+                    json={'service_id': service_id, 'phone_number': '0788000000'})
+        client.get(f'/client/api/display-status?org_id={org_id}')
+        client.get('/staff/api/queue')
+        client.get('/staff/api/queue/changes?since=1&day=' + date.today().isoformat())
+        client.get('/staff/api/stats')
+        client.post('/staff/api/call-next')
+        for scheduler in ('priority', 'weighted', 'appointment'):
+            admin.put(f'/admin/api/services/{service_id}', json={'scheduler': scheduler})
+            client.post('/staff/api/call-next')
+        admin.post('/admin/api/tickets/transfer',
+                   json={'from_service_id': service_id + 1, 'to_service_id': service_id, 'count': 3})
+        admin.get('/admin/api/analytics?days=30')
+        admin.get(f'/admin/api/services/{service_id}/simulation?days=10&target_minutes=10')
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    failures = []
+    with engine.connect() as connection:
+        for statement, parameters in captured.items():
+            scans = explain(connection, statement, parameters)
+            status = 'FULL SCAN' if scans else 'ok'
+            print(f"[{status:>9}] {' '.join(statement.split())[:110]}")
+            if scans:
+                failures.append((statement, scans))
+
+    if failures:
+        print(f"\n{len(failures)} queue_items statement(s) without index access")
+        sys.exit(1)
+    print(f"\nAll {len(captured)} distinct queue_items statements use an index")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""Load test replaying a realistic mix of kiosk, staff and display traffic.
+
+Seeds organizations with services, one staff member per service and
+`--history-days` days of finished tickets, then runs these actors
+concurrently against the app for `--duration` seconds:
+
+* a kiosk per organization joining random services, with occasional
+  bursts of several clients at once
+* a staff member per service calling the next client, serving them and
+  marking them done (or skipping them now and then)
+* staff dashboards polling the queue every 5 seconds and the stats every
+  10 seconds, like `staff.js`
+* `--screens` display screens per organization polling the display
+  status every 3 seconds
+
+`--speed` divides every interval, to compress the traffic. Throughput,
+p50/p95/p99 latency and SQL statements per request are reported per
+endpoint and written as JSON to `--output`. Pass a previous result file
+as `--baseline` to compare runs; `--fail-on-regression` makes the run
+exit non-zero when an endpoint's p95 latency or statement count
+regressed.
+
+Runs against a temporary SQLite file by default; set `DATABASE_URL` to
+target MySQL.
+
+Usage:
+    python benchmarks/loadtest.py [--orgs 2] [--services 3] [--duration 20]
+        [--speed 5] [--output loadtest.json] [--baseline previous.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from config import Config
+from app import create_app
+from app.models import db, Organization, Service, User, QueueItem
+
+_DB_DIR = tempfile.mkdtemp(prefix='smartq-loadtest-')
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = (os.environ.get('DATABASE_URL')
+                               or f"sqlite:///{os.path.join(_DB_DIR, 'loadtest.db')}")
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    SMS_TRANSPORT = 'fake'
+
+
+class Recorder:
+    """Collects latency and SQL statement counts per endpoint.
+
+    Statements are attributed through a thread-local counter, so queries
+    issued by background threads (SMS delivery, display pushes) are not
+    charged to requests.
+    """
+
+    def __init__(self, engine):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args, **kwargs):
+        if getattr(self._local, 'statements', None) is not None:
+            self._local.statements += 1
+
+    def request(self, client, name, method, url, **kwargs):
+        """Issue a request through `client` and record it under `name`."""
+        self._local.statements = 0
+        start = time.perf_counter()
+        response = getattr(client, method)(url, **kwargs)
+        elapsed = time.perf_counter() - start
+        statements, self._local.statements = self._local.statements, None
+        with self._lock:
+            if response.status_code >= 400:
+                self.errors[name] += 1
+            self.samples[name].append((elapsed, statements))
+        return response
+
+
+def seed(orgs, services, history_days, tickets_per_day):
+    """Create the organizations, services, staff and historical tickets.
+
+    Returns:
+        list: ``(org_id, [service_id, ...])`` per organization.
+    """
+    password_hash = generate_password_hash('load', method='pbkdf2:sha256:1000')
+    layout = []
+    today = date.today()
+    for o in range(orgs):
+        org = Organization(name=f'Load Org {o}')
+        db.session.add(org)
+        db.session.flush()
+        service_ids = []
+        for s in range(services):
+            service = Service(name=f'Service {s}', organization_id=org.id,
+                              counter_number=str(s + 1), avg_service_time=5)
+            db.session.add(service)
+            db.session.flush()
+            service_ids.append(service.id)
+            db.session.add(User(username=f'load_staff_{service.id}', role='staff',
+                                password_hash=password_hash, organization_id=org.id,
+                                service_id=service.id))
+
+            rows = []
+            for days_ago in range(history_days, 0, -1):
+                day = today - timedelta(days=days_ago)
+                opened = datetime.combine(day, datetime.min.time()) + timedelta(hours=8)
+                for n in range(tickets_per_day):
+                    created = opened + timedelta(minutes=n * 480 / tickets_per_day)
+                    called = created + timedelta(minutes=random.randint(1, 40))
+                    status = 'skipped' if random.random() < 0.1 else 'done'
+                    rows.append({
+                        'queue_number': f'SER{n + 1:03d}',
+                        'service_id': service.id,
+                        'phone_number': '0788000000',
+                        'status': status,
+                        'created_at': created,
+                        'called_at': called,
+                        'completed_at': called + timedelta(minutes=random.randint(2, 10))
+                        if status == 'done' else None,
+                        'service_day': day,
+                        'ticket_seq': n + 1,
+                    })
+            db.session.bulk_insert_mappings(QueueItem, rows)
+        layout.append((org.id, service_ids))
+    db.session.commit()
+    return layout
+
+
+def run_actors(app, recorder, layout, args):
+    """Run every actor until `args.duration` seconds have passed."""
+    stop = threading.Event()
+    scale = 1 / args.speed
+
+    def pause(seconds):
+        return stop.wait(seconds * scale)
+
+    def kiosk(service_ids):
+        client = app.test_client()
+        while not pause(random.expovariate(1 / args.join_interval)):
+            burst = random.randint(3, 6) if random.random() < 0.1 else 1
+            for _ in range(burst):
+                recorder.request(client, 'POST /client/api/join-queue', 'post',
+                                 '/client/api/join-queue', json={
+                                     'service_id': random.choice(service_ids),
+                                     'phone_number': f'078{random.randint(0, 9999999):07d}'})
+
+    def login(client, service_id):
+        while True:
+            response = client.post('/staff/login', json={'username': f'load_staff_{service_id}',
+                                                         'password': 'load'})
+            # Every hashing slot busy: the burst of actors logging in at once
+            if response.status_code != 503:
+                break
+            time.sleep(float(response.headers.get('Retry-After', 1)))
+        assert response.status_code == 200, response.data
+
+    def staff(service_id):
+        client = app.test_client()
+        login(client, service_id)
+        while not stop.is_set():
+            response = recorder.request(client, 'POST /staff/api/call-next', 'post',
+                                        '/staff/api/call-next')
+            item = (response.get_json() or {}).get('queue_item')
+            if not item:
+                if pause(2):
+                    return
+                continue
+            if pause(random.uniform(1, 2 * args.service_time)):
+                return
+            action = 'skip' if random.random() < 0.05 else 'mark-done'
+            recorder.request(client, f'POST /staff/api/{action}/:id', 'post',
+                             f"/staff/api/{action}/{item['id']}")
+
+    def staff_dashboard(service_id):
+        client = app.test_client()
+        login(client, service_id)
+        day, version = '', 0
+        ticks = 0
+        while not pause(5):
+            response = recorder.request(
+                client, 'GET /staff/api/queue/changes', 'get',
+                f'/staff/api/queue/changes?since={version}&day={day}')
+            if response.status_code == 200:
+                payload = response.get_json()
+                day, version = payload['day'], payload['version']
+            ticks += 1
+            if ticks % 2 == 0:
+                recorder.request(client, 'GET /staff/api/stats', 'get', '/staff/api/stats')
+
+    def screen(org_id):
+        client = app.test_client()
+        # Screens do not start in lockstep
+        if pause(random.uniform(0, 3)):
+            return
+        while True:
+            recorder.request(client, 'GET /client/api/display-status', 'get',
+                             f'/client/api/display-status?org_id={org_id}')
+            if pause(3):
+                return
+
+    threads = []
+    for org_id, service_ids in layout:
+        threads.append(threading.Thread(target=kiosk, args=(service_ids,)))
+        threads += [threading.Thread(target=screen, args=(org_id,)) for _ in range(args.screens)]
+        for service_id in service_ids:
+            threads.append(threading.Thread(target=staff, args=(service_id,)))
+            threads.append(threading.Thread(target=staff_dashboard, args=(service_id,)))
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, len(threads)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for name, samples in sorted(recorder.samples.items()):
+        latencies = sorted(s[0] * 1000 for s in samples)
+        endpoints[name] = {
+            'requests': len(samples),
+            'errors': recorder.errors[name],
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(statistics.mean(latencies), 2),
+            'sql_per_request': round(statistics.mean(s[1] for s in samples), 2),
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    return endpoints, {'requests': total, 'throughput_rps': round(total / elapsed, 2),
+                       'errors': sum(e['errors'] for e in endpoints.values())}
+
+
+def compare(endpoints, baseline, tolerance):
+    """Print the change against a baseline run. Returns the regressed endpoints."""
+    regressions = []
+    print(f"\n{'endpoint':<36} {'p95 ms':>17} {'sql/req':>15}")
+    for name, current in endpoints.items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        slower = current['p95_ms'] > before['p95_ms'] * (1 + tolerance)
+        chattier = current['sql_per_request'] > before['sql_per_request'] + 0.5
+        flag = '  REGRESSION' if slower or chattier else ''
+        print(f"{name:<36} {before['p95_ms']:>7.1f} -> {current['p95_ms']:<7.1f} "
+              f"{before['sql_per_request']:>5.1f} -> {current['sql_per_request']:<5.1f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orgs', type=int, default=2)
+    parser.add_argument('--services', type=int, default=3, help='Services per organization.')
+    parser.add_argument('--screens', type=int, default=2, help='Display screens per organization.')
+    parser.add_argument('--history-days', type=int, default=30)
+    parser.add_argument('--tickets-per-day', type=int, default=60,
+                        help='Historical tickets per service and day.')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of traffic.')
+    parser.add_argument('--speed', type=float, default=5, help='Divides every interval.')
+    parser.add_argument('--join-interval', type=float, default=4,
+                        help='Mean seconds between kiosk joins per organization.')
+    parser.add_argument('--service-time', type=float, default=6,
+                        help='Mean seconds a staff member spends on a client.')
+    parser.add_argument('--output', default='loadtest.json')
+    parser.add_argument('--baseline', help='Result file of a previous run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative p95 increase before flagging a regression.')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        start = time.perf_counter()
+        layout = seed(args.orgs, args.services, args.history_days, args.tickets_per_day)
+        print(f"Seeded {args.orgs} org(s) x {args.services} service(s) with "
+              f"{args.history_days} day(s) of history in {time.perf_counter() - start:.1f}s")
+        engine = db.engine
+        dialect = engine.dialect.name
+
+    recorder = Recorder(engine)
+    elapsed, actors = run_actors(app, recorder, layout, args)
+    endpoints, total = summarize(recorder, elapsed)
+
+    print(f"\n{actors} actors for {elapsed:.1f}s on {dialect}: {total['requests']} requests, "
+          f"{total['throughput_rps']} req/s, {total['errors']} error(s)\n")
+    print(f"{'endpoint':<36} {'reqs':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'sql/req':>8}")
+    for name, e in endpoints.items():
+        print(f"{name:<36} {e['requests']:>6} {e['throughput_rps']:>7.2f} {e['p50_ms']:>8.2f} "
+              f"{e['p95_ms']:>8.2f} {e['p99_ms']:>8.2f} {e['sql_per_request']:>8.2f}")
+
+    result = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'dialect': dialect,
+            'python': platform.python_version(),
+            'options': vars(args),
+            'elapsed_s': round(elapsed, 2),
+        },
+        'total': total,
+        'endpoints': endpoints,
+    }
+    with open(args.output, 'w') as handle:
+        json.dump(result, handle, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare(endpoints, json.load(handle), args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Query-count regression check for list and dashboard endpoints.
+
+Seeds a small and a large number of tenants and counts the SQL
+statements each endpoint issues on a cold cache. An endpoint fails the
+check when its statement count grows with the number of tenants (an N+1
+pattern) or exceeds its budget. Exits non-zero on failure, so it can run
+in CI next to `explain_indexes.py`.
+
+Usage:
+    python benchmarks/query_budget.py [--small 5] [--large 50]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from config import Config
+from app import create_app, lookups
+from app.display import snapshot_key
+from app.state import get_state
+from app.models import db, Organization, Service, User, QueueItem
+
+# Maximum statements per request on a cold cache
+BUDGETS = {
+    '/super-admin/api/organizations': 1,
+    '/super-admin/api/organizations?limit=10': 1,
+    '/super-admin/api/admins': 1,
+    '/super-admin/api/admins?limit=10': 1,
+    '/super-admin/api/overview': 4,
+    '/client/api/organizations': 1,
+    '/client/api/services?org_id={org_id}': 1,
+    '/client/api/display-status?org_id={org_id}': 2,
+    '/admin/api/analytics?days=30': 2,
+}
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+
+def seed(tenants):
+    """Create `tenants` organizations, each with admins, services, staff and tickets."""
+    first_org = None
+    for n in range(tenants):
+        org = Organization(name=f'Tenant {n}')
+        db.session.add(org)
+        db.session.flush()
+        first_org = first_org or org.id
+        for s in range(3):
+            service = Service(name=f'Service {s}', organization_id=org.id, counter_number=str(s))
+            db.session.add(service)
+            db.session.flush()
+            db.session.add(QueueItem(queue_number=f'SER{s:03d}', service_id=service.id,
+                                     phone_number='0788000000', status='waiting'))
+            db.session.add(User(username=f't{n}_staff{s}', role='staff', password_hash='x',
+                                organization_id=org.id, service_id=service.id))
+        db.session.add(User(username=f't{n}_admin', role='admin', password_hash='x',
+                            organization_id=org.id))
+    admin = User.query.filter_by(username='t0_admin').first()
+    admin.set_password('budget')
+    db.session.commit()
+    return first_org
+
+
+def measure(tenants):
+    """Return {endpoint: statements} for a fresh database with `tenants` tenants."""
+    app = create_app(BenchConfig)
+    with app.app_context():
+        org_id = seed(tenants)
+        engine = db.engine
+
+    super_admin = app.test_client()
+    admin = app.test_client()
+    assert super_admin.post('/super-admin/login', json={'username': 'superadmin',
+                                                        'password': 'admin123'}).status_code == 200
+    assert admin.post('/admin/login', json={'username': 't0_admin',
+                                            'password': 'budget'}).status_code == 200
+
+    counts = {}
+    statements = []
+    listener = lambda *args, **kwargs: statements.append(1)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        for endpoint in BUDGETS:
+            lookups.clear()
+            get_state(app).delete(snapshot_key(org_id))
+            client = admin if endpoint.startswith('/admin') else super_admin
+            statements.clear()
+            response = client.get(endpoint.format(org_id=org_id))
+            assert response.status_code == 200, (endpoint, response.status_code)
+            counts[endpoint] = len(statements)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--small', type=int, default=5)
+    parser.add_argument('--large', type=int, default=50)
+    args = parser.parse_args()
+
+    small = measure(args.small)
+    large = measure(args.large)
+
+    failures = 0
+    print(f"{'endpoint':<46} {args.small:>6} {args.large:>6} {'budget':>6}")
+    for endpoint, budget in BUDGETS.items():
+        grows = large[endpoint] > small[endpoint]
+        over = large[endpoint] > budget
+        flag = ' N+1' if grows else (' OVER' if over else '')
+        failures += bool(flag)
+        print(f"{endpoint:<46} {small[endpoint]:>6} {large[endpoint]:>6} {budget:>6}{flag}")
+
+    if failures:
+        print(f"\n{failures} endpoint(s) failed the query budget")
+        sys.exit(1)
+    print("\nAll endpoints within budget")
+
+
+if __name__ == '__main__':
+    main()
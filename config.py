@@ -38,6 +38,133 @@ class Config:
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
 
+    # Password hashing (Werkzeug notation, e.g. 'scrypt:32768:8:1' or
+    # 'pbkdf2:sha256:600000'); stored hashes are upgraded on login. Logins
+    # verify passwords on PASSWORD_HASH_WORKERS threads per worker and are
+    # refused with 503 once PASSWORD_HASH_QUEUE more are waiting.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 8))
+    PASSWORD_HASH_TIMEOUT = 5  # seconds
+
+    # Failed logins allowed per username and per client IP within the
+    # window before further attempts are refused with 429
+    LOGIN_MAX_FAILURES_PER_USER = int(os.environ.get('LOGIN_MAX_FAILURES_PER_USER', 5))
+    LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', 50))
+    LOGIN_FAILURE_WINDOW = 900  # seconds
+
+    # Request metrics served at /metrics. Point METRICS_DIR at a directory
+    # shared by the gunicorn workers of a host to aggregate all of them.
+    # SLOW_REQUEST_MS logs slower requests with their SQL (unset: off).
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5  # seconds
+    SLOW_REQUEST_MS = int(os.environ['SLOW_REQUEST_MS']) if os.environ.get('SLOW_REQUEST_MS') else None
+
+    # Shared state (counters, short-lived caches, pub/sub between workers):
+    # 'memory://' keeps it inside each worker, 'redis://host:6379/0' shares
+    # it between all workers and containers using the same server.
+    SMARTQ_STATE_URL = os.environ.get('SMARTQ_STATE_URL', 'memory://')
+
+    # Process-local caches for Service/Organization lookups. Point
+    # CACHE_INVALIDATION_FILE at a path shared by all workers of a host to
+    # broadcast invalidations between them.
+    LOOKUP_CACHE_TTL = float(os.environ.get('LOOKUP_CACHE_TTL', 60))  # seconds
+    LOOKUP_CACHE_SIZE = int(os.environ.get('LOOKUP_CACHE_SIZE', 4096))
+    CACHE_INVALIDATION_FILE = os.environ.get('CACHE_INVALIDATION_FILE')
+
+    # Display screens (Server-Sent Events feed and polled snapshot cache)
+    DISPLAY_CACHE_TTL = float(os.environ.get('DISPLAY_CACHE_TTL', 2))  # seconds
+    DISPLAY_STREAM_KEEPALIVE = int(os.environ.get('DISPLAY_STREAM_KEEPALIVE', 15))  # seconds
+    DISPLAY_STREAM_RESYNC = int(os.environ.get('DISPLAY_STREAM_RESYNC', 10))  # seconds
+    DISPLAY_STREAM_RETRY_MS = 3000
+    # Open streams per worker; each holds a thread, so keep this below the
+    # worker's thread count (gunicorn --threads). Further screens poll.
+    DISPLAY_STREAM_MAX = int(os.environ.get('DISPLAY_STREAM_MAX', 24))
+
+    # SMS delivery: 'console' prints messages, 'twilio' sends them, 'fake'
+    # records them in memory (tests). Messages are queued in the
+    # notifications outbox and sent by NOTIFICATION_WORKERS background
+    # threads per web worker (0 leaves delivery to `flask notifications-worker`).
+    # NOTIFICATION_RATE holds across all processes sharing SMARTQ_STATE_URL,
+    # and applies to each process on its own with the memory backend.
+    SMS_TRANSPORT = os.environ.get('SMS_TRANSPORT', 'console')
+    NOTIFICATION_WORKERS = int(os.environ.get('NOTIFICATION_WORKERS', 2))
+    NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', 20))
+    NOTIFICATION_RATE = float(os.environ.get('NOTIFICATION_RATE', 10))  # messages/second
+    NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', 5))
+    NOTIFICATION_RETRY_BASE = 5  # seconds, doubled on every retry
+    NOTIFICATION_POLL_INTERVAL = 5  # seconds
+    NOTIFICATION_LEASE = 60  # seconds
+
+    # Wait estimates: weight of the newest completed ticket in the moving
+    # averages, the gap after which throughput is considered stale, and how
+    # long after their last queue action staff count as active.
+    ESTIMATOR_ALPHA = float(os.environ.get('ESTIMATOR_ALPHA', 0.2))
+    ESTIMATOR_IDLE_GAP = 900  # seconds
+    STAFF_ACTIVE_WINDOW = 900  # seconds
+
+    # Text waiting clients once at most this many people are ahead of them
+    # (0 disables the "almost up" SMS)
+    ALMOST_UP_THRESHOLD = int(os.environ.get('ALMOST_UP_THRESHOLD', 3))
+
+    # Ticket classes. Each service's `scheduler` ('fifo', 'priority',
+    # 'weighted' or 'appointment', see app/scheduling.py) decides how they
+    # are served: lower `priority` first, or calls shared out in proportion
+    # to `weight`. The kiosk offers the classes marked `kiosk`; staff can
+    # move a waiting ticket to any class.
+    QUEUE_CLASSES = {
+        'emergency': {'priority': 0, 'weight': 4},
+        'priority': {'priority': 10, 'weight': 2, 'kiosk': True},
+        'appointment': {'priority': 20, 'weight': 2},
+        'standard': {'priority': 50, 'weight': 1, 'kiosk': True},
+    }
+    DEFAULT_QUEUE_CLASS = 'standard'
+    # Booked tickets become callable this long before their slot
+    APPOINTMENT_CALL_AHEAD = 300  # seconds
+
+    # Appointment slots (app/appointments.py): opening hours cut into slots,
+    # the share of a slot's measured throughput offered for booking (the rest
+    # stays free for walk-ins) and how many days ahead clients can book
+    APPOINTMENT_HOURS = (8, 17)  # [start hour, end hour)
+    APPOINTMENT_SLOT_MINUTES = int(os.environ.get('APPOINTMENT_SLOT_MINUTES', 15))
+    APPOINTMENT_SHARE = float(os.environ.get('APPOINTMENT_SHARE', 0.5))
+    APPOINTMENT_BOOKING_DAYS = 14
+
+    # Waiting tickets moved by one transfer request (staff or admin)
+    TRANSFER_MAX_TICKETS = int(os.environ.get('TRANSFER_MAX_TICKETS', 500))
+
+    # Staffing simulations (admin endpoint, `flask simulate-service`): days
+    # of history they are seeded from, simulated days per staffing and the
+    # most counters tried. The endpoint runs inside a request worker, so it
+    # takes at most SIMULATION_MAX_DAYS days per staffing and
+    # SIMULATION_MAX_CLIENTS simulated clients in all (days x clients per
+    # day x staffings its search may try; about 1.5 s of CPU per million);
+    # larger runs go through the command, which has no limit
+    SIMULATION_HISTORY_DAYS = 28
+    SIMULATION_DAYS = int(os.environ.get('SIMULATION_DAYS', 1000))
+    SIMULATION_MAX_DAYS = 2000
+    SIMULATION_MAX_CLIENTS = int(os.environ.get('SIMULATION_MAX_CLIENTS', 1000000))
+    SIMULATION_MAX_STAFF = 50
+
+    # `flask archive-queue` moves finished tickets of past days out of the
+    # live queue table in batches of this size, pausing between batches
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+    ARCHIVE_BATCH_PAUSE = float(os.environ.get('ARCHIVE_BATCH_PAUSE', 0.05))  # seconds
+
+    # Replay of the queue event log into derived views (`flask replay-events`):
+    # events younger than the lag are left for the next run, so transactions
+    # still committing are not skipped
+    EVENT_REPLAY_LAG = 5  # seconds
+    EVENT_REPLAY_BATCH_SIZE = int(os.environ.get('EVENT_REPLAY_BATCH_SIZE', 1000))
+
+    # Bulk provisioning endpoints and `flask provision`: rows accepted per
+    # batch, staff/admin rows accepted per request (their passwords are
+    # hashed on the login pool) and threads hashing passwords in the CLI
+    # (0: one per CPU)
+    PROVISIONING_MAX_ROWS = int(os.environ.get('PROVISIONING_MAX_ROWS', 10000))
+    PROVISIONING_MAX_REQUEST_ACCOUNTS = int(os.environ.get('PROVISIONING_MAX_REQUEST_ACCOUNTS', 20))
+    PROVISIONING_HASH_WORKERS = int(os.environ.get('PROVISIONING_HASH_WORKERS', 0))
+
     # Twilio configuration (mock for now)
     TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID') or 'mock_sid'
     TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN') or 'mock_token'
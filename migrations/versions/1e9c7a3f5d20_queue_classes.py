@@ -0,0 +1,46 @@
+"""ticket classes, appointment slots and per-service schedulers
+
+Revision ID: 1e9c7a3f5d20
+Revises: 4f8a2d6c1b39
+Create Date: 2026-10-18 18:02:44.381270
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1e9c7a3f5d20'
+down_revision = '4f8a2d6c1b39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('services', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('scheduler', sa.String(length=20), nullable=False,
+                                      server_default='fifo'))
+
+    # Existing tickets join the default 'standard' class
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('queue_class', sa.String(length=20), nullable=False,
+                                      server_default='standard'))
+        batch_op.add_column(sa.Column('priority', sa.SmallInteger(), nullable=False,
+                                      server_default='50'))
+        batch_op.add_column(sa.Column('scheduled_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_queue_items_service_status_priority',
+                              ['service_id', 'status', 'priority', 'created_at'], unique=False)
+        batch_op.create_index('ix_queue_items_service_status_slot',
+                              ['service_id', 'status', 'scheduled_at', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_queue_items_service_status_slot')
+        batch_op.drop_index('ix_queue_items_service_status_priority')
+        batch_op.drop_column('scheduled_at')
+        batch_op.drop_column('priority')
+        batch_op.drop_column('queue_class')
+
+    with op.batch_alter_table('services', schema=None) as batch_op:
+        batch_op.drop_column('scheduler')
@@ -0,0 +1,41 @@
+"""service wait estimates and staff activity
+
+Revision ID: 2e7a4c9d8b13
+Revises: 9d1b6f3e5c28
+Create Date: 2026-10-18 14:18:03.775210
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e7a4c9d8b13'
+down_revision = '9d1b6f3e5c28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Estimates start from Service.avg_service_time and adapt as tickets
+    # are completed
+    op.create_table('service_wait_estimates',
+    sa.Column('service_id', sa.Integer(), nullable=False),
+    sa.Column('samples', sa.Integer(), nullable=False),
+    sa.Column('ewma_service_seconds', sa.Float(), nullable=True),
+    sa.Column('ewma_interval_seconds', sa.Float(), nullable=True),
+    sa.Column('last_completed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['service_id'], ['services.id'], ),
+    sa.PrimaryKeyConstraint('service_id')
+    )
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_active_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_users_service_last_active', ['service_id', 'last_active_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_service_last_active')
+        batch_op.drop_column('last_active_at')
+
+    op.drop_table('service_wait_estimates')
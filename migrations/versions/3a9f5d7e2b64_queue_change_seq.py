@@ -0,0 +1,36 @@
+"""queue change sequence for the staff delta view
+
+Revision ID: 3a9f5d7e2b64
+Revises: f0c6e2d8a413
+Create Date: 2026-10-18 12:20:41.902117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a9f5d7e2b64'
+down_revision = 'f0c6e2d8a413'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing tickets keep a NULL change_seq; clients start every day
+    # (and every version mismatch) with a full load, which includes them.
+    with op.batch_alter_table('service_daily_counters', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('change_seq', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('change_seq', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_queue_items_service_day_change', ['service_id', 'service_day', 'change_seq'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_queue_items_service_day_change')
+        batch_op.drop_column('change_seq')
+
+    with op.batch_alter_table('service_daily_counters', schema=None) as batch_op:
+        batch_op.drop_column('change_seq')
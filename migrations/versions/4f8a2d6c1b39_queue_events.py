@@ -0,0 +1,62 @@
+"""queue event log, projection checkpoints and hourly stats
+
+Revision ID: 4f8a2d6c1b39
+Revises: 6b3d8f1c4e72
+Create Date: 2026-10-18 17:21:09.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f8a2d6c1b39'
+down_revision = '6b3d8f1c4e72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Append-only; no foreign keys so events outlive archived tickets
+    op.create_table('queue_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('queue_item_id', sa.Integer(), nullable=False),
+    sa.Column('service_id', sa.Integer(), nullable=False),
+    sa.Column('service_day', sa.Date(), nullable=False),
+    sa.Column('ticket_seq', sa.Integer(), nullable=True),
+    sa.Column('kind', sa.SmallInteger(), nullable=False),
+    sa.Column('staff_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('queue_events', schema=None) as batch_op:
+        batch_op.create_index('ix_queue_events_queue_item', ['queue_item_id', 'id'], unique=False)
+
+    op.create_table('projection_checkpoints',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('last_event_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # Filled by `flask replay-events hourly-stats`
+    op.create_table('service_hourly_stats',
+    sa.Column('service_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('hour', sa.SmallInteger(), nullable=False),
+    sa.Column('joined_count', sa.Integer(), nullable=False),
+    sa.Column('served_count', sa.Integer(), nullable=False),
+    sa.Column('skipped_count', sa.Integer(), nullable=False),
+    sa.Column('wait_samples', sa.Integer(), nullable=False),
+    sa.Column('total_wait_seconds', sa.Float(), nullable=False),
+    sa.Column('total_service_seconds', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('service_id', 'day', 'hour')
+    )
+
+
+def downgrade():
+    op.drop_table('service_hourly_stats')
+    op.drop_table('projection_checkpoints')
+    with op.batch_alter_table('queue_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_queue_events_queue_item')
+
+    op.drop_table('queue_events')
@@ -0,0 +1,82 @@
+"""baseline schema
+
+Revision ID: 5c0e1b7a9d21
+Revises: 
+Create Date: 2026-10-18 09:12:04.118421
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0e1b7a9d21'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('organizations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=200), nullable=False),
+    sa.Column('location', sa.String(length=200), nullable=True),
+    sa.Column('contact', sa.String(length=50), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('services',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.Column('counter_number', sa.String(length=20), nullable=True),
+    sa.Column('avg_service_time', sa.Integer(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=80), nullable=False),
+    sa.Column('password_hash', sa.String(length=255), nullable=False),
+    sa.Column('role', sa.String(length=20), nullable=False),
+    sa.Column('organization_id', sa.Integer(), nullable=True),
+    sa.Column('service_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ),
+    sa.ForeignKeyConstraint(['service_id'], ['services.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_users_username'), ['username'], unique=True)
+
+    op.create_table('queue_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('queue_number', sa.String(length=20), nullable=False),
+    sa.Column('service_id', sa.Integer(), nullable=False),
+    sa.Column('phone_number', sa.String(length=15), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('called_at', sa.DateTime(), nullable=True),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['service_id'], ['services.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_queue_items_created_at'), ['created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_queue_items_queue_number'), ['queue_number'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_queue_items_queue_number'))
+        batch_op.drop_index(batch_op.f('ix_queue_items_created_at'))
+
+    op.drop_table('queue_items')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_username'))
+
+    op.drop_table('users')
+    op.drop_table('services')
+    op.drop_table('organizations')
@@ -0,0 +1,54 @@
+"""queue items archive
+
+Revision ID: 6b3d8f1c4e72
+Revises: 2e7a4c9d8b13
+Create Date: 2026-10-18 16:02:41.318520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b3d8f1c4e72'
+down_revision = '2e7a4c9d8b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `flask archive-queue`; ids are copied from queue_items
+    op.create_table('queue_items_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('queue_number', sa.String(length=20), nullable=False),
+    sa.Column('service_id', sa.Integer(), nullable=False),
+    sa.Column('phone_number', sa.String(length=15), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('called_at', sa.DateTime(), nullable=True),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.Column('service_day', sa.Date(), nullable=False),
+    sa.Column('ticket_seq', sa.Integer(), nullable=True),
+    sa.Column('served_by', sa.Integer(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['service_id'], ['services.id'], ),
+    sa.ForeignKeyConstraint(['served_by'], ['users.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('queue_items_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_queue_items_archive_service_status_day',
+                              ['service_id', 'status', 'service_day'], unique=False)
+
+
+def downgrade():
+    # Archived tickets are moved back before the table goes away
+    op.execute(
+        'INSERT INTO queue_items (id, queue_number, service_id, phone_number, status, '
+        'created_at, called_at, completed_at, service_day, ticket_seq, served_by) '
+        'SELECT id, queue_number, service_id, phone_number, status, created_at, '
+        'called_at, completed_at, service_day, ticket_seq, served_by FROM queue_items_archive'
+    )
+    with op.batch_alter_table('queue_items_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_queue_items_archive_service_status_day')
+
+    op.drop_table('queue_items_archive')
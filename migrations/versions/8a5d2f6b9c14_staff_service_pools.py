@@ -0,0 +1,36 @@
+"""staff service pools and queue view reset version
+
+Revision ID: 8a5d2f6b9c14
+Revises: 1e9c7a3f5d20
+Create Date: 2026-10-18 19:10:27.529613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a5d2f6b9c14'
+down_revision = '1e9c7a3f5d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('staff_service_pools',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('service_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['service_id'], ['services.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'service_id')
+    )
+    with op.batch_alter_table('service_daily_counters', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reset_seq', sa.Integer(), nullable=False,
+                                      server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('service_daily_counters', schema=None) as batch_op:
+        batch_op.drop_column('reset_seq')
+
+    op.drop_table('staff_service_pools')
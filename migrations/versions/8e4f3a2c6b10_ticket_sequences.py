@@ -0,0 +1,52 @@
+"""per-service daily ticket sequences
+
+Revision ID: 8e4f3a2c6b10
+Revises: 5c0e1b7a9d21
+Create Date: 2026-10-18 09:40:51.602337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4f3a2c6b10'
+down_revision = '5c0e1b7a9d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('service_daily_counters',
+    sa.Column('service_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('last_seq', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['service_id'], ['services.id'], ),
+    sa.PrimaryKeyConstraint('service_id', 'day')
+    )
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('service_day', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('ticket_seq', sa.Integer(), nullable=True))
+        batch_op.create_unique_constraint('uq_queue_items_service_day_seq', ['service_id', 'service_day', 'ticket_seq'])
+
+    # Existing tickets keep a NULL ticket_seq; seed today's and earlier
+    # counters from the legacy COUNT(*) numbering so new tickets continue it.
+    queue_items = sa.table('queue_items',
+                           sa.column('service_id', sa.Integer),
+                           sa.column('created_at', sa.DateTime),
+                           sa.column('service_day', sa.Date))
+    op.execute(queue_items.update().values(service_day=sa.func.date(queue_items.c.created_at)))
+    op.execute(
+        'INSERT INTO service_daily_counters (service_id, day, last_seq) '
+        'SELECT service_id, service_day, COUNT(*) FROM queue_items '
+        'WHERE service_day IS NOT NULL GROUP BY service_id, service_day'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_queue_items_service_day_seq', type_='unique')
+        batch_op.drop_column('ticket_seq')
+        batch_op.drop_column('service_day')
+
+    op.drop_table('service_daily_counters')
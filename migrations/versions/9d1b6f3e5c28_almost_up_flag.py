@@ -0,0 +1,26 @@
+"""almost up notification flag on queue_items
+
+Revision ID: 9d1b6f3e5c28
+Revises: 7c2e8b4f1a05
+Create Date: 2026-10-18 13:41:57.120834
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d1b6f3e5c28'
+down_revision = '7c2e8b4f1a05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('almost_up_notified_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.drop_column('almost_up_notified_at')
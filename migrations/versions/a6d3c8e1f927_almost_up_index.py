@@ -0,0 +1,26 @@
+"""index the almost-up flag of queue_items
+
+Revision ID: a6d3c8e1f927
+Revises: c3f7a1e9d846
+Create Date: 2026-10-18 14:20:41.806215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d3c8e1f927'
+down_revision = 'c3f7a1e9d846'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.create_index('ix_queue_items_service_status_almost_up', ['service_id', 'status', 'almost_up_notified_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_queue_items_service_status_almost_up')
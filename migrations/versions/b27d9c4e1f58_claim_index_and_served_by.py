@@ -0,0 +1,30 @@
+"""claim index and served_by on queue_items
+
+Revision ID: b27d9c4e1f58
+Revises: 8e4f3a2c6b10
+Create Date: 2026-10-18 10:21:37.940215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b27d9c4e1f58'
+down_revision = '8e4f3a2c6b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('served_by', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_queue_items_served_by_users', 'users', ['served_by'], ['id'], ondelete='SET NULL')
+        batch_op.create_index('ix_queue_items_service_status_created', ['service_id', 'status', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_queue_items_service_status_created')
+        batch_op.drop_constraint('fk_queue_items_served_by_users', type_='foreignkey')
+        batch_op.drop_column('served_by')
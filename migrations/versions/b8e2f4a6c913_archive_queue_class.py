@@ -0,0 +1,30 @@
+"""ticket class and slot of archived tickets
+
+Revision ID: b8e2f4a6c913
+Revises: e5b9d1a7c342
+Create Date: 2026-10-18 16:40:09.215734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e2f4a6c913'
+down_revision = 'e5b9d1a7c342'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tickets archived so far are recorded in the default 'standard' class
+    with op.batch_alter_table('queue_items_archive', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('queue_class', sa.String(length=20), nullable=False,
+                                      server_default='standard'))
+        batch_op.add_column(sa.Column('scheduled_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('queue_items_archive', schema=None) as batch_op:
+        batch_op.drop_column('scheduled_at')
+        batch_op.drop_column('queue_class')
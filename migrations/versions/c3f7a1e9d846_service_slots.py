@@ -0,0 +1,31 @@
+"""appointment slots
+
+Revision ID: c3f7a1e9d846
+Revises: 8a5d2f6b9c14
+Create Date: 2026-10-18 20:04:51.217390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f7a1e9d846'
+down_revision = '8a5d2f6b9c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('service_slots',
+    sa.Column('service_id', sa.Integer(), nullable=False),
+    sa.Column('starts_at', sa.DateTime(), nullable=False),
+    sa.Column('capacity', sa.Integer(), nullable=False),
+    sa.Column('booked', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['service_id'], ['services.id'], ),
+    sa.PrimaryKeyConstraint('service_id', 'starts_at')
+    )
+
+
+def downgrade():
+    op.drop_table('service_slots')
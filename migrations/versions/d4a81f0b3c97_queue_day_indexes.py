@@ -0,0 +1,36 @@
+"""composite day indexes on queue_items
+
+Revision ID: d4a81f0b3c97
+Revises: b27d9c4e1f58
+Create Date: 2026-10-18 11:02:15.337164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a81f0b3c97'
+down_revision = 'b27d9c4e1f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    queue_items = sa.table('queue_items',
+                           sa.column('created_at', sa.DateTime),
+                           sa.column('service_day', sa.Date))
+    op.execute(queue_items.update().where(queue_items.c.service_day.is_(None)).values(
+        service_day=sa.func.coalesce(sa.func.date(queue_items.c.created_at), sa.func.current_date())))
+
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.alter_column('service_day', existing_type=sa.Date(), nullable=False)
+        batch_op.create_index('ix_queue_items_service_status_day', ['service_id', 'status', 'service_day'], unique=False)
+        batch_op.create_index('ix_queue_items_service_day_created', ['service_id', 'service_day', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('queue_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_queue_items_service_day_created')
+        batch_op.drop_index('ix_queue_items_service_status_day')
+        batch_op.alter_column('service_day', existing_type=sa.Date(), nullable=True)
@@ -0,0 +1,37 @@
+"""insert time of queue events and their day index
+
+Revision ID: e5b9d1a7c342
+Revises: a6d3c8e1f927
+Create Date: 2026-10-18 15:02:17.440918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b9d1a7c342'
+down_revision = 'a6d3c8e1f927'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('queue_events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recorded_at', sa.DateTime(), nullable=True))
+
+    # Events written so far are old enough for any replay lag
+    queue_events = sa.table('queue_events',
+                            sa.column('created_at', sa.DateTime),
+                            sa.column('recorded_at', sa.DateTime))
+    op.execute(queue_events.update().values(recorded_at=queue_events.c.created_at))
+
+    with op.batch_alter_table('queue_events', schema=None) as batch_op:
+        batch_op.alter_column('recorded_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_index('ix_queue_events_day_ticket', ['service_day', 'queue_item_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('queue_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_queue_events_day_ticket')
+        batch_op.drop_column('recorded_at')
@@ -0,0 +1,36 @@
+"""service daily stats rollup
+
+Revision ID: f0c6e2d8a413
+Revises: d4a81f0b3c97
+Create Date: 2026-10-18 11:47:29.581902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f0c6e2d8a413'
+down_revision = 'd4a81f0b3c97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Maintained from here on; `flask rebuild-stats` repairs the days the
+    # queue event log covers
+    op.create_table('service_daily_stats',
+    sa.Column('service_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('served_count', sa.Integer(), nullable=False),
+    sa.Column('skipped_count', sa.Integer(), nullable=False),
+    sa.Column('wait_samples', sa.Integer(), nullable=False),
+    sa.Column('total_wait_seconds', sa.Float(), nullable=False),
+    sa.Column('total_service_seconds', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['service_id'], ['services.id'], ),
+    sa.PrimaryKeyConstraint('service_id', 'day')
+    )
+
+
+def downgrade():
+    op.drop_table('service_daily_stats')